@@ -2,6 +2,7 @@
 
 HOME_DIR=/home/elab
 ELAB_DIR=${HOME_DIR}/app/elabsheet
+GRADER_WORKERS=${GRADER_WORKERS:-1}
 
 while ! nc -z web 9001 > /dev/null; do
   echo 'Waiting for elab-web to be ready...'
@@ -11,5 +12,5 @@ done
 su -c "
   . ${HOME_DIR}/virtualenv/elab/bin/activate ve
   cd ${ELAB_DIR}
-  ./manage.py run_grader
+  ./manage.py run_grader --workers ${GRADER_WORKERS}
 " elab
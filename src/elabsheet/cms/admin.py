@@ -22,7 +22,7 @@ class SupplementInline(admin.TabularInline):
 class TaskForm(forms.ModelForm):
     class Meta:
         model = Task
-        fields = ['name','language','owner','is_private','tags','note','source','generator','text_grader']
+        fields = ['name','language','owner','is_private','stop_on_failure','tags','note','source','generator','text_grader']
     owner = forms.ModelChoiceField(queryset=User.objects.filter(is_staff=True))
 
 
@@ -0,0 +1,96 @@
+"""
+Comparison of program outputs with expected outputs.
+
+Outputs are compared after removing trailing whitespace of every line and
+of the whole output.  Outputs that differ only in letter case or only in
+whitespace are reported separately, so that students get a hint.
+"""
+import re
+
+from commons.models import TestCaseResult
+
+RE_REMOVE_WS = re.compile(r'\s')
+
+# compare_result feeds strings to the comparator in slices of this size
+CHUNK_SIZE = 65536
+
+
+def normalize(text):
+    """
+    Removes trailing whitespace of every line and of the whole text.
+    """
+    return '\n'.join([line.rstrip() for line in text.split('\n')]).rstrip()
+
+
+class PrefixMatcher:
+    """
+    Checks that the pieces of text fed to it, concatenated, form the
+    expected text.
+    """
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.pos = 0
+        self.ok = True
+
+    def feed(self, text):
+        if self.ok and text:
+            self.ok = self.expected.startswith(text, self.pos)
+            self.pos += len(text)
+
+    def matched(self):
+        return self.ok and self.pos == len(self.expected)
+
+
+class OutputComparator:
+    """
+    Compares an output, fed in chunks, with the expected output in a
+    single pass.  Only whitespace at the end of what has been fed so far
+    is kept; feed() returns False as soon as the output cannot match in
+    any way, so the rest of it need not be read.
+
+    result() gives the same TestCaseResult as comparing the whole output
+    with compare_result().
+    """
+
+    def __init__(self, expected):
+        expected = normalize(expected)
+        self.exact = PrefixMatcher(expected)
+        self.case = PrefixMatcher(expected.lower())
+        self.space = PrefixMatcher(RE_REMOVE_WS.sub('', expected))
+        self.pending = ''
+
+    def feed(self, chunk):
+        text = self.pending + chunk
+        stripped = text.rstrip()
+        # trailing whitespace is dropped unless more output follows
+        self.pending = text[len(stripped):]
+        text = '\n'.join([line.rstrip() for line in stripped.split('\n')])
+
+        self.exact.feed(text)
+        self.case.feed(text.lower())
+        self.space.feed(RE_REMOVE_WS.sub('', text))
+        return self.exact.ok or self.case.ok or self.space.ok
+
+    def result(self):
+        if self.exact.matched():
+            return TestCaseResult.PASSED
+        if self.case.matched():
+            return TestCaseResult.CASEPROBLEM
+        if self.space.matched():
+            return TestCaseResult.SPACEPROBLEM
+        return TestCaseResult.FAILED
+
+
+def compare_result(result, expected):
+    """
+    Compares output result (a string, or None when the program produced
+    no readable output) with expected output.
+    """
+    if result is None:
+        return TestCaseResult.FAILED
+    comparator = OutputComparator(expected)
+    for start in range(0, len(result), CHUNK_SIZE):
+        if not comparator.feed(result[start:start+CHUNK_SIZE]):
+            break
+    return comparator.result()
@@ -0,0 +1,258 @@
+"""
+Grading methods of tasks that need no database.
+
+Task and GradingSupplement get them from GradingMixin and SupplementMixin,
+and so do the stand-ins for them in remote graders (see grader/remote.py),
+which grade without the ORM.  Classes using GradingMixin provide language,
+code, testcases, stop_on_failure and supplement_set (whose all() returns
+SupplementMixin objects).  Classes using SupplementMixin provide
+archive_path().
+"""
+from django.conf import settings
+
+from .comparator import OutputComparator,compare_result
+from sandbox import Sandbox,SourceCode,RunStats,available_cpus,evaluate_in_parallel
+from sandbox.cache import SupplementCache,link_tree
+from sandbox.scratch import get_scratch_dir
+from commons.models import TestCaseResult
+from commons import timing
+
+
+class GradingMixin:
+
+    @staticmethod
+    def compare_result(result,expected):
+        """
+        Compare outputs from students' submission with the output from
+        the provided solution.
+
+        Currently all trailing whitespaces are removed before comparison
+        (see comparator.py).
+        """
+        return compare_result(result,expected)
+
+
+    def evaluate_built_source_with_messages(self,built_source,sandbox,
+                                            input_data,
+                                            capture=False,
+                                            comparator=None):
+
+        for supplement in self.supplement_set.all():
+            supplement.unzip_to(sandbox.get_scratch_dir())
+
+        output = sandbox.evaluate(built_source=built_source,
+                                  input_string=input_data,
+                                  capture=capture,
+                                  comparator=comparator)
+
+        messages = sandbox.get_compiler_messages()
+
+        return output,messages
+
+
+    def evaluate_testcases_with_messages(self,built_source,sandbox,
+                                         inputs,capture=False,
+                                         comparators=None):
+        """
+        Evaluates built_source against every input in inputs and returns
+        the list of outputs and the list of RunStats, both in the same
+        order as inputs, with compiler messages.
+
+        If a list of OutputComparators (one for each input) is given, the
+        outputs are compared while being read and the returned list holds
+        the fed comparators instead (see Sandbox.evaluate).
+
+        When settings.GRADER_TESTCASE_WORKERS is greater than one, the
+        inputs are evaluated in parallel (up to the number of available
+        cores), each inside a child sandbox that shares the same build.
+        """
+        workers = min(settings.GRADER_TESTCASE_WORKERS,
+                      available_cpus(),
+                      len(inputs))
+        if comparators is None:
+            comparators = [None] * len(inputs)
+        if workers <= 1:
+            outputs = []
+            stats = []
+            messages = ''
+            for input_data,comparator in zip(inputs,comparators):
+                output,messages = (
+                    self.evaluate_built_source_with_messages(
+                        built_source,
+                        sandbox,
+                        input_data,
+                        capture,
+                        comparator)
+                    )
+                outputs.append(output)
+                stats.append(sandbox.get_stats())
+            return outputs,stats,messages
+
+        # each child starts with a fresh copy of the scratch dir, which
+        # already contains the extracted supplements
+        children = []
+        try:
+            for input_data in inputs:
+                children.append(sandbox.create_child())
+            jobs = [(child,built_source,input_data,comparator)
+                    for child,input_data,comparator
+                    in zip(children,inputs,comparators)]
+            evaluated = evaluate_in_parallel(jobs,workers)
+        finally:
+            for child in children:
+                child.clean_scratch_dir()
+
+        outputs = [output for output,_ in evaluated]
+        stats = [run_stats for _,run_stats in evaluated]
+        return outputs,stats,built_source.compiler_messages
+
+
+    def evaluate_testcases_until_failure(self,built_source,sandbox,inputs,
+                                         comparators=None):
+        """
+        Like evaluate_testcases_with_messages, but evaluates the inputs
+        one by one and stops after the first one whose output does not
+        pass, so the returned lists may be shorter than inputs.
+        """
+        outputs = []
+        stats = []
+        messages = built_source.compiler_messages
+        if comparators is None:
+            comparators = [None] * len(inputs)
+        for input_data,testcase,comparator in zip(inputs,self.testcases,
+                                                  comparators):
+            output,messages = self.evaluate_built_source_with_messages(
+                built_source,
+                sandbox,
+                input_data,
+                comparator=comparator)
+            run_stats = sandbox.get_stats()
+            outputs.append(output)
+            stats.append(run_stats)
+            if not GradingMixin.judge_result(output,
+                                     testcase['output'],
+                                     run_stats).passed():
+                break
+        return outputs,stats,messages
+
+
+    @staticmethod
+    def judge_result(result,expected,stats=None):
+        """
+        Like compare_result, but reports programs killed by the sandbox for
+        exceeding the time, memory or output limit first.  result may also
+        be an OutputComparator already fed with the output.
+        """
+        if stats is not None:
+            if stats.status == RunStats.TIME_LIMIT:
+                return TestCaseResult.TIMEOUT
+            if stats.status == RunStats.MEMORY_LIMIT:
+                return TestCaseResult.MEMORY
+            if stats.status == RunStats.OUTPUT_LIMIT:
+                return TestCaseResult.OUTPUT
+        if isinstance(result,OutputComparator):
+            return result.result()
+        return GradingMixin.compare_result(result,expected)
+
+
+    def verify_with_messages(self,answer,output_list=None):
+        submitted_code = self.code.dump(answer)
+        src = SourceCode(self.language ,submitted_code)
+        results = []
+
+        sandbox = Sandbox(get_scratch_dir(),
+                          temp_subdir=True,clean_dir=False,flags=self.code.flags)
+        # extract supplements into scratch dir for compiling
+        with timing.span('supplements'):
+            for supplement in self.supplement_set.all():
+                supplement.unzip_to(sandbox.get_scratch_dir())
+        built_source = sandbox.build(src)
+
+        if not built_source.succeeded:
+            # nothing to run; every test case fails
+            sandbox.clean_scratch_dir()
+            for testcase in self.testcases:
+                results.append({'task' : self,
+                                'testcase' : testcase,
+                                'passed' : TestCaseResult.FAILED,
+                                'stats' : None})
+                if output_list!=None:
+                    output_list.append(None)
+            return results,built_source.compiler_messages
+
+        inputs = [testcase['input']+'\n' for testcase in self.testcases]
+        if output_list==None:
+            # outputs are only compared, never kept
+            comparators = [OutputComparator(testcase['output'])
+                           for testcase in self.testcases]
+        else:
+            comparators = None
+        if self.stop_on_failure:
+            outputs,stats,messages = self.evaluate_testcases_until_failure(
+                built_source,
+                sandbox,
+                inputs,
+                comparators)
+        else:
+            outputs,stats,messages = self.evaluate_testcases_with_messages(
+                built_source,
+                sandbox,
+                inputs,
+                comparators=comparators)
+
+        for i,testcase in enumerate(self.testcases):
+            this_result = {'task' : self,
+                           'testcase' : testcase}
+            if i < len(outputs):
+                output,run_stats = outputs[i],stats[i]
+                with timing.span('judge'):
+                    this_result['passed'] = GradingMixin.judge_result(output,
+                                                              testcase['output'],
+                                                              run_stats)
+            else:
+                output,run_stats = None,None
+                this_result['passed'] = TestCaseResult.NOTRUN
+            this_result['stats'] = run_stats.to_dict() if run_stats else None
+            results.append(this_result)
+            if output_list!=None:
+                output_list.append(output)
+
+        sandbox.clean_scratch_dir()
+        return results,messages
+
+
+class SupplementMixin:
+
+    def extract_to(self,path):
+        filename = self.archive_path()
+
+        if filename.endswith('zip'):
+
+            import zipfile
+            import os.path
+            import os
+
+            zf = zipfile.ZipFile(filename)
+            zf.extractall(path)
+
+        elif (filename.endswith('tar') or 
+              filename.endswith('tgz') or
+              filename.endswith('tar.gz')):
+
+            import tarfile
+
+            tf = tarfile.open(filename)
+            tf.extractall(path)
+
+    def unzip_to(self,path):
+        """
+        Puts the supplement files into path.  With
+        settings.SUPPLEMENT_CACHE_DIR, the archive is extracted only once
+        and its (read-only) files are linked into path; calling this again
+        on the same path restores only files that have been changed.
+        """
+        cache = SupplementCache.from_settings()
+        if cache:
+            link_tree(cache.get_dir(self.archive_path(),self.extract_to),path)
+        else:
+            self.extract_to(path)
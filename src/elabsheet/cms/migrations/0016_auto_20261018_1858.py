@@ -0,0 +1,31 @@
+# Generated by Django 2.0.13 on 2026-10-18 11:58
+
+import commons.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0015_auto_20190621_2125'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedGradingResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('child_key', models.CharField(blank=True, max_length=50)),
+                ('digest', models.CharField(max_length=64)),
+                ('results', commons.fields.LongJSONField(blank=True, null=True)),
+                ('compiler_messages', models.TextField(blank=True)),
+                ('last_used_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cms.Task')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='cachedgradingresult',
+            unique_together={('task', 'child_key', 'digest')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0016_auto_20261018_1858'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='stop_on_failure',
+            field=models.BooleanField(default=False, help_text='If checked, grading stops at the first failed test case and the remaining ones are marked as not run'),
+        ),
+    ]
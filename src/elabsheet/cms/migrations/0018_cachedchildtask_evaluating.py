@@ -0,0 +1,23 @@
+# Generated by Django 2.0.13 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0017_task_stop_on_failure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cachedchildtask',
+            name='evaluating_by',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='cachedchildtask',
+            name='evaluating_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,25 +1,33 @@
-import re
 import os
+import time
+import socket
 import inspect
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
 from django.db.utils import IntegrityError
 from django.template import Context,Template
 from django.conf import settings
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.files.base import ContentFile
 from django.core.exceptions import ValidationError
 from django.dispatch import receiver
 
 from .markdown_processor import process_markdown_source,insert_test_dialog
+from .grading import GradingMixin,SupplementMixin
 from .elab import Code
 from sandbox import Sandbox,SourceCode
+from sandbox.cache import SupplementCache
+from sandbox.scratch import get_scratch_dir
 from .fields import CodeField
 from commons.fields import LongJSONField
 from commons.models import TestCaseResult
 
 LANGS = ((x,x) for x in Sandbox.get_languages())
 
-RE_REMOVE_WS = re.compile(r'\s')
+# seconds between checks of whether another grader has evaluated the test
+# cases of a child task
+CHILD_TASK_POLL_INTERVAL = 0.5
 
 
 class TagManager(models.Manager):
@@ -55,7 +63,7 @@ class InvalidGenerator(Exception):
 class InvalidTextGrader(Exception):
     pass
 
-class Task(models.Model):
+class Task(GradingMixin,models.Model):
     """
     Task is a central model for E-Labsheet.
 
@@ -97,6 +105,10 @@ class Task(models.Model):
     is_private = models.BooleanField(default=False,
                 help_text='If checked, this task becomes private to its creator '
                           'and owner')
+
+    stop_on_failure = models.BooleanField(default=False,
+                help_text='If checked, grading stops at the first failed test '
+                          'case and the remaining ones are marked as not run')
     
     # simplest way to implement tags
     tags = models.CharField(max_length=200,
@@ -182,78 +194,9 @@ class Task(models.Model):
         return sum([blank['score'] for blank in self.textblanks])
 
     ###########################
-    # Methods for grading
+    # Methods for grading (see also GradingMixin)
     #
 
-    @staticmethod
-    def compare_result(result,expected):
-        """
-        Compare outputs from students' submission with the output from
-        the provided solution.
-
-        Currently all trailing whitespaces are removed before comparison.
-        """
-        if result is None:
-            return TestCaseResult.FAILED
-        result = '\n'.join([line.rstrip() for line in result.split('\n')])
-        expected = '\n'.join([line.rstrip() for line in expected.split('\n')])
-        if result.rstrip() == expected.rstrip():
-            return TestCaseResult.PASSED
-        if result.rstrip().lower() == expected.rstrip().lower():
-            return TestCaseResult.CASEPROBLEM
-        if RE_REMOVE_WS.sub('',result) == RE_REMOVE_WS.sub('',expected):
-            return TestCaseResult.SPACEPROBLEM
-        return TestCaseResult.FAILED
-
-
-    def evaluate_built_source_with_messages(self,built_source,sandbox,
-                                            input_data,
-                                            capture=False):
-
-        for supplement in self.supplement_set.all():
-            supplement.unzip_to(sandbox.get_scratch_dir())
-
-        output = sandbox.evaluate(built_source=built_source,
-                                  input_string=input_data,
-                                  capture=capture)
-
-        messages = sandbox.get_compiler_messages()
-
-        return output,messages
-
-
-    def verify_with_messages(self,answer,output_list=None):
-        submitted_code = self.code.dump(answer)
-        src = SourceCode(self.language ,submitted_code)
-        results = []
-        messages = ''
-
-        sandbox = Sandbox(settings.SANDBOX_SCRATCH_DIR,
-                          temp_subdir=True,clean_dir=False,flags=self.code.flags)
-        # extract supplements into scratch dir for compiling
-        for supplement in self.supplement_set.all():
-            supplement.unzip_to(sandbox.get_scratch_dir())
-        built_source = sandbox.build(src)
-
-        for testcase in self.testcases:
-            output,messages = (
-                self.evaluate_built_source_with_messages(
-                    built_source,
-                    sandbox,
-                    testcase['input']+'\n')
-                )
-
-            this_result = {'task' : self,
-                           'testcase' : testcase}
-            this_result['passed'] = Task.compare_result(output,testcase['output'])
-            results.append(this_result)
-            if output_list!=None:
-                output_list.append(output)
-
-        sandbox.clean_scratch_dir()
-        return results,messages
-
-
     def verify(self,answer,output_list=None):
         results,messages = self.verify_with_messages(answer,output_list)
         return results
@@ -299,15 +242,22 @@ class Task(models.Model):
     def run_testcases(self):
         solution = self.code.dump_solution()
         src = SourceCode(self.language,solution)
-        sandbox = Sandbox(settings.SANDBOX_SCRATCH_DIR,
+        sandbox = Sandbox(get_scratch_dir(),
                           temp_subdir=True,clean_dir=False,flags=self.code.flags)
-        # extract supplements into scratch dir for compiling
-        for supplement in self.supplement_set.all():
-            supplement.unzip_to(sandbox.get_scratch_dir())
-        built_source = sandbox.build(src)
-
-        for test in self.testcases:
-            test['output'] = self.run_testcase(built_source,sandbox,test['input'])
+        try:
+            # extract supplements into scratch dir for compiling
+            for supplement in self.supplement_set.all():
+                supplement.unzip_to(sandbox.get_scratch_dir())
+            built_source = sandbox.build(src)
+
+            outputs,stats,messages = self.evaluate_testcases_with_messages(
+                built_source,
+                sandbox,
+                [test['input']+'\n' for test in self.testcases])
+        finally:
+            sandbox.clean_scratch_dir()
+        for test,output in zip(self.testcases,outputs):
+            test['output'] = output
    
     def build_from_source(self,run_testcases=True):
         """
@@ -386,8 +336,9 @@ class Task(models.Model):
         self.preprocess_tags()
         super(Task,self).save(force_insert,force_update)
 
-        # delete all associated cached child tasks
+        # delete all associated cached child tasks and grading results
         CachedChildTask.objects.filter(parent_task=self).delete()
+        CachedGradingResult.objects.filter(task=self).delete()
 
     def compile_generator(self):
         if not self.generator:
@@ -698,7 +649,7 @@ class TextBlank:
                 .replace('\n','<cr>')
 
 
-class GradingSupplement(models.Model):
+class GradingSupplement(SupplementMixin,models.Model):
     """
     Stores supplemental files to be unzipped and copied to sandbox
     when evaluating submissions.  Currently, the original filename is
@@ -709,26 +660,8 @@ class GradingSupplement(models.Model):
     task = models.ForeignKey(Task,related_name='supplement_set',on_delete=models.CASCADE)
     data_file = models.FileField(upload_to='supplements/%Y/%m/%d')
 
-    def unzip_to(self,path):
-        filename = self.data_file.path
-
-        if filename.endswith('zip'):
-
-            import zipfile
-            import os.path
-            import os
-
-            zf = zipfile.ZipFile(filename)
-            zf.extractall(path)
-
-        elif (filename.endswith('tar') or 
-              filename.endswith('tgz') or
-              filename.endswith('tar.gz')):
-
-            import tarfile
-
-            tf = tarfile.open(filename)
-            tf.extractall(path)
+    def archive_path(self):
+        return self.data_file.path
 
     def clone(self):
         import os.path
@@ -756,6 +689,9 @@ def auto_delete_supplement(sender,instance,**kwargs):
     deleted
     """
     if instance.data_file:
+        cache = SupplementCache.from_settings()
+        if cache:
+            cache.remove(instance.data_file.path)
         instance.data_file.delete(save=False)
 
 
@@ -863,15 +799,68 @@ class ChildTask(Task):
     def save(self,force_insert=False,force_update=False):
         raise ChildTaskException('ChildTask must not be saved')
 
+    def evaluate_testcases_once(self):
+        '''
+        Makes sure that expected outputs of test cases are available.  They
+        are computed only once for each cached child task: a grader marks
+        the cached row as being evaluated by itself for up to
+        settings.CHILD_TASK_EVALUATION_TIMEOUT seconds, runs the solution
+        outside any transaction and stores the outputs.  Other graders
+        grading the same child task meanwhile poll the row for the outputs,
+        and run the solution themselves (without caching the outputs) if
+        they are not ready in time.
+        '''
+        if self.testcases_evaluated:
+            return
+        timeout = settings.CHILD_TASK_EVALUATION_TIMEOUT
+        wait_until = time.monotonic() + timeout
+        evaluator = '%s:%d' % (socket.gethostname(),os.getpid())
+        while True:
+            now = timezone.now()
+            marked = (CachedChildTask.objects
+                      .filter(pk=self.cache.pk,testcases_evaluated=False)
+                      .filter(Q(evaluating_until__isnull=True)|
+                              Q(evaluating_until__lt=now))
+                      .update(evaluating_by=evaluator,
+                              evaluating_until=now+timezone.timedelta(seconds=timeout)))
+            if marked:
+                try:
+                    self.run_testcases()
+                except:
+                    (CachedChildTask.objects
+                     .filter(pk=self.cache.pk,evaluating_by=evaluator)
+                     .update(evaluating_by='',evaluating_until=None))
+                    raise
+                return
+
+            try:
+                cache = CachedChildTask.objects.get(pk=self.cache.pk)
+            except CachedChildTask.DoesNotExist:
+                # the parent task has just been changed; the outputs
+                # can't be cached
+                Task.run_testcases(self)
+                return
+            if cache.testcases_evaluated:
+                cache.populate_childtask(self)
+                return
+            if time.monotonic() >= wait_until:
+                # the grader evaluating it may be stuck
+                Task.run_testcases(self)
+                return
+            time.sleep(CHILD_TASK_POLL_INTERVAL)
+
     def run_testcases(self):
         super().run_testcases()
+        self.testcases_evaluated = True
         self.cache.testcases = self.testcases
         self.cache.testcases_evaluated = True
+        self.cache.evaluating_by = ''
+        self.cache.evaluating_until = None
         self.cache.save()
 
     def verify_with_messages(self,answer,output_list=None):
         # generate testcases' results before verifying the answer
-        self.run_testcases()
+        self.evaluate_testcases_once()
         return super().verify_with_messages(answer,output_list)
 
 
@@ -888,6 +877,11 @@ class CachedChildTask(models.Model):
     testcases = LongJSONField(blank=True, null=True)
     textblanks = LongJSONField(blank=True, null=True)
     testcases_evaluated = models.BooleanField(default=False)
+    # the grader running the solution to evaluate the test cases, and
+    # until when other graders wait for it (see
+    # ChildTask.evaluate_testcases_once)
+    evaluating_by = models.CharField(max_length=100,blank=True,default='')
+    evaluating_until = models.DateTimeField(blank=True,null=True)
 
     class Meta:
         index_together = [
@@ -914,3 +908,105 @@ class CachedChildTask(models.Model):
         childtask.textblanks = self.textblanks
         childtask.testcases_evaluated = self.testcases_evaluated
         childtask.cache = self
+
+
+class CachedGradingResult(models.Model):
+    """
+    Stores results of grading submitted code, so that identical code
+    submitted again (or regraded) to the same task is not evaluated again.
+    Results are identified by the task (and child task key for super
+    tasks) and a digest of the code and grading supplements.  They are
+    deleted whenever the task is saved.
+
+    At most settings.GRADING_RESULT_CACHE_SIZE results are kept; the least
+    recently used ones are removed first.
+    """
+    task = models.ForeignKey(Task,on_delete=models.CASCADE)
+    child_key = models.CharField(max_length=50,blank=True)
+    digest = models.CharField(max_length=64)
+    # test case results as stored by TestCaseResult.to_db()
+    results = LongJSONField(blank=True,null=True)
+    compiler_messages = models.TextField(blank=True)
+    last_used_at = models.DateTimeField(auto_now=True,db_index=True)
+
+    class Meta:
+        unique_together = [
+            ["task","child_key","digest"],
+        ]
+
+    def __str__(self):
+        return '{} | {} | {}'.format(self.task, self.child_key, self.digest)
+
+    def get_results(self):
+        return [TestCaseResult.create_from_db(r) for r in self.results]
+
+    @staticmethod
+    def enabled():
+        return settings.GRADING_RESULT_CACHE_SIZE > 0
+
+    @staticmethod
+    def get_child_key(task):
+        if task.is_childtask():
+            return ChildTask.generate_key(task.seed,task.difficulty)
+        return ''
+
+    @staticmethod
+    def get_digest(task,answer):
+        import hashlib
+        h = hashlib.sha256()
+        h.update(task.language.encode('utf-8'))
+        h.update(b'\0')
+        h.update(task.code.dump(answer).encode('utf-8'))
+        for supplement in task.supplement_set.order_by('id'):
+            h.update(b'\0')
+            h.update(supplement.data_file.name.encode('utf-8'))
+            try:
+                st = os.stat(supplement.data_file.path)
+                h.update(('%d:%d' % (st.st_size,st.st_mtime_ns)).encode('utf-8'))
+            except OSError:
+                pass
+        return h.hexdigest()
+
+    @staticmethod
+    def lookup(task,answer):
+        """
+        Returns the cached result of grading answer for task, or None.
+        """
+        try:
+            cached = CachedGradingResult.objects.get(
+                    task_id=task.id,
+                    child_key=CachedGradingResult.get_child_key(task),
+                    digest=CachedGradingResult.get_digest(task,answer))
+        except CachedGradingResult.DoesNotExist:
+            return None
+        # mark as recently used
+        cached.save(update_fields=['last_used_at'])
+        return cached
+
+    @staticmethod
+    def store(task,answer,results,compiler_messages):
+        """
+        Caches results (a list of TestCaseResult) and compiler messages
+        of grading answer for task.
+        """
+        try:
+            with transaction.atomic():
+                CachedGradingResult.objects.create(
+                        task_id=task.id,
+                        child_key=CachedGradingResult.get_child_key(task),
+                        digest=CachedGradingResult.get_digest(task,answer),
+                        results=[r.to_db() for r in results],
+                        compiler_messages=compiler_messages)
+        except IntegrityError:
+            # another grader has just graded the same code
+            return
+        CachedGradingResult.trim(settings.GRADING_RESULT_CACHE_SIZE)
+
+    @staticmethod
+    def trim(size):
+        excess = CachedGradingResult.objects.count() - size
+        if excess > 0:
+            ids = list(CachedGradingResult.objects
+                       .order_by('last_used_at')
+                       .values_list('id',flat=True)[:excess])
+            CachedGradingResult.objects.filter(id__in=ids).delete()
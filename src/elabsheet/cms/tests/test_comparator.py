@@ -0,0 +1,72 @@
+import re
+import random
+from django.test import SimpleTestCase
+from cms.comparator import OutputComparator, compare_result
+from commons.models import TestCaseResult
+
+RE_REMOVE_WS = re.compile(r'\s')
+
+def compare_whole(result,expected):
+    """
+    Compares whole outputs, as done before outputs were compared in
+    chunks.
+    """
+    if result is None:
+        return TestCaseResult.FAILED
+    result = '\n'.join([line.rstrip() for line in result.split('\n')])
+    expected = '\n'.join([line.rstrip() for line in expected.split('\n')])
+    if result.rstrip() == expected.rstrip():
+        return TestCaseResult.PASSED
+    if result.rstrip().lower() == expected.rstrip().lower():
+        return TestCaseResult.CASEPROBLEM
+    if RE_REMOVE_WS.sub('',result) == RE_REMOVE_WS.sub('',expected):
+        return TestCaseResult.SPACEPROBLEM
+    return TestCaseResult.FAILED
+
+def compare_in_chunks(result,expected,chunk_size):
+    comparator = OutputComparator(expected)
+    for start in range(0,len(result),chunk_size):
+        comparator.feed(result[start:start+chunk_size])
+    return comparator.result()
+
+
+class ComparatorTestCase(SimpleTestCase):
+
+    def test_results(self):
+        expected = "Hello World\n1 2 3\n"
+        self.assertIs(compare_result("Hello World  \n1 2 3\n\n\n",expected),
+                      TestCaseResult.PASSED)
+        self.assertIs(compare_result("hello world\n1 2 3",expected),
+                      TestCaseResult.CASEPROBLEM)
+        self.assertIs(compare_result("HelloWorld\n1  2\t3\n",expected),
+                      TestCaseResult.SPACEPROBLEM)
+        self.assertIs(compare_result("Hello World\n1 2 3 4\n",expected),
+                      TestCaseResult.FAILED)
+        self.assertIs(compare_result(None,expected),TestCaseResult.FAILED)
+        self.assertIs(compare_result("",""),TestCaseResult.PASSED)
+        self.assertIs(compare_result(" \n\n",""),TestCaseResult.PASSED)
+
+    def test_early_exit(self):
+        comparator = OutputComparator("1\n2\n")
+        self.assertTrue(comparator.feed("1\n"))
+        self.assertFalse(comparator.feed("3"))
+        self.assertIs(comparator.result(),TestCaseResult.FAILED)
+
+    def test_same_as_whole_comparison(self):
+        rand = random.Random(12)
+        alphabet = ['a','A','b',' ','\t','\n','\r','1']
+        for i in range(2000):
+            expected = ''.join(rand.choice(alphabet)
+                               for _ in range(rand.randint(0,8)))
+            if rand.random() < 0.5:
+                # derive the output from the expected one
+                result = ''.join(c.swapcase() if rand.random() < 0.1 else
+                                 c+' ' if rand.random() < 0.1 else c
+                                 for c in expected)
+            else:
+                result = ''.join(rand.choice(alphabet)
+                                 for _ in range(rand.randint(0,8)))
+            chunk_size = rand.randint(1,4)
+            self.assertIs(compare_in_chunks(result,expected,chunk_size),
+                          compare_whole(result,expected),
+                          (result,expected,chunk_size))
@@ -1,5 +1,11 @@
-from django.test import TestCase
-from cms.models import Task
+import os
+import shutil
+import tempfile
+from unittest import mock
+from django.test import TestCase, override_settings
+from django.core.files.base import ContentFile
+from cms.models import Task, GradingSupplement, CachedGradingResult
+from commons.models import TestCaseResult
 
 ######################
 MD_PYTHON3_WITH_TEST_CASES = """\
@@ -22,6 +28,76 @@ print(x+y)
 5
 ::elab:endtest"""
 
+######################
+MD_PYTHON3_WITH_BLANK_AND_TEST_CASES = """\
+Test Cases with Blank
+=====================
+
+::elab:begincode language="python3"
+x = int(input())
+print({{x*2}})
+::elab:endcode
+
+::elab:begintest
+1
+::elab:endtest
+
+::elab:begintest
+2
+::elab:endtest
+
+::elab:begintest
+3
+::elab:endtest
+
+::elab:begintest
+4
+::elab:endtest"""
+
+SUB_ONLY_EVEN_PASSED = {0:"x*2 if x%2==0 else 0"}
+
+######################
+MD_C_WITH_BLANK_AND_TEST_CASES = """\
+Test Cases in C
+===============
+
+::elab:begincode language="c"
+#include <stdio.h>
+int main()
+{
+  int x;
+  scanf("%d",&x);
+  printf("%d\\n",{{x+1}});
+  return 0;
+}
+::elab:endcode
+
+::elab:begintest
+1
+::elab:endtest
+
+::elab:begintest
+2
+::elab:endtest"""
+
+######################
+MD_PYTHON3_WITH_SUPPLEMENT = """\
+Test Cases with Supplement
+==========================
+
+::elab:begincode language="python3"
+x = int(input())
+print(open('data/a.txt').read().strip()*x)
+::elab:endcode
+
+::elab:begintest
+1
+::elab:endtest
+
+::elab:begintest
+3
+::elab:endtest"""
+
 ######################
 MD_CODE_BLANKS_BLOCK = """\
 Code Blanks - Block
@@ -159,6 +235,244 @@ class TestTestCase(TestCase):
         self.assertEqual(sols[0]['output'],"12\n")
         self.assertEqual(sols[1]['output'],"7\n")
 
+    def test_scratch_dir_cleaned(self):
+        scratch_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,scratch_dir)
+        with override_settings(SANDBOX_SCRATCH_DIR=scratch_dir):
+            task = Task(name="Dummy",source=MD_PYTHON3_WITH_TEST_CASES,language="python3")
+            task.save()
+            task.verify({})
+        self.assertEqual(os.listdir(scratch_dir),[])
+
+    @override_settings(GRADER_TESTCASE_WORKERS=4)
+    def test_parallel_testcases(self):
+        with mock.patch('cms.grading.available_cpus',return_value=4):
+            task = Task(name="Dummy",
+                        source=MD_PYTHON3_WITH_BLANK_AND_TEST_CASES,
+                        language="python3")
+            task.save()
+            self.assertEqual([t['output'] for t in task.testcases],
+                             ["2\n","4\n","6\n","8\n"])
+            outputs = []
+            results = task.verify(SUB_ONLY_EVEN_PASSED,outputs)
+        self.assertEqual([r['passed'] for r in results],[
+            TestCaseResult.FAILED,
+            TestCaseResult.PASSED,
+            TestCaseResult.FAILED,
+            TestCaseResult.PASSED,
+            ])
+        self.assertEqual(outputs,["0\n","4\n","0\n","8\n"])
+
+    def test_run_stats(self):
+        task = Task(name="Dummy",source=MD_PYTHON3_WITH_TEST_CASES,language="python3")
+        task.save()
+        results = task.verify({})
+        for result in results:
+            self.assertEqual(result['stats']['status'],'ok')
+            self.assertGreater(result['stats']['mem'],0)
+            self.assertGreater(result['stats']['user']+result['stats']['sys'],0)
+
+    @override_settings(SANDBOX_EXECUTOR='shell')
+    def test_shell_executor(self):
+        task = Task(name="Dummy",source=MD_PYTHON3_WITH_TEST_CASES,language="python3")
+        task.save()
+        self.assertEqual([t['output'] for t in task.testcases],["12\n","7\n"])
+
+    @override_settings(PYTHON_FORKSERVER=True)
+    def test_python_forkserver(self):
+        task = Task(name="Dummy",source=MD_PYTHON3_WITH_BLANK_AND_TEST_CASES,language="python3")
+        task.save()
+        import sandbox
+        with mock.patch('sandbox.run_script',wraps=sandbox.run_script) as run_script:
+            results = task.verify({0:"x*2"})
+        self.assertEqual(run_script.call_count,4)
+        self.assertEqual([r['passed'] for r in results],[TestCaseResult.PASSED]*4)
+
+    def test_testcases_evaluated_in_threads(self):
+        task = Task(name="Dummy",
+                    source=MD_PYTHON3_WITH_BLANK_AND_TEST_CASES,
+                    language="python3")
+        task.save()
+        with override_settings(GRADER_TESTCASE_WORKERS=4,
+                               SANDBOX_EXECUTOR='subprocess'), \
+             mock.patch('cms.grading.available_cpus',return_value=4), \
+             mock.patch('multiprocessing.get_context') as get_context:
+            results = task.verify({0:"x*2"})
+        get_context.assert_not_called()
+        self.assertEqual([r['passed'] for r in results],[TestCaseResult.PASSED]*4)
+
+    def test_phase_timing(self):
+        from commons import timing
+        task = Task(name="Dummy",
+                    source=MD_PYTHON3_WITH_BLANK_AND_TEST_CASES,
+                    language="python3")
+        task.save()
+        timing.start()
+        try:
+            task.verify({0:"x*2"})
+        finally:
+            recorded = timing.stop()
+        self.assertEqual(recorded.phases['build'][1],1)
+        self.assertEqual(recorded.phases['run'][1],4)
+        self.assertEqual(recorded.phases['compare'][1],4)
+        self.assertEqual(recorded.phases['judge'][1],4)
+
+    def test_build_cache(self):
+        from sandbox.builders import CBuilder
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,cache_dir)
+        with override_settings(SANDBOX_BUILD_CACHE_DIR=cache_dir):
+            task = Task(name="Dummy",
+                        source=MD_C_WITH_BLANK_AND_TEST_CASES,
+                        language="c")
+            task.save()
+            self.assertEqual([t['output'] for t in task.testcases],
+                             ["2\n","3\n"])
+            self.assertEqual(len(os.listdir(cache_dir)),1)
+
+            with mock.patch.object(CBuilder,'build') as build:
+                # same code as the solution
+                results,messages = task.verify_with_messages({0:"x+1"})
+            build.assert_not_called()
+            self.assertEqual([r['passed'] for r in results],
+                             [TestCaseResult.PASSED,TestCaseResult.PASSED])
+
+            # compiler messages refer to the scratch dir of each sandbox
+            results,messages1 = task.verify_with_messages({0:"x+"})
+            results,messages2 = task.verify_with_messages({0:"x+"})
+            self.assertEqual(len(os.listdir(cache_dir)),2)
+            self.assertIn('source.c',messages1)
+            self.assertNotEqual(messages1,messages2)
+            self.assertEqual(messages1.split('source.c')[-1],
+                             messages2.split('source.c')[-1])
+
+
+    def test_build_failure(self):
+        from sandbox import Sandbox
+        task = Task(name="Dummy",
+                    source=MD_C_WITH_BLANK_AND_TEST_CASES,
+                    language="c")
+        task.save()
+        with mock.patch.object(Sandbox,'evaluate') as evaluate:
+            results,messages = task.verify_with_messages({0:"x+"})
+        evaluate.assert_not_called()
+        self.assertIn('error',messages)
+        self.assertEqual([r['passed'] for r in results],
+                         [TestCaseResult.FAILED,TestCaseResult.FAILED])
+
+    def test_stop_on_failure(self):
+        task = Task(name="Dummy",
+                    source=MD_PYTHON3_WITH_BLANK_AND_TEST_CASES,
+                    language="python3",
+                    stop_on_failure=True)
+        task.save()
+        results = task.verify({0:"x*2 if x<2 else 0"})
+        self.assertEqual([r['passed'] for r in results],
+                         [TestCaseResult.PASSED,TestCaseResult.FAILED,
+                          TestCaseResult.NOTRUN,TestCaseResult.NOTRUN])
+        results = task.verify({0:"x*2"})
+        self.assertEqual([r['passed'] for r in results],[TestCaseResult.PASSED]*4)
+
+    def test_long_output(self):
+        task = Task(name="Dummy",
+                    source=MD_PYTHON3_WITH_BLANK_AND_TEST_CASES
+                        .replace("print({{x*2}})","print('a'*{{x*2}})")
+                        .replace("4\n::elab:endtest","750000\n::elab:endtest"),
+                    language="python3")
+        task.save()
+        self.assertEqual(len(task.testcases[-1]['output']),1000000)
+        results = task.verify({0:"x*2"})
+        self.assertEqual([r['passed'] for r in results],[TestCaseResult.PASSED]*4)
+
+    def test_supplement_cache(self):
+        import io
+        import zipfile
+        media_root = tempfile.mkdtemp()
+        cache_dir = tempfile.mkdtemp()
+        scratch_dir = tempfile.mkdtemp()
+        for d in [media_root,cache_dir,scratch_dir]:
+            self.addCleanup(shutil.rmtree,d)
+        zip_data = io.BytesIO()
+        with zipfile.ZipFile(zip_data,'w') as zf:
+            zf.writestr('data/a.txt','ab\n')
+
+        with override_settings(MEDIA_ROOT=media_root,
+                               SUPPLEMENT_CACHE_DIR=cache_dir):
+            task = Task(name="Dummy",
+                        source=MD_PYTHON3_WITH_SUPPLEMENT,
+                        language="python3")
+            task.save()
+            supplement = GradingSupplement(task=task)
+            supplement.data_file.save('data.zip',ContentFile(zip_data.getvalue()))
+            task.save()
+            self.assertEqual([t['output'] for t in task.testcases],
+                             ["ab\n","ababab\n"])
+            self.assertEqual(len(os.listdir(cache_dir)),1)
+
+            with mock.patch.object(GradingSupplement,'extract_to') as extract:
+                supplement.unzip_to(scratch_dir)
+            extract.assert_not_called()
+            scratch_file = os.path.join(scratch_dir,'data','a.txt')
+            cached_file = os.path.join(cache_dir,os.listdir(cache_dir)[0],
+                                       'data','a.txt')
+            # without box, programs could change linked cached files
+            self.assertFalse(os.path.samefile(scratch_file,cached_file))
+            os.chmod(scratch_file,0o644)
+            with open(scratch_file,'w') as f:
+                f.write('changed')
+            supplement.unzip_to(scratch_dir)
+            for filename in [scratch_file,cached_file]:
+                with open(filename) as f:
+                    self.assertEqual(f.read(),'ab\n')
+
+            # a changed file gets restored
+            with override_settings(USE_BOX_IN_SANDBOX=True):
+                shutil.rmtree(os.path.join(scratch_dir,'data'))
+                supplement.unzip_to(scratch_dir)
+                self.assertTrue(os.path.samefile(scratch_file,cached_file))
+                os.remove(scratch_file)
+                with open(scratch_file,'w') as f:
+                    f.write('changed')
+                supplement.unzip_to(scratch_dir)
+                self.assertTrue(os.path.samefile(scratch_file,cached_file))
+
+            supplement.delete()
+            self.assertEqual(os.listdir(cache_dir),[])
+
+
+@override_settings(GRADING_RESULT_CACHE_SIZE=2)
+class CachedGradingResultTestCase(TestCase):
+
+    PASSED = [TestCaseResult.PASSED]*4
+    FAILED = [TestCaseResult.FAILED]*4
+
+    def setUp(self):
+        self.task = Task(name="Dummy",
+                         source=MD_PYTHON3_WITH_BLANK_AND_TEST_CASES,
+                         language="python3")
+        self.task.save()
+
+    def test_lookup(self):
+        self.assertIsNone(CachedGradingResult.lookup(self.task,{0:"x*2"}))
+        CachedGradingResult.store(self.task,{0:"x*2"},self.PASSED,'')
+        cached = CachedGradingResult.lookup(self.task,{0:"x*2"})
+        self.assertEqual([r.passed() for r in cached.get_results()],[True]*4)
+        self.assertIsNone(CachedGradingResult.lookup(self.task,{0:"x*3"}))
+
+    def test_invalidated_on_task_save(self):
+        CachedGradingResult.store(self.task,{0:"x*2"},self.PASSED,'')
+        self.task.save()
+        self.assertIsNone(CachedGradingResult.lookup(self.task,{0:"x*2"}))
+
+    def test_least_recently_used_removed(self):
+        CachedGradingResult.store(self.task,{0:"x*2"},self.PASSED,'')
+        CachedGradingResult.store(self.task,{0:"x*3"},self.FAILED,'')
+        CachedGradingResult.lookup(self.task,{0:"x*2"})
+        CachedGradingResult.store(self.task,{0:"x*4"},self.FAILED,'')
+        self.assertEqual(CachedGradingResult.objects.count(),2)
+        self.assertIsNotNone(CachedGradingResult.lookup(self.task,{0:"x*2"}))
+        self.assertIsNone(CachedGradingResult.lookup(self.task,{0:"x*3"}))
+
 
 class TaskModelTestCase(TestCase):
 
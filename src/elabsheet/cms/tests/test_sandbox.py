@@ -0,0 +1,509 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+from unittest import mock
+from django.test import SimpleTestCase, override_settings
+from cms.models import Task
+from commons.models import TestCaseResult
+from sandbox import RunStats, Sandbox, SourceCode
+
+BOX_OUTPUT_OK = """\
+OK
+0.0000r0.0120u0.0040s5244m
+"""
+
+BOX_OUTPUT_TIMEOUT = """\
+Time limit exceeded.
+2.0000r1.9980u0.0010s5244m
+"""
+
+BOX_OUTPUT_MEMORY = """\
+Exited with error status 1.
+0.0000r0.0500u0.0400s31200m
+"""
+
+class RunStatsTestCase(SimpleTestCase):
+
+    def test_parse_box_output(self):
+        stats = RunStats.from_box_output(BOX_OUTPUT_OK,32768)
+        self.assertEqual(stats.to_dict(),{
+            'status': RunStats.OK,
+            'wall': 0.0,
+            'user': 0.012,
+            'sys': 0.004,
+            'mem': 5244,
+            })
+
+    def test_parse_box_limits(self):
+        self.assertEqual(RunStats.from_box_output(BOX_OUTPUT_TIMEOUT,32768).status,
+                         RunStats.TIME_LIMIT)
+        self.assertEqual(RunStats.from_box_output(BOX_OUTPUT_MEMORY,32768).status,
+                         RunStats.MEMORY_LIMIT)
+        # far below the limit, it is just a runtime error
+        self.assertEqual(RunStats.from_box_output(BOX_OUTPUT_MEMORY,327680).status,
+                         RunStats.ERROR)
+        self.assertEqual(RunStats.from_box_output('').status,RunStats.ERROR)
+
+    def test_judge_result(self):
+        self.assertIs(Task.judge_result('1\n','1\n',RunStats()),
+                      TestCaseResult.PASSED)
+        self.assertIs(Task.judge_result('1\n','1\n',
+                                        RunStats(status=RunStats.TIME_LIMIT)),
+                      TestCaseResult.TIMEOUT)
+        self.assertIs(Task.judge_result('','1\n',
+                                        RunStats(status=RunStats.MEMORY_LIMIT)),
+                      TestCaseResult.MEMORY)
+        self.assertIs(Task.judge_result('','1\n',
+                                        RunStats(status=RunStats.ERROR)),
+                      TestCaseResult.FAILED)
+        self.assertIs(Task.judge_result('1\n','1\n',
+                                        RunStats(status=RunStats.OUTPUT_LIMIT)),
+                      TestCaseResult.OUTPUT)
+
+
+@override_settings(PYTHON_FORKSERVER=True,BUILDERS={'python3':sys.executable})
+class ForkServerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.scratch_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.scratch_dir)
+
+    def evaluate(self, body, input_string='', **kwargs):
+        sandbox = Sandbox(self.scratch_dir,use_box=False,build_cache=False,
+                          flags={'build':'','run':''},**kwargs)
+        built_source = sandbox.build(SourceCode('python3',body))
+        self.assertIsNotNone(built_source.forkserver_args)
+        output = sandbox.evaluate(built_source=built_source,
+                                  input_string=input_string)
+        return output, sandbox.get_stats()
+
+    def test_output(self):
+        output, stats = self.evaluate(
+            "import os\n"
+            "x = int(input())\n"
+            "print(x*2, __name__, os.environ['ELAB_GRADING'])\n",
+            "21\n")
+        self.assertEqual(output,"42 __main__ 1\n")
+        self.assertEqual(stats.status,RunStats.OK)
+
+    def test_not_used_with_isolating_executor(self):
+        from sandbox.executors import SubprocessExecutor
+        executor = SubprocessExecutor()
+        executor.isolated = True
+        with mock.patch('sandbox.run_script') as run_script:
+            output, stats = self.evaluate("print(input())\n","1\n",
+                                          executor=executor)
+        run_script.assert_not_called()
+        self.assertEqual(output,"1\n")
+
+    def test_errors_and_limits(self):
+        output, stats = self.evaluate("print(1)\nraise ValueError()\n")
+        self.assertEqual(output,"1\n")
+        self.assertEqual(stats.status,RunStats.ERROR)
+
+        output, stats = self.evaluate("while True: pass\n",time_limit=0.3)
+        self.assertEqual(stats.status,RunStats.TIME_LIMIT)
+
+        output, stats = self.evaluate("x = 'a' * (200*1024*1024)\n",
+                                      memory_limit=100)
+        self.assertEqual(stats.status,RunStats.MEMORY_LIMIT)
+
+        # exit statuses are the program's own
+        for program in ["import sys\nsys.exit(125)\n","exit(125)\n"]:
+            output, stats = self.evaluate(program)
+            self.assertEqual(stats.status,RunStats.ERROR)
+
+    def test_not_used_in_pool_processes(self):
+        from sandbox import _evaluate_job_in_process
+        from commons import metrics
+        self.addCleanup(setattr,metrics.registry,'autoflush',
+                        metrics.registry.autoflush)
+        sandbox = Sandbox(self.scratch_dir,use_box=False,build_cache=False,
+                          flags={'build':'','run':''})
+        built_source = sandbox.build(SourceCode('python3',"print(input())\n"))
+        with mock.patch('sandbox.run_script') as run_script:
+            output, stats, values, phases = _evaluate_job_in_process(
+                    (sandbox,built_source,"1\n",None))
+        run_script.assert_not_called()
+        self.assertEqual(output,"1\n")
+
+    def test_random_state_not_shared(self):
+        program = "import random\nprint(random.random())\n"
+        first, _ = self.evaluate(program)
+        second, _ = self.evaluate(program)
+        self.assertNotEqual(first,second)
+
+
+class JavaBuilderTestCase(SimpleTestCase):
+
+    def build_run_script(self):
+        from sandbox.builders import JavaBuilder
+        scratch_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,scratch_dir)
+        JavaBuilder().build("// elab-source: Main.java\nclass Main {}\n",
+                            scratch_dir,{'build':'','run':''})
+        with open(os.path.join(scratch_dir,'run')) as f:
+            return f.read()
+
+    def test_cds_archive(self):
+        with override_settings(JAVA_CDS_ARCHIVE=None):
+            self.assertNotIn('SharedArchiveFile',self.build_run_script())
+        with override_settings(JAVA_CDS_ARCHIVE='/opt/elab/java.jsa'):
+            self.assertIn('-Xshare:auto -XX:SharedArchiveFile=/opt/elab/java.jsa',
+                          self.build_run_script())
+
+    @unittest.skipUnless(shutil.which('javac') and shutil.which('java'),
+                         'java is not installed')
+    def test_bad_cds_archive(self):
+        from sandbox.builders import JavaBuilder
+        scratch_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,scratch_dir)
+        with open(os.path.join(scratch_dir,'bad.jsa'),'wb') as f:
+            f.write(b'not an archive')
+        source = ('// elab-source: Main.java\n'
+                  'class Main { public static void main(String[] a) {'
+                  ' System.out.println("hello"); } }\n')
+        for archive in ['bad.jsa','missing.jsa']:
+            with override_settings(JAVA_CDS_ARCHIVE=os.path.join(scratch_dir,archive)):
+                JavaBuilder().build(source,scratch_dir,{'build':'','run':''})
+            run = subprocess.run(['./run'],cwd=scratch_dir,
+                                 stdin=subprocess.DEVNULL,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL)
+            self.assertEqual(run.stdout,b'hello\n')
+
+
+class CompileServerArgsTestCase(SimpleTestCase):
+
+    def test_javac_args(self):
+        from sandbox.compileserver import get_javac_args
+        with mock.patch.dict(os.environ,{},clear=True):
+            self.assertEqual(get_javac_args('',['/s/A.java'],'/s'),
+                             ['-cp','/s/.','/s/A.java'])
+            self.assertEqual(get_javac_args('-encoding UTF-8 -Xlint:all',['/s/A.java'],'/s'),
+                             ['-cp','/s/.','-encoding','UTF-8','-Xlint:all','/s/A.java'])
+            for flags in ['-cp lib','--class-path=lib','-d out','-J-Xmx1g',
+                          '@options','Extra.java','-encoding','-cp $HOME']:
+                self.assertIsNone(get_javac_args(flags,['/s/A.java'],'/s'),flags)
+        with mock.patch.dict(os.environ,{'CLASSPATH':'lib:/opt/x.jar'}):
+            self.assertEqual(get_javac_args('',[],'/s')[:2],
+                             ['-cp','/s/lib:/opt/x.jar'])
+
+    def test_fallback_without_jdk(self):
+        from sandbox.builders import JavaBuilder
+        from sandbox.compileserver import JavaCompileServer
+        server = JavaCompileServer(javac='no-such-javac')
+        self.assertIsNone(JavaBuilder().build_with_server(
+            server,'/tmp','/tmp/A.java','/tmp/error.msg',{'build':''}))
+        self.assertIn('no-such-javac',server.unavailable)
+
+
+@unittest.skipUnless(shutil.which('javac'),'javac is not installed')
+class JavaCompileServerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        from sandbox import compileserver
+        self.scratch_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.scratch_dir)
+        self.server = compileserver.JavaCompileServer(max_compiles=2)
+        self.addCleanup(self.server.close)
+
+    def build(self,source,server):
+        from sandbox.builders import JavaBuilder
+        builder = JavaBuilder()
+        with mock.patch('sandbox.compileserver.get_server',return_value=server):
+            builder.build(source,self.scratch_dir,{'build':'','run':''})
+        return builder
+
+    def test_same_messages(self):
+        source = ('// elab-source: Main.java\n'
+                  'class Main { void f() { int x = "a"; java.util.List l = null; l.add(1); } }\n')
+        messages = self.build(source,None).get_compiler_messages()
+        self.assertIn('error:',messages)
+        builder = self.build(source,self.server)
+        self.assertTrue(self.server.is_running())
+        self.assertFalse(builder.build_succeeded())
+        self.assertEqual(builder.get_compiler_messages(),messages)
+
+        builder = self.build('// elab-source: Main.java\nclass Main {}\n',self.server)
+        self.assertTrue(builder.build_succeeded())
+        self.assertEqual(builder.get_compiler_messages(),'')
+        self.assertTrue(os.path.exists(os.path.join(self.scratch_dir,'Main.class')))
+
+    def test_restart(self):
+        source = '// elab-source: Main.java\nclass Main {}\n'
+        self.build(source,self.server)
+        pid = self.server.process.pid
+        # restarted after max_compiles builds
+        self.build(source,self.server)
+        self.assertFalse(self.server.is_running())
+        self.assertTrue(self.build(source,self.server).build_succeeded())
+        self.assertNotEqual(self.server.process.pid,pid)
+        # and when it has died
+        self.server.process.kill()
+        self.server.process.wait()
+        self.assertTrue(self.build(source,self.server).build_succeeded())
+        self.assertTrue(self.server.is_running())
+        self.server.check_health()
+        self.assertGreater(self.server.ping(),0)
+
+
+@unittest.skipUnless(shutil.which('g++'),'g++ is not installed')
+class PrecompiledHeaderTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.pch_dir = tempfile.mkdtemp()
+        self.scratch_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.pch_dir)
+        self.addCleanup(shutil.rmtree,self.scratch_dir)
+        self.settings_override = override_settings(
+                SANDBOX_PCH_DIR=self.pch_dir,
+                SANDBOX_PCH_HEADERS={'c++':['iostream']},
+                SANDBOX_PCH_BUILD_FLAGS=[''])
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def build(self,source):
+        from sandbox.builders import CBuilder, CppBuilder
+        builder = CppBuilder()
+        with mock.patch.object(CppBuilder,'build_for_posix',autospec=True,
+                               side_effect=CBuilder.build_for_posix) as build:
+            builder.build(source,self.scratch_dir,{'build':'','run':''})
+        return builder,[call[0][3] for call in build.call_args_list]
+
+    def test_prepare(self):
+        from sandbox.pch import prepare_precompiled_headers, get_pch_dir
+        with override_settings(SANDBOX_PCH_DIR=None):
+            self.assertEqual(prepare_precompiled_headers(),[])
+        with override_settings(SANDBOX_PCH_HEADERS={'c++':['iostream','nonexistent']}):
+            (language,message), = prepare_precompiled_headers()
+            self.assertEqual(language,'c++')
+            self.assertTrue(message.startswith('precompiled 1 of 2 headers'))
+            self.assertEqual(prepare_precompiled_headers(),[('c++','up to date')])
+        self.assertEqual(os.listdir(os.path.join(get_pch_dir('g++'),'iostream.gch')),
+                         ['0.gch'])
+
+    def test_build_with_precompiled_header(self):
+        from sandbox.pch import prepare_precompiled_headers, get_pch_dir
+        source = '#include <iostream>\nint main() { std::cout << 1; }\n'
+        builder,build_flags = self.build(source)
+        self.assertEqual(build_flags,[''])
+        prepare_precompiled_headers()
+        builder,build_flags = self.build(source)
+        self.assertEqual(build_flags,['-I %s ' % get_pch_dir('g++')])
+        self.assertTrue(builder.build_succeeded())
+        self.assertEqual(builder.get_compiler_messages(),'')
+
+    def test_same_messages_without_precompiled_header(self):
+        from sandbox.pch import prepare_precompiled_headers
+        source = ('#include <iostream>\n'
+                  'int main() { std::string s; s.append(std::cout); }\n')
+        builder,build_flags = self.build(source)
+        messages = builder.get_compiler_messages()
+        self.assertIn('from %s' % os.path.join(self.scratch_dir,'source.cpp'),
+                      messages)
+        prepare_precompiled_headers()
+        builder,build_flags = self.build(source)
+        self.assertEqual(len(build_flags),2)
+        self.assertFalse(builder.build_succeeded())
+        self.assertEqual(builder.get_compiler_messages(),messages)
+
+
+class BuildCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        from sandbox.cache import BuildCache
+        self.dirs = [tempfile.mkdtemp() for i in range(3)]
+        for d in self.dirs:
+            self.addCleanup(shutil.rmtree,d)
+        cache_dir,self.build_dir,self.scratch_dir = self.dirs
+        self.cache = BuildCache(cache_dir,1024*1024)
+        with open(os.path.join(self.build_dir,'run'),'w') as f:
+            f.write('built')
+        self.cache.store('key',self.build_dir,{},
+                         os.path.join(self.build_dir,'run'),'')
+        self.cached_file = os.path.join(cache_dir,'key','files','run')
+
+    def test_fetch_copies_without_box(self):
+        executable_filename,messages,succeeded = self.cache.fetch(
+            'key',self.scratch_dir)
+        self.assertEqual(executable_filename,
+                         os.path.join(self.scratch_dir,'run'))
+        self.assertFalse(os.path.samefile(executable_filename,self.cached_file))
+        os.chmod(executable_filename,0o644)
+        with open(executable_filename,'w') as f:
+            f.write('changed')
+        with open(self.cached_file) as f:
+            self.assertEqual(f.read(),'built')
+
+    def test_fetch_links_with_box(self):
+        with override_settings(USE_BOX_IN_SANDBOX=True):
+            executable_filename,messages,succeeded = self.cache.fetch(
+                'key',self.scratch_dir)
+        self.assertTrue(os.path.samefile(executable_filename,self.cached_file))
+
+
+@override_settings(BUILDERS={'python3':sys.executable})
+class OutputLimitTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.scratch_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.scratch_dir)
+
+    def evaluate(self, language, body):
+        sandbox = Sandbox(self.scratch_dir,use_box=False,build_cache=False,
+                          output_limit=1,flags={'build':'','run':''})
+        sandbox.evaluate(source=SourceCode(language,body),input_string='',
+                         output_filename='out.txt')
+        size = os.path.getsize(os.path.join(self.scratch_dir,'out.txt'))
+        return sandbox.get_stats(), size
+
+    def test_killed_by_signal(self):
+        stats, size = self.evaluate('c',
+            '#include <stdio.h>\n'
+            'int main() { for (;;) printf("output\\n"); }\n')
+        self.assertEqual(stats.status,RunStats.OUTPUT_LIMIT)
+        self.assertLessEqual(size,1024*1024)
+
+    def test_write_error(self):
+        # python ignores SIGXFSZ and fails with an error instead
+        program = "while True: print('output')\n"
+        stats, size = self.evaluate('python3',program)
+        self.assertEqual(stats.status,RunStats.OUTPUT_LIMIT)
+        self.assertEqual(size,1024*1024)
+        with override_settings(PYTHON_FORKSERVER=True):
+            stats, size = self.evaluate('python3',program)
+        self.assertEqual(stats.status,RunStats.OUTPUT_LIMIT)
+        self.assertEqual(size,1024*1024)
+
+    def test_limit_set_before_box(self):
+        # a stand-in for box binaries without -s
+        box_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,box_dir)
+        with open(os.path.join(box_dir,'box'),'w') as f:
+            f.write('#!/bin/sh\n'
+                    'while [ "$1" != -o ]; do shift; done\n'
+                    'exec head -c 2000000 /dev/zero > "$2"\n')
+        os.chmod(os.path.join(box_dir,'box'),0o755)
+        sandbox = Sandbox(self.scratch_dir,use_box=True,verify_box=False,
+                          build_cache=False,output_limit=1,
+                          flags={'build':'','run':''})
+        sandbox.sandbox_dir = box_dir
+        sandbox.evaluate(source=SourceCode('python3','print(1)\n'),
+                         input_string='',output_filename='out.txt')
+        size = os.path.getsize(os.path.join(self.scratch_dir,'out.txt'))
+        self.assertEqual(sandbox.get_stats().status,RunStats.OUTPUT_LIMIT)
+        self.assertEqual(size,1024*1024)
+
+    def test_box_option(self):
+        sandbox = Sandbox(self.scratch_dir,use_box=False,output_limit=1)
+        args = sandbox.prepare_args_with_box('./run','in','out')
+        self.assertNotIn('-s',args)
+        with override_settings(BOX_OUTPUT_LIMIT=True):
+            args = sandbox.prepare_args_with_box('./run','in','out')
+        self.assertEqual(args[args.index('-s')+1],'1024')
+
+
+@override_settings(SANDBOX_EXECUTOR='subprocess')
+class SubprocessOutputLimitTestCase(OutputLimitTestCase):
+    pass
+
+
+class ScratchSpaceTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.memory_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.memory_dir)
+
+    def test_memory_backend(self):
+        from sandbox.scratch import get_scratch_dir, get_scratch_space
+        with override_settings(SANDBOX_SCRATCH_BACKEND='memory',
+                               SANDBOX_MEMORY_SCRATCH_DIR=self.memory_dir,
+                               SANDBOX_MEMORY_SCRATCH_SIZE=20,
+                               DEFAULT_OUTPUT_LIMIT=16):
+            worker_dir = get_scratch_dir()
+            self.assertEqual(os.path.dirname(worker_dir),self.memory_dir)
+            sandbox = Sandbox(worker_dir,temp_subdir=True,use_box=False,
+                              build_cache=False,flags={'build':'','run':''})
+            with open(os.path.join(sandbox.get_scratch_dir(),'big'),'wb') as f:
+                f.write(b'x' * (5*1024*1024))
+            # 5 MB used, 16 MB more would not fit
+            self.assertNotEqual(get_scratch_dir(),worker_dir)
+            sandbox.clean_scratch_dir()
+            self.assertEqual(get_scratch_dir(),worker_dir)
+            space = get_scratch_space()
+            self.assertEqual((space.memory_uses,space.disk_uses),(2,1))
+            self.assertIn('1 on disk',space.report())
+
+        with override_settings(SANDBOX_SCRATCH_BACKEND='disk'):
+            self.assertEqual(get_scratch_space().report(),'')
+
+    def test_child_copies_counted(self):
+        from sandbox.scratch import get_scratch_dir, get_scratch_space
+        disk_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,disk_dir)
+        with override_settings(SANDBOX_SCRATCH_BACKEND='memory',
+                               SANDBOX_MEMORY_SCRATCH_DIR=self.memory_dir,
+                               SANDBOX_MEMORY_SCRATCH_SIZE=20,
+                               SANDBOX_SCRATCH_DIR=disk_dir,
+                               DEFAULT_OUTPUT_LIMIT=4):
+            worker_dir = get_scratch_dir()
+            sandbox = Sandbox(worker_dir,temp_subdir=True,use_box=False,
+                              build_cache=False,flags={'build':'','run':''})
+            with open(os.path.join(sandbox.get_scratch_dir(),'big'),'wb') as f:
+                f.write(b'x' * (3*1024*1024))
+            # 3 MB used, each copy takes 3 MB and reserves 4 MB more
+            children = [sandbox.create_child() for _ in range(3)]
+            self.assertEqual([os.path.dirname(child.get_scratch_dir())
+                              for child in children],
+                             [worker_dir,worker_dir,disk_dir])
+            self.assertNotEqual(get_scratch_dir(),worker_dir)
+            for child in children:
+                child.clean_scratch_dir()
+            self.assertEqual(os.listdir(disk_dir),[])
+            self.assertEqual(get_scratch_space().reservations,{})
+            self.assertEqual(get_scratch_dir(),worker_dir)
+            sandbox.clean_scratch_dir()
+
+
+class CgroupExecutorTestCase(SimpleTestCase):
+
+    def test_read_keyed_file(self):
+        from sandbox.executors import CgroupExecutor
+        f = tempfile.NamedTemporaryFile('w',suffix='.stat')
+        self.addCleanup(f.close)
+        f.write('usage_usec 1500000\nuser_usec 1000000\nsystem_usec 500000\n')
+        f.flush()
+        self.assertEqual(CgroupExecutor.read_keyed_file(f.name),
+                         {'usage_usec':1500000,
+                          'user_usec':1000000,
+                          'system_usec':500000})
+        self.assertEqual(CgroupExecutor.read_keyed_file(f.name+'.missing'),{})
+
+    def test_limits(self):
+        from sandbox.executors import CgroupExecutor, CgroupNotReady
+        try:
+            executor = CgroupExecutor()
+        except CgroupNotReady as e:
+            self.skipTest(str(e))
+        scratch_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,scratch_dir)
+        def evaluate(body, **kwargs):
+            sandbox = Sandbox(scratch_dir,use_box=False,build_cache=False,
+                              executor=executor,flags={'build':'','run':''},
+                              **kwargs)
+            output = sandbox.evaluate(source=SourceCode('python3',body),
+                                      input_string='')
+            return output, sandbox.get_stats()
+
+        output, stats = evaluate("print(1)\n")
+        self.assertEqual((output,stats.status),("1\n",RunStats.OK))
+        output, stats = evaluate("import time\ntime.sleep(10)\n",time_limit=0.5)
+        self.assertEqual(stats.status,RunStats.TIME_LIMIT)
+        output, stats = evaluate("x = 'a' * (200*1024*1024)\n",memory_limit=100)
+        self.assertEqual(stats.status,RunStats.MEMORY_LIMIT)
+        self.assertEqual([name for name in os.listdir(executor.cgroup_dir)
+                          if name.startswith('run-')],[])
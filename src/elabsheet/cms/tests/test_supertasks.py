@@ -1,4 +1,6 @@
+from unittest import mock
 from django.test import TestCase
+from django.utils import timezone
 from cms.models import Task,ChildTask,ChildTaskException,CachedChildTask
 from textwrap import dedent
 
@@ -148,6 +150,74 @@ class TestSuperTask(TestCase):
         except CachedChildTask.DoesNotExist:
             self.fail('Cached child task should exist')
 
+    def test_childtask_testcases_evaluated_once(self):
+        run_testcases = Task.run_testcases
+        with mock.patch.object(Task,'run_testcases',autospec=True,
+                               side_effect=run_testcases) as run:
+            for i in range(3):
+                # as if graded by different graders
+                task = Task.objects.get(pk=self.task_id)
+                ChildTask.transform(task,seed=7,difficulty=0)
+                results,messages = task.verify_with_messages(
+                        {0:"r = int(input('Enter r: '))\nprint(f'The output is {9*r+35}')"})
+                self.assertEqual(len(results),1)
+                self.assertTrue(results[0]['passed'])
+        # the solution is run only for the first submission
+        self.assertEqual(run.call_count,1)
+        cache = CachedChildTask.objects.get(parent_task_id=self.task_id,
+                                            key=ChildTask.generate_key(7,0))
+        self.assertTrue(cache.testcases_evaluated)
+        self.assertEqual(cache.testcases[0]['output'].strip(),
+                         "Enter r: The output is 125")
+
+    def mark_evaluating(self,seconds):
+        task = Task.objects.get(pk=self.task_id)
+        ChildTask.transform(task,seed=7,difficulty=0)
+        (CachedChildTask.objects.filter(pk=task.cache.pk)
+            .update(evaluating_by='other:1',
+                    evaluating_until=timezone.now()+timezone.timedelta(seconds=seconds)))
+        return task
+
+    def test_childtask_waits_for_other_grader(self):
+        task = self.mark_evaluating(60)
+        other = Task.objects.get(pk=self.task_id)
+        ChildTask.transform(other,seed=7,difficulty=0)
+
+        def other_grader_done(seconds):
+            other.run_testcases()
+
+        with mock.patch('cms.models.time.sleep',side_effect=other_grader_done) as sleep, \
+             mock.patch.object(Task,'run_testcases',autospec=True,
+                               side_effect=Task.run_testcases) as run:
+            task.evaluate_testcases_once()
+        self.assertEqual(sleep.call_count,1)
+        # only run by the other grader
+        self.assertEqual(run.call_count,1)
+        self.assertIs(run.call_args[0][0],other)
+        self.assertEqual(task.testcases[0]['output'].strip(),
+                         "Enter r: The output is 125")
+
+    def test_childtask_stops_waiting(self):
+        task = self.mark_evaluating(60)
+        with self.settings(CHILD_TASK_EVALUATION_TIMEOUT=0), \
+             mock.patch('cms.models.time.sleep') as sleep:
+            task.evaluate_testcases_once()
+        sleep.assert_not_called()
+        self.assertEqual(task.testcases[0]['output'].strip(),
+                         "Enter r: The output is 125")
+        # not stored, as the other grader is still evaluating it
+        cache = CachedChildTask.objects.get(pk=task.cache.pk)
+        self.assertFalse(cache.testcases_evaluated)
+        self.assertEqual(cache.evaluating_by,'other:1')
+
+    def test_childtask_takes_over_expired_evaluation(self):
+        task = self.mark_evaluating(-1)
+        task.evaluate_testcases_once()
+        cache = CachedChildTask.objects.get(pk=task.cache.pk)
+        self.assertTrue(cache.testcases_evaluated)
+        self.assertEqual(cache.evaluating_by,'')
+        self.assertIsNone(cache.evaluating_until)
+
 
 ########################
 class TestSuperTaskWithAdjustment(TestCase):
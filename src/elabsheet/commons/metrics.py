@@ -0,0 +1,319 @@
+"""
+Counters and histograms of graders and of the web app, exposed in the
+Prometheus text exposition format by the metrics view (/metrics) and by
+the "metrics" management command.
+
+Each process (every grader and web server worker) keeps its metrics in
+memory and writes them to a JSON file named after its host and PID in
+settings.METRICS_DIR, at most every METRICS_FLUSH_INTERVAL seconds or
+when flush() is called.  The exposition merges the files of all
+processes, so counters and histogram buckets are totals over every
+process sharing the directory.  Files untouched for METRICS_MAX_AGE
+seconds belong to processes that are gone and are removed; as with any
+process restart, scrapers see their counters reset.
+
+Histograms have cumulative buckets, so percentiles can be computed by the
+scraper (e.g., histogram_quantile() over a rate of the buckets).
+"""
+import os
+import json
+import time
+import socket
+import tempfile
+import threading
+
+from django.conf import settings
+
+FILE_EXTENSION = '.json'
+
+# bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+WAIT_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def metrics_enabled():
+    return bool(getattr(settings, 'METRICS_DIR', None))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                                      .replace('"', '\\"')
+                                      .replace('\n', '\\n'))
+        for name, value in labels)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def get_key(self, labels):
+        return json.dumps([str(labels[name]) for name in self.labelnames])
+
+    def inc(self, amount=1, **labels):
+        self.registry.update(self, self.get_key(labels), amount)
+
+    def empty(self):
+        return 0
+
+    def add(self, value, amount):
+        return value + amount
+
+    def merge(self, value, other):
+        return value + other
+
+    def render(self, key, value):
+        labels = list(zip(self.labelnames, json.loads(key)))
+        return ['%s%s %s' % (self.name, format_labels(labels),
+                             format_value(value))]
+
+
+class Histogram(Counter):
+    """
+    A value is kept as [bucket counts..., count, sum].
+    """
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        self.registry.update(self, self.get_key(labels), value)
+
+    def empty(self):
+        return [0] * (len(self.buckets) + 2)
+
+    def add(self, value, amount):
+        value = list(value)
+        for i, bound in enumerate(self.buckets):
+            if amount <= bound:
+                value[i] += 1
+        value[-2] += 1
+        value[-1] += amount
+        return value
+
+    def merge(self, value, other):
+        if len(other) != len(value):
+            # written with other buckets, e.g., before an upgrade
+            return value
+        return [a + b for a, b in zip(value, other)]
+
+    def render(self, key, value):
+        labels = list(zip(self.labelnames, json.loads(key)))
+        lines = []
+        for bound, count in zip(self.buckets + (float('inf'),),
+                                value[:len(self.buckets)] + [value[-2]]):
+            lines.append('%s_bucket%s %s' % (
+                self.name,
+                format_labels(labels + [('le', format_value(bound))]),
+                format_value(count)))
+        lines.append('%s_count%s %s' % (self.name, format_labels(labels),
+                                        format_value(value[-2])))
+        lines.append('%s_sum%s %s' % (self.name, format_labels(labels),
+                                      format_value(value[-1])))
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        # whether values are written when METRICS_FLUSH_INTERVAL passes
+        self.autoflush = True
+        self.reset()
+
+    def reset(self):
+        self.values = {}
+        self.last_flushed_at = time.time()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        metric.registry = self
+        return metric
+
+    def update(self, metric, key, amount):
+        if not metrics_enabled():
+            return
+        with self.lock:
+            values = self.values.setdefault(metric.name, {})
+            values[key] = metric.add(values.get(key, metric.empty()), amount)
+            due = (self.autoflush and
+                   time.time() - self.last_flushed_at >=
+                   settings.METRICS_FLUSH_INTERVAL)
+        if due:
+            self.flush()
+
+    def take_values(self):
+        """
+        Returns the values recorded since the last reset and resets them,
+        e.g., to be sent from a child process to its parent.
+        """
+        with self.lock:
+            values = self.values
+            self.values = {}
+        return values
+
+    def add_values(self, values):
+        """
+        Adds values taken from another registry (see take_values).
+        """
+        with self.lock:
+            for metric_name, metric_values in values.items():
+                metric = self.metrics[metric_name]
+                own_values = self.values.setdefault(metric_name, {})
+                for key, value in metric_values.items():
+                    own_values[key] = metric.merge(
+                        own_values.get(key, metric.empty()), value)
+
+    def get_filename(self):
+        return os.path.join(settings.METRICS_DIR, '%s-%d%s' % (
+            socket.gethostname(), os.getpid(), FILE_EXTENSION))
+
+    def flush(self):
+        """
+        Writes the metrics of this process to its file.  Errors are
+        ignored; the metrics are written again next time.
+        """
+        if not metrics_enabled():
+            return
+        with self.lock:
+            data = json.dumps(self.values)
+            self.last_flushed_at = time.time()
+        try:
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            fd, temp_filename = tempfile.mkstemp(dir=settings.METRICS_DIR,
+                                                 prefix='.tmp-')
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            os.rename(temp_filename, self.get_filename())
+        except OSError:
+            pass
+
+    def collect(self):
+        """
+        Returns a dict mapping metric names to dicts of merged values of
+        all processes.
+        """
+        self.flush()
+        merged = {}
+        try:
+            names = os.listdir(settings.METRICS_DIR)
+        except OSError:
+            return merged
+        now = time.time()
+        for name in names:
+            if not name.endswith(FILE_EXTENSION):
+                continue
+            filename = os.path.join(settings.METRICS_DIR, name)
+            try:
+                if os.stat(filename).st_mtime < now - settings.METRICS_MAX_AGE:
+                    os.remove(filename)
+                    continue
+                with open(filename) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric_name, values in data.items():
+                metric = self.metrics.get(metric_name)
+                if metric is None:
+                    continue
+                metric_values = merged.setdefault(metric_name, {})
+                for key, value in values.items():
+                    metric_values[key] = metric.merge(
+                        metric_values.get(key, metric.empty()), value)
+        return merged
+
+    def render(self, gauges=()):
+        """
+        Returns the text exposition of all metrics, preceded by the given
+        (name, documentation, [(labels, value), ...]) gauges.
+        """
+        lines = []
+        for name, documentation, samples in gauges:
+            lines.append('# HELP %s %s' % (name, documentation))
+            lines.append('# TYPE %s gauge' % name)
+            for labels, value in samples:
+                lines.append('%s%s %s' % (name, format_labels(labels),
+                                          format_value(value)))
+        merged = self.collect()
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            lines.append('# HELP %s %s' % (name, metric.documentation))
+            lines.append('# TYPE %s %s' % (name, metric.type_name))
+            for key, value in sorted(merged.get(name, {}).items()):
+                lines.extend(metric.render(key, value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+if hasattr(os, 'register_at_fork'):
+    # a forked process (e.g., a grader worker) starts counting from zero
+    # instead of counting its parent's values again
+    os.register_at_fork(after_in_child=registry.reset)
+
+
+def flush():
+    registry.flush()
+
+
+def counter(name, documentation, labelnames=()):
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, buckets, labelnames=()):
+    return registry.register(Histogram(name, documentation, buckets,
+                                       labelnames))
+
+
+SUBMISSIONS = counter(
+    'elab_submissions_total',
+    'Submissions received by the web app',
+    ('grading',))
+CLAIM_LATENCY = histogram(
+    'elab_claim_latency_seconds',
+    'Time taken by graders to claim submissions from the queue',
+    LATENCY_BUCKETS)
+QUEUE_WAIT = histogram(
+    'elab_queue_wait_seconds',
+    'Time from submission (or regrade request) to the start of grading',
+    WAIT_BUCKETS,
+    ('lane',))
+GRADING_PHASE = histogram(
+    'elab_grading_phase_seconds',
+    'Time graders spend in each phase of grading a submission',
+    DURATION_BUCKETS,
+    ('phase',))
+BUILD_TIME = histogram(
+    'elab_build_seconds',
+    'Time taken by sandboxes to build sources (or fetch cached builds)',
+    DURATION_BUCKETS,
+    ('language', 'cached'))
+RUN_TIME = histogram(
+    'elab_run_seconds',
+    'Wall time of programs run by sandboxes',
+    DURATION_BUCKETS,
+    ('language',))
+SANDBOX_LAUNCHES = counter(
+    'elab_sandbox_launches_total',
+    'Programs started by sandboxes',
+    ('language',))
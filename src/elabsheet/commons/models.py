@@ -9,6 +9,13 @@ class TestCaseResult:
     RESULT_SPACEPROBLEM = 2
     RESULT_TIMEOUT = 3
     RESULT_CASEPROBLEM = 4
+    RESULT_MEMORY = 5
+    RESULT_NOTRUN = 6
+    RESULT_OUTPUT = 7
+
+    RESULTS = (RESULT_FAILED, RESULT_PASSED, RESULT_SPACEPROBLEM,
+               RESULT_TIMEOUT, RESULT_CASEPROBLEM, RESULT_MEMORY,
+               RESULT_NOTRUN, RESULT_OUTPUT)
 
     def __init__(self, result):
         self.result = result
@@ -32,6 +39,15 @@ class TestCaseResult:
     def case_problem(self):
         return self.result == TestCaseResult.RESULT_CASEPROBLEM
 
+    def memory_exceeded(self):
+        return self.result == TestCaseResult.RESULT_MEMORY
+
+    def not_run(self):
+        return self.result == TestCaseResult.RESULT_NOTRUN
+
+    def output_exceeded(self):
+        return self.result == TestCaseResult.RESULT_OUTPUT
+
     def to_db(self):
         return self.result
 
@@ -44,6 +60,12 @@ class TestCaseResult:
             return 'T'
         elif self.case_problem():
             return 'C'
+        elif self.memory_exceeded():
+            return 'M'
+        elif self.not_run():
+            return 'N'
+        elif self.output_exceeded():
+            return 'O'
         else:
             return '-'
 
@@ -56,6 +78,12 @@ class TestCaseResult:
             return 'Time exceeded'
         elif self.case_problem():
             return 'Incorrect case'
+        elif self.memory_exceeded():
+            return 'Memory exceeded'
+        elif self.not_run():
+            return 'Not run'
+        elif self.output_exceeded():
+            return 'Output exceeded'
         else:
             return 'Failed'
 
@@ -64,4 +92,7 @@ TestCaseResult.PASSED = TestCaseResult(TestCaseResult.RESULT_PASSED)
 TestCaseResult.SPACEPROBLEM = TestCaseResult(TestCaseResult.RESULT_SPACEPROBLEM)
 TestCaseResult.TIMEOUT = TestCaseResult(TestCaseResult.RESULT_TIMEOUT)
 TestCaseResult.CASEPROBLEM = TestCaseResult(TestCaseResult.RESULT_CASEPROBLEM)
+TestCaseResult.MEMORY = TestCaseResult(TestCaseResult.RESULT_MEMORY)
+TestCaseResult.NOTRUN = TestCaseResult(TestCaseResult.RESULT_NOTRUN)
+TestCaseResult.OUTPUT = TestCaseResult(TestCaseResult.RESULT_OUTPUT)
 
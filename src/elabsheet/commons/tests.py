@@ -1,7 +1,121 @@
+import os
+import json
+import shutil
 import doctest
-from django.test import SimpleTestCase
+import tempfile
+import threading
+from django.test import SimpleTestCase, override_settings
 from . import utils
+from . import metrics
+from . import timing
 
 class UtilsModuleTest(SimpleTestCase):
     def test_doctests(self):
         doctest.testmod(utils)
+
+
+class MetricsTest(SimpleTestCase):
+
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(METRICS_DIR=self.metrics_dir)
+        self.settings_override.enable()
+        self.counter = metrics.Counter('test_total', 'Test counter', ('kind',))
+        self.histogram = metrics.Histogram('test_seconds', 'Test histogram',
+                                           (1, 5))
+        self.registry = metrics.Registry()
+        self.registry.register(self.counter)
+        self.registry.register(self.histogram)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.metrics_dir)
+
+    def write_other_process(self, values):
+        with open(os.path.join(self.metrics_dir, 'other-1.json'), 'w') as f:
+            json.dump(values, f)
+
+    def test_render_merges_processes(self):
+        self.counter.inc(kind='a')
+        self.counter.inc(2, kind='a')
+        self.histogram.observe(0.5)
+        self.histogram.observe(3)
+        self.write_other_process({
+            'test_total': {'["a"]': 1, '["b"]': 4},
+            'test_seconds': {'[]': [0, 1, 1, 7]},
+        })
+        text = self.registry.render([
+            ('test_depth', 'Test gauge', [([('status', 'inqueue')], 2)]),
+        ])
+        self.assertEqual(text.splitlines(), [
+            '# HELP test_depth Test gauge',
+            '# TYPE test_depth gauge',
+            'test_depth{status="inqueue"} 2',
+            '# HELP test_seconds Test histogram',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="1"} 1',
+            'test_seconds_bucket{le="5"} 3',
+            'test_seconds_bucket{le="+Inf"} 3',
+            'test_seconds_count 3',
+            'test_seconds_sum 10.5',
+            '# HELP test_total Test counter',
+            '# TYPE test_total counter',
+            'test_total{kind="a"} 4',
+            'test_total{kind="b"} 4',
+        ])
+
+    def test_stale_files_removed(self):
+        self.write_other_process({'test_total': {'["a"]': 1}})
+        filename = os.path.join(self.metrics_dir, 'other-1.json')
+        os.utime(filename, (0, 0))
+        self.assertEqual(self.registry.collect(), {})
+        self.assertFalse(os.path.exists(filename))
+
+    def test_values_from_child_process(self):
+        self.counter.inc(kind='a')
+        values = self.registry.take_values()
+        self.assertEqual(self.registry.values, {})
+        self.registry.add_values(values)
+        self.registry.add_values(values)
+        self.assertEqual(self.registry.values['test_total'], {'["a"]': 2})
+
+
+class TimingTest(SimpleTestCase):
+
+    def tearDown(self):
+        timing.stop()
+
+    def test_span_without_timing(self):
+        with timing.span('build'):
+            pass
+        self.assertIsNone(timing.current())
+        self.assertIsNone(timing.stop())
+
+    def test_spans_add_up_per_phase(self):
+        timing.start()
+        with timing.span('verify'):
+            for i in range(3):
+                with timing.span('run'):
+                    pass
+        def run_in_thread():
+            with timing.span('run'):
+                pass
+        thread = threading.Thread(target=run_in_thread)
+        thread.start()
+        thread.join()
+        recorded = timing.stop()
+        self.assertEqual(sorted(recorded.phases), ['run', 'verify'])
+        self.assertEqual(recorded.phases['run'][1], 4)
+        self.assertEqual(recorded.phases['verify'][1], 1)
+        self.assertGreaterEqual(recorded.total, recorded.phases['verify'][0])
+        self.assertIsNone(timing.current())
+
+    def test_phases_from_child_process(self):
+        timing.start()
+        with timing.span('run'):
+            pass
+        phases = timing.take_phases()
+        self.assertEqual(timing.current().phases, {})
+        timing.add_phases(phases)
+        timing.add_phases(phases)
+        self.assertEqual(timing.stop().phases['run'][1], 2)
@@ -0,0 +1,139 @@
+"""
+Per-phase timing of grading a submission.
+
+A grader starts a Timing before grading a submission and stops it when
+done; in between, code along the grading pipeline (run_grader,
+Task.verify_with_messages, Sandbox) marks its phases with
+
+    with timing.span('build'):
+        ...
+
+Spans add up per phase name, together with how many times each phase was
+entered (e.g., once per test case for 'evaluate').  Spans may nest (e.g.,
+'build' within 'verify') and, when test cases are evaluated in parallel,
+overlap, so phases do not add up to the total.  When no timing is
+started, spans cost next to nothing.
+
+A grader grades one submission at a time, so the started timing is shared
+by every thread of the process.  Processes evaluating test cases hand
+their phases back with take_phases() (see sandbox.evaluate_in_parallel).
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Timing:
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.total = None
+        # phase name -> [seconds, count]
+        self.phases = {}
+        self.lock = threading.Lock()
+
+    def add(self, phase, seconds, count=1):
+        with self.lock:
+            value = self.phases.setdefault(phase, [0.0, 0])
+            value[0] += seconds
+            value[1] += count
+
+    def add_phases(self, phases):
+        for phase, (seconds, count) in phases.items():
+            self.add(phase, seconds, count)
+
+    def take_phases(self):
+        with self.lock:
+            phases = self.phases
+            self.phases = {}
+        return phases
+
+    def stop(self):
+        self.total = time.perf_counter() - self.started_at
+
+    @staticmethod
+    def from_dict(phases, total):
+        """
+        Returns a stopped Timing with the given phases (see to_dict),
+        e.g., as reported by a remote grader.
+        """
+        timing = Timing()
+        timing.add_phases(phases)
+        timing.total = total
+        return timing
+
+    def to_dict(self):
+        """
+        Returns the phases as a compact dict of {phase: [seconds, count]},
+        with seconds rounded to milliseconds.
+        """
+        with self.lock:
+            return {phase: [round(seconds, 3), count]
+                    for phase, (seconds, count) in sorted(self.phases.items())}
+
+
+_current = None
+
+
+def start():
+    """
+    Starts timing the phases of this process and returns the Timing.
+    """
+    global _current
+    _current = Timing()
+    return _current
+
+
+def stop():
+    """
+    Stops timing and returns the Timing (None if not started).
+    """
+    global _current
+    timing, _current = _current, None
+    if timing is not None:
+        timing.stop()
+    return timing
+
+
+def current():
+    return _current
+
+
+def take_phases():
+    """
+    Returns the phases recorded so far by this process and forgets them,
+    e.g., to be sent from a child process to its parent.
+    """
+    if _current is None:
+        return {}
+    return _current.take_phases()
+
+
+def add_phases(phases):
+    if _current is not None:
+        _current.add_phases(phases)
+
+
+def _reset_in_child():
+    global _current
+    if _current is not None:
+        # a forked process reports only the phases it records itself
+        _current = Timing()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_child)
+
+
+@contextmanager
+def span(phase):
+    timing = _current
+    if timing is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(phase, time.perf_counter() - started_at)
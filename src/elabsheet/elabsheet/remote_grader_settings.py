@@ -0,0 +1,18 @@
+"""
+Settings of remote graders (manage.py run_remote_grader), which grade
+through the job API of the web app without its database or apps:
+
+    DJANGO_SETTINGS_MODULE=elabsheet.remote_grader_settings \
+        python manage.py run_remote_grader https://elab.example.com/
+
+The sandbox and grading settings are those of settings.py (and
+settings_local.py).
+"""
+from .settings import *
+
+INSTALLED_APPS = [
+    'grader',
+]
+
+# the dummy backend fails on any query
+DATABASES = {}
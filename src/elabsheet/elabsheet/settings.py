@@ -173,6 +173,106 @@ GRADER_LOG_DIR = os.path.join(BASE_DIR,'grader/log')
 # Set this to True, if you want the grader to save submission outputs
 GRADER_OUTPUT_LOG = False
 
+# Number of test cases of a single submission to be evaluated at the same
+# time.  Each one runs in its own scratch subdir sharing the same build.
+# The actual number is capped at the number of available CPU cores.
+GRADER_TESTCASE_WORKERS = 1
+
+# Maximum number of in-queue submissions a grader claims at once.  Larger
+# batches mean fewer queue queries but may leave submissions waiting behind
+# a busy grader while others are idle.
+GRADER_CLAIM_BATCH_SIZE = 1
+
+# Set this to True to have graders interleave submissions of different
+# users and sections instead of taking them strictly in submission order
+# (see lab/scheduling.py).  GRADER_FAIR_SHARE_WINDOW oldest in-queue
+# submissions are considered at each claim, and each user's and section's
+# turn depends on how many of their submissions were graded during the
+# last GRADER_FAIR_SHARE_HISTORY seconds.  Submissions waiting longer than
+# GRADER_FAIR_SHARE_MAX_WAIT seconds are graded first in submission
+# order, so none waits forever.
+#
+# Fair share trades tail latency for median latency: strict submission
+# order gives the shortest longest wait, and any interleaving makes some
+# submissions wait longer.  The longest waits grow by up to about
+# GRADER_FAIR_SHARE_MAX_WAIT, so keep it short; with the defaults below,
+# scripts/fair-share-benchmark.py shows first submissions of each user
+# waiting about half as long, with p95/p99 of all submissions within a
+# few seconds of strict order.
+GRADER_FAIR_SHARE = False
+GRADER_FAIR_SHARE_WINDOW = 50
+GRADER_FAIR_SHARE_HISTORY = 30
+GRADER_FAIR_SHARE_MAX_WAIT = 15
+
+# Relative share of grading given to sections (by section id) when their
+# submissions are queued together, e.g., {12: 3} to favor a section
+# taking an exam.  Sections not listed have weight 1.
+GRADER_FAIR_SHARE_SECTION_WEIGHTS = {}
+
+# Seconds a grader's claim on a submission lasts unless renewed.  Graders
+# renew the claims on their submissions while grading, and put back to the
+# queue submissions whose claims have expired, e.g., because their grader
+# was killed.  A submission whose grading has been started
+# GRADER_MAX_ATTEMPTS times without completing is marked as graded with no
+# test case run, instead of bringing down graders over and over.
+GRADER_LEASE_DURATION = 120
+GRADER_MAX_ATTEMPTS = 3
+
+# Seconds graders wait for another grader running the solution of a child
+# task (of a supertask) to store its expected outputs, before running it
+# themselves.  The grader running it keeps other graders waiting for at
+# most this long, e.g., if it is killed.
+CHILD_TASK_EVALUATION_TIMEOUT = 120
+
+# Number of grading results kept for reuse when the same code is submitted
+# (or regraded) again for the same task.  Set this to 0 to always grade.
+# Results are reused only if grading is deterministic, so keep this at 0 if
+# tasks rely on timing, randomness or the SUBMITTER environment variable.
+GRADING_RESULT_CACHE_SIZE = 0
+
+# Remote graders ("manage.py run_remote_grader"), which need no database
+# access, claim submissions and report results through the job API at
+# /grader/api/, authenticating with this shared secret.  Keep it secret
+# and serve the API over HTTPS only.  Set this to None to disable the API.
+# Remote graders run with elabsheet/remote_grader_settings.py.
+GRADER_API_TOKEN = None
+
+# Idle graders wait for a notification on a Unix socket created in this
+# directory, which must be shared by the web server and the graders.  Set
+# this to None to have idle graders poll the queue every second instead.
+GRADER_WAKEUP_DIR = os.path.join(BASE_DIR,'grader/wakeup')
+
+# Seconds an idle grader waits for a notification before checking the
+# queue anyway
+GRADER_WAKEUP_TIMEOUT = 10
+
+# Graders and web server processes keep metrics (queue waits, grading and
+# build times, etc.) in files in this directory, which must be shared by
+# all of them.  The metrics are served in the Prometheus text format at
+# /metrics to clients from METRICS_ALLOWED_ADDRESSES (a comma-separated
+# list of addresses or address ranges) and to staff, and printed by
+# "manage.py metrics".  Set METRICS_DIR to None to disable metrics.
+METRICS_DIR = os.path.join(BASE_DIR,'tmp/metrics')
+METRICS_ALLOWED_ADDRESSES = '127.0.0.1'
+
+# Seconds between writes of a process's metrics, and after which the
+# metrics of a process that stopped writing are discarded
+METRICS_FLUSH_INTERVAL = 5
+METRICS_MAX_AGE = 24 * 3600
+
+# Fraction (0 to 1) of gradings whose time spent in each phase (building,
+# running and judging test cases, saving, etc.) is kept in the database
+# (see lab.models.GradingTiming), e.g., to be summarized per task with
+# "manage.py grading_timings".  Set this to 0 to keep none.  Every kept
+# grading adds a row, so raise this only for a while (e.g., to 1.0 during
+# an exam being investigated) on busy installations.
+GRADER_TIMING_SAMPLE_RATE = 0.01
+
+# Days for which grading timings are kept.  Older ones are deleted as new
+# ones are recorded, or with "manage.py grading_timings --prune DAYS".
+# Set this to 0 to keep them forever.
+GRADER_TIMING_RETENTION_DAYS = 7
+
 # Set this to True to use "box.cc" as a sandboxing tool, you may want
 # to override this in settings_dev.py if you're on an OS that doesn't
 # support box (i.e., anything that's not Linux).
@@ -185,10 +285,105 @@ USE_BOX_IN_SANDBOX = False
 BOX_USER = 'elabdummy'              
 BOX_GROUP = 'elabdummy'
 
+# Set this to True once box has been rebuilt with install-box.sh, so that
+# box itself limits the size of written files to DEFAULT_OUTPUT_LIMIT (its
+# -s option) and reports programs exceeding it.  Older box binaries reject
+# -s.  Either way, the executor sets the limit (RLIMIT_FSIZE) before
+# starting box, and box passes it on to the program.
+BOX_OUTPUT_LIMIT = False
+
 # This is where all temp scratch box dirs will be created.
 # When deployed, it should be move to some other place.
 SANDBOX_SCRATCH_DIR = os.path.join(BASE_DIR, 'tmp/elab')
 
+# Where graders create scratch dirs: 'disk' uses SANDBOX_SCRATCH_DIR;
+# 'memory' uses SANDBOX_MEMORY_SCRATCH_DIR, which should be on a
+# memory-backed filesystem such as /dev/shm, to avoid small disk writes
+# for every evaluation.  Each grader process may use up to
+# SANDBOX_MEMORY_SCRATCH_SIZE MB there; scratch dirs that might not fit
+# go to SANDBOX_SCRATCH_DIR instead.  Usage is reported in grader logs.
+SANDBOX_SCRATCH_BACKEND = 'disk'
+SANDBOX_MEMORY_SCRATCH_DIR = '/dev/shm/elab'
+SANDBOX_MEMORY_SCRATCH_SIZE = 256
+
+# Builds of compiled languages (C, C++, Java and C#) are cached here, so
+# that the same code with the same flags and supplements is compiled only
+# once.  With USE_BOX_IN_SANDBOX, keep it on the same filesystem as
+# SANDBOX_SCRATCH_DIR so that cached files can be hardlinked instead of
+# copied; without box, they are always copied, since evaluated programs
+# could otherwise change them.  Clear this directory
+# after upgrading compilers.  Set this to None to disable the cache.
+SANDBOX_BUILD_CACHE_DIR = os.path.join(BASE_DIR, 'tmp/build-cache')
+
+# Maximum size of the build cache in MB
+SANDBOX_BUILD_CACHE_SIZE = 512
+
+# Headers precompiled for the C and C++ builders are kept here (see
+# sandbox/pch.py).  Graders precompile SANDBOX_PCH_HEADERS of each language
+# at startup, once for each build flags in SANDBOX_PCH_BUILD_FLAGS ('' for
+# tasks without build flags); tasks with other build flags are compiled
+# without them.  Set this to None to not precompile headers.
+SANDBOX_PCH_DIR = os.path.join(BASE_DIR, 'tmp/pch')
+SANDBOX_PCH_HEADERS = {
+    'c': ['stdio.h', 'stdlib.h', 'string.h', 'math.h'],
+    'c++': ['bits/stdc++.h', 'iostream'],
+    'c++11': ['bits/stdc++.h', 'iostream'],
+}
+SANDBOX_PCH_BUILD_FLAGS = ['']
+
+# Grading supplements are extracted once into this directory and their
+# read-only files are linked (or, without box, copied) into scratch dirs.
+# Like the build cache, it should be on the same filesystem as
+# SANDBOX_SCRATCH_DIR.  Set this to
+# None to extract supplements into every scratch dir instead.
+SUPPLEMENT_CACHE_DIR = os.path.join(BASE_DIR, 'tmp/supplements')
+
+# How evaluated programs are started: 'shell' runs them through os.system,
+# changing the working directory of the whole process; 'subprocess' runs
+# them directly with their own working directory and environment, so that
+# many sandboxes may run in one process (e.g., in threads, with
+# GRADER_TESTCASE_WORKERS).  'cgroup' runs each of them like 'subprocess'
+# but in its own cgroup (v2) under SANDBOX_CGROUP_DIR, which enforces time
+# and memory limits and measures the whole process tree without the ptrace
+# overhead of box; use it with USE_BOX_IN_SANDBOX = False (see
+# INSTALL_NOTES).
+SANDBOX_EXECUTOR = 'shell'
+
+# cgroup delegated to the grader's user, and the number of CPUs each
+# evaluated program may use, for the 'cgroup' executor
+SANDBOX_CGROUP_DIR = '/sys/fs/cgroup/elab'
+SANDBOX_CGROUP_CPUS = 1
+
+# Set this to True to run Python submissions by forking a warmed-up
+# interpreter (see sandbox/pyforkserver.py) instead of starting a new one
+# for every test case.  The fork server only applies resource limits and
+# cannot be wrapped by box or run in a cgroup, so it is used only when
+# USE_BOX_IN_SANDBOX is False and SANDBOX_EXECUTOR is not 'cgroup'.  Nor
+# is it used when test cases are evaluated in parallel processes (with
+# GRADER_TESTCASE_WORKERS and the 'shell' executor), as each process would
+# start a server for a single test case.
+PYTHON_FORKSERVER = False
+
+# Path of a class data sharing archive for the JVM running Java
+# submissions (see INSTALL_NOTES).  Mapping preloaded classes from the
+# archive cuts the JVM startup paid by every test case.  The JVM ignores
+# an archive that is missing or was dumped by another JVM, with a warning
+# on standard error (not in the program's output).  This needs Java 10 or
+# later, for -XX:SharedArchiveFile and -Xlog.  Set this to None to not use
+# an archive.
+JAVA_CDS_ARCHIVE = None
+
+# Set this to True to have each grader worker build Java submissions with a
+# long-lived javac (see sandbox/compileserver.py) instead of starting the
+# javac JVM for every build.  The compile server is restarted after
+# JAVA_COMPILE_SERVER_MAX_COMPILES builds or once its resident memory
+# exceeds JAVA_COMPILE_SERVER_MAX_MEMORY MB.  A build the server does not
+# finish in JAVA_COMPILE_SERVER_TIMEOUT seconds is run with javac again.
+JAVA_COMPILE_SERVER = False
+JAVA_COMPILE_SERVER_MAX_COMPILES = 500
+JAVA_COMPILE_SERVER_MAX_MEMORY = 512
+JAVA_COMPILE_SERVER_TIMEOUT = 60
+
 # Default time limit in seconds for grading
 DEFAULT_TIME_LIMIT = 2
 
@@ -198,6 +393,12 @@ USE_WALL_CLOCK = True
 # Default memory limit in MB for grading
 DEFAULT_MEMORY_LIMIT = 2560
 
+# Default limit in MB on the size of each file (including the output)
+# written by a graded program.  A program writing past it is killed and
+# its test case is reported as exceeding the output limit.  This also
+# applies to programs run by box (see BOX_OUTPUT_LIMIT).
+DEFAULT_OUTPUT_LIMIT = 16
+
 ### logging settings ###
 
 # log all accesses to previous submissions
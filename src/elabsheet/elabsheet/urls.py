@@ -4,9 +4,11 @@ from django.urls import include,path
 from django.conf.urls.static import static
 from django.conf import settings
 from lab.views import index
+from grader.views import metrics
 
 urlpatterns = [
     path('', index,name='index'),
+    path('metrics', metrics,name='metrics'),
     path('admin/', admin.site.urls),
     path('admin/doc/', include('django.contrib.admindocs.urls')),
     path('cms/', include('cms.urls')),
@@ -14,6 +16,7 @@ urlpatterns = [
     path('instr/', include('instr.urls')),
     path('feedback/', include('feedback.urls')),
     path('taskpads/', include('taskpads.urls')),
+    path('grader/', include('grader.urls')),
     path('accounts/', include('django.contrib.auth.urls')),
 ] \
 + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT) \
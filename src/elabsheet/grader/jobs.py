@@ -0,0 +1,197 @@
+"""
+Grading jobs of the web app for remote graders.
+
+Remote graders (see grader/remote.py) have no access to the database.
+Through the job API (see the api_* views), they claim submissions and
+receive each one as a self-contained bundle: a JSON-serializable dict with
+the dumped code, the language, the build flags, the test cases, and the
+versions of the grading supplements, which they download once (and again
+only when changed).  Results of grading a bundle are posted back and saved
+here, as graders running in the web app's own environment (run_grader) do
+with the functions below.
+"""
+import hashlib
+import logging
+import os
+
+from django.urls import reverse
+from django.utils import timezone
+
+from cms.models import CachedGradingResult
+from commons import metrics
+from commons.models import TestCaseResult
+from commons.timing import Timing
+from lab.models import Submission, GradingTiming
+
+logger = logging.getLogger(__name__)
+
+
+def save_grading_result(submission,
+                        grading_results,
+                        manual_grading_results,
+                        compiler_messages,
+                        start_time):
+    result_list = [r['passed'] for r in grading_results]
+
+    submission.compiler_messages = compiler_messages
+    submission.results = result_list
+    submission.stats = [r.get('stats') for r in grading_results]
+    submission.manual_scores = manual_grading_results
+    submission.start_grading_at = start_time
+    submission.graded_at = timezone.now()
+    submission.code_grading_status = Submission.CODE_STATUS_GRADED
+    submission.claimed_by = ''
+    submission.lease_expires_at = None
+    submission.grading_attempts = 0
+
+    submission.save()
+
+
+def record_timing(submission, task, grading_timing, cached):
+    for phase, (seconds, count) in grading_timing.phases.items():
+        metrics.GRADING_PHASE.observe(seconds, phase=phase)
+    metrics.GRADING_PHASE.observe(grading_timing.total, phase='total')
+    metrics.flush()
+    if GradingTiming.sampled():
+        GradingTiming.record(submission, task, grading_timing,
+                             cached=bool(cached))
+
+
+def observe_queue_wait(submission, start_time):
+    if submission.regrade_job_id is not None:
+        metrics.QUEUE_WAIT.observe(
+            (start_time - submission.regrade_job.created_at).total_seconds(),
+            lane='regrade')
+    elif submission.graded_at is None:
+        metrics.QUEUE_WAIT.observe(
+            (start_time - submission.submitted_at).total_seconds(),
+            lane='live')
+    # otherwise, an individual regrade whose request time is unknown
+
+
+def get_supplement_version(supplement):
+    """
+    Returns a digest that changes whenever the supplement's file does, so
+    that remote graders keep downloaded supplements until then.
+    """
+    h = hashlib.sha256(supplement.data_file.name.encode('utf-8'))
+    try:
+        st = os.stat(supplement.data_file.path)
+        h.update(('\0%d:%d' % (st.st_size, st.st_mtime_ns)).encode('utf-8'))
+    except OSError:
+        pass
+    return h.hexdigest()
+
+
+def make_bundle(submission):
+    """
+    Returns the grading bundle of a claimed submission.
+    """
+    submission.make_task_concrete()
+    task = submission.assignment.task
+    if task.is_childtask():
+        # expected outputs of child tasks are computed when first needed
+        task.evaluate_testcases_once()
+    return {
+        'submission_id': submission.id,
+        'task_id': task.id,
+        'submitter': submission.user.username,
+        'language': task.language,
+        'flags': task.code.flags,
+        'code': task.code.dump(submission.answer),
+        'stop_on_failure': task.stop_on_failure,
+        'testcases': [{'input': testcase['input'],
+                       'output': testcase['output']}
+                      for testcase in task.testcases],
+        'supplements': [{'id': supplement.id,
+                         'name': os.path.basename(supplement.data_file.name),
+                         'version': get_supplement_version(supplement),
+                         'url': reverse('grader:api-supplement',
+                                        args=[supplement.id])}
+                        for supplement in task.supplement_set.order_by('id')],
+    }
+
+
+def claim_bundles(grader_id, limit):
+    """
+    Claims up to limit submissions for grader_id and returns their
+    bundles.  Submissions whose results are cached are saved right away
+    instead of being handed out.  Submissions that cannot be bundled
+    (e.g., their task is broken) are put back to the queue, or given up
+    on after settings.GRADER_MAX_ATTEMPTS claims, as if their grader had
+    stopped (see Submission.reap_expired_claims).
+    """
+    bundles = []
+    failed = []
+    for submission in Submission.claim_inqueue_submissions(limit, grader_id):
+        try:
+            bundle = claim_bundle(submission)
+        except Exception:
+            logger.exception('cannot bundle submission %d', submission.id)
+            failed.append(submission)
+            continue
+        if bundle is not None:
+            bundles.append(bundle)
+    if failed:
+        Submission.expire_claims(failed)
+        Submission.reap_expired_claims()
+    return bundles
+
+
+def claim_bundle(submission):
+    """
+    Returns the bundle of a claimed submission, or None when its cached
+    result has been saved instead.
+    """
+    start_time = timezone.now()
+    observe_queue_wait(submission, start_time)
+    if CachedGradingResult.enabled():
+        submission.make_task_concrete()
+        task = submission.assignment.task
+        cached = CachedGradingResult.lookup(task, submission.answer)
+        if cached:
+            save_grading_result(
+                submission,
+                [{'passed': r} for r in cached.get_results()],
+                task.verify_manual_auto_gradable_fields(submission.answer),
+                cached.compiler_messages,
+                start_time)
+            return None
+    return make_bundle(submission)
+
+
+def save_bundle_result(submission, result):
+    """
+    Saves the result posted by a remote grader for the bundle of
+    submission (see grader.remote.grade_bundle).  Raises ValueError,
+    saving nothing, unless the result has one valid TestCaseResult and
+    stats for each test case of the task.
+    """
+    submission.make_task_concrete()
+    task = submission.assignment.task
+    if not (len(result['results']) == len(result['stats']) ==
+            len(task.testcases or [])):
+        raise ValueError('expected {} results'.format(len(task.testcases or [])))
+    for passed in result['results']:
+        if type(passed) is not int or passed not in TestCaseResult.RESULTS:
+            raise ValueError('invalid result {!r}'.format(passed))
+    grading_results = [{'passed': TestCaseResult(passed), 'stats': stats}
+                       for passed, stats in zip(result['results'],
+                                                result['stats'])]
+    grading_timing = Timing.from_dict(result.get('phases') or {},
+                                      result.get('total') or 0)
+    start_time = timezone.now() - timezone.timedelta(
+            seconds=grading_timing.total)
+    save_grading_result(submission,
+                        grading_results,
+                        task.verify_manual_auto_gradable_fields(submission.answer),
+                        result['compiler_messages'],
+                        start_time)
+    # timeouts depend on the grader's load, so do not reuse them
+    if CachedGradingResult.enabled() and not any(
+            r['passed'].timeout() for r in grading_results):
+        CachedGradingResult.store(task,
+                                  submission.answer,
+                                  [r['passed'] for r in grading_results],
+                                  result['compiler_messages'])
+    record_timing(submission, task, grading_timing, False)
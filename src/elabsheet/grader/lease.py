@@ -0,0 +1,69 @@
+"""
+Keeps the claims of a grader alive while it is grading.
+
+Claimed submissions carry the claiming grader's id and a lease expiry
+time (see Submission.claim_queued_submissions).  While a grader works on
+its submissions, a LeaseRenewer thread extends their leases every third
+of settings.GRADER_LEASE_DURATION, so that long test cases never let a
+lease expire.  Once a grader dies, its leases expire and any other
+grader puts its submissions back to the queue
+(Submission.reap_expired_claims).
+"""
+import os
+import socket
+import threading
+
+from django import db
+from django.conf import settings
+
+
+def get_grader_id(pid=None):
+    """
+    Returns an id of the grader with the given PID (default: this
+    process) that is unique among graders sharing a database, e.g., those
+    in different containers.
+    """
+    if pid is None:
+        pid = os.getpid()
+    return '%s:%d' % (socket.gethostname(), pid)
+
+
+class LeaseRenewer(threading.Thread):
+
+    def __init__(self, grader_id):
+        super().__init__(daemon=True)
+        self.grader_id = grader_id
+        self.stopped = threading.Event()
+
+    def run(self):
+        interval = settings.GRADER_LEASE_DURATION / 3.0
+        try:
+            while not self.stopped.wait(interval):
+                self.renew()
+        finally:
+            self.close()
+
+    def renew(self):
+        # remote graders renew their leases without the ORM
+        from lab.models import Submission
+
+        try:
+            Submission.renew_leases(self.grader_id)
+        except db.Error:
+            # reconnect and try again before the lease expires
+            db.connection.close()
+
+    def close(self):
+        # this thread has its own connection
+        db.connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cms.models import Task
+from lab.models import GradingTiming
+
+
+class Command(BaseCommand):
+
+    help = ('Summarize the time graders spent on each task, by phase '
+            '(see GRADER_TIMING_SAMPLE_RATE)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=float, default=24,
+                help='Summarize gradings of the last SINCE hours '
+                     '(default: 24)')
+        parser.add_argument('--task', type=int, default=None,
+                help='Show only the task with this id, with its '
+                     'slowest gradings')
+        parser.add_argument('--limit', type=int, default=20,
+                help='Number of tasks (or gradings) shown (default: 20)')
+        parser.add_argument('--prune', type=float, default=None,
+                metavar='DAYS',
+                help='Delete timings of gradings older than DAYS days '
+                     'instead (see GRADER_TIMING_RETENTION_DAYS)')
+
+    def handle(self, *args, **options):
+        if options['prune'] is not None:
+            count = GradingTiming.prune(options['prune'])
+            self.stdout.write('{} timing(s) deleted'.format(count))
+            return
+
+        timings = GradingTiming.objects.filter(
+                graded_at__gte=timezone.now() -
+                    timezone.timedelta(hours=options['since']))
+        if options['task'] is not None:
+            timings = timings.filter(task_id=options['task'])
+
+        summaries = GradingTiming.summarize(timings)[:options['limit']]
+        if not summaries:
+            self.stdout.write('No gradings timed')
+            return
+
+        names = dict(Task.objects
+                     .filter(id__in=[s['task_id'] for s in summaries])
+                     .values_list('id', 'name'))
+        self.stdout.write('{:>6} {:<30} {:>6} {:>9} {:>7} {:>7}   {}'.format(
+            'task', 'name', 'count', 'total(s)', 'mean', 'p95',
+            'mean seconds by phase'))
+        for summary in summaries:
+            phases = sorted(summary['phases'].items(),
+                            key=lambda phase: -phase[1])
+            self.stdout.write(
+                '{:>6} {:<30.30} {:>6} {:>9.1f} {:>7.3f} {:>7.3f}   {}'.format(
+                summary['task_id'],
+                names.get(summary['task_id'], ''),
+                summary['count'],
+                summary['total'],
+                summary['total'] / summary['count'],
+                summary['p95'],
+                ' '.join('{}={:.3f}'.format(phase, seconds)
+                         for phase, seconds in phases)))
+
+        if options['task'] is not None:
+            self.stdout.write('\nSlowest gradings:')
+            for t in timings.order_by('-total')[:options['limit']]:
+                self.stdout.write('submission:{} at {} {:.3f}s{} {}'.format(
+                    t.submission_id,
+                    timezone.localtime(t.graded_at).strftime('%Y-%m-%d %H:%M:%S'),
+                    t.total,
+                    ' (cached)' if t.cached else '',
+                    ' '.join('{}={:.3f}/{}'.format(phase, seconds, count)
+                             for phase, (seconds, count) in t.phases.items())))
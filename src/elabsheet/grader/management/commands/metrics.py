@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from grader.metrics import render_metrics
+
+
+class Command(BaseCommand):
+
+    help = ('Print metrics of graders and of the web app in the '
+            'Prometheus text format')
+
+    def handle(self, *args, **options):
+        self.stdout.write(render_metrics(), ending='')
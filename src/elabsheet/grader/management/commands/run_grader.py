@@ -3,52 +3,55 @@ import datetime
 import os
 import os.path
 import sys
+import signal
+import multiprocessing
 
+from django import db
 from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
 from elabsheet import settings
 from lab.models import Submission
+from cms.models import CachedGradingResult
+from commons import metrics, timing
+from sandbox.scratch import get_scratch_space
+from sandbox.pch import prepare_precompiled_headers
+from sandbox import compileserver
+from grader.wakeup import WakeupListener, wakeup_supported, wake_grader
+from grader.lease import LeaseRenewer, get_grader_id
+from grader.stopfile import get_stop_filename, check_stop_file, \
+        delete_stop_file, create_stop_file
+from grader.jobs import save_grading_result, record_timing, \
+        observe_queue_wait
 
+# how long (in seconds) an idle grader waits before checking the queue
+# again, when graders cannot be woken up by notifications
 SLEEP_INTERVAL = 1
 
-def get_stop_filename(pid):
-    return os.path.join(settings.BASE_DIR, 'grader', 'stop.%d' % pid)
-
-def check_stop_file(pid):
-    return os.path.exists(get_stop_filename(pid))
-
-def delete_stop_file(pid):
-    os.remove(get_stop_filename(pid))
-
-
-def save_grading_result(submission, 
-                        grading_results, 
-                        manual_grading_results, 
-                        compiler_messages,
-                        start_time):
-    result_list = [r['passed'] for r in grading_results]
-            
-    submission.compiler_messages = compiler_messages
-    submission.results = result_list
-    submission.manual_scores = manual_grading_results
-    submission.start_grading_at = start_time
-    submission.graded_at = timezone.now()
-    submission.code_grading_status = Submission.CODE_STATUS_GRADED
-    
-    submission.save()
+# how often (in seconds) the supervisor checks its workers
+SUPERVISE_INTERVAL = 1
 
+# how often (in seconds) a grader looks for expired claims of other graders
+REAP_INTERVAL = 30
 
 
 class Command(BaseCommand):
 
     help = 'Run a grader'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                help='Number of grading worker processes to be started '
+                     'and watched by a supervisor (default: 1, i.e., '
+                     'grade in this process without a supervisor)')
+
     @property
     def now(self):
         return timezone.localtime(
                 timezone.now()).strftime("[%Y-%m-%d %H:%M:%S.%f]")
 
     def log(self, msg, style=lambda x:x):
+        if self.tag:
+            msg = self.tag + " " + msg
         print(self.now,msg,file=self.log_file)
         self.log_file.flush()
         if self.isatty:
@@ -81,67 +84,253 @@ class Command(BaseCommand):
         #    return
 
         self.isatty = sys.stdout.isatty()
+        self.tag = None
 
         # get my pid, will keep logs in log/{pid}.log and log/output.{pid}.log
+        # (workers started by a supervisor share the supervisor's logs)
         my_pid = os.getpid()
         log_filename = os.path.join(settings.GRADER_LOG_DIR, '%d.log' % my_pid)
         self.log_file = open(log_filename,'a+')
 
-        self.log("Grader started with PID {}".format(my_pid), style=self.style.SUCCESS)
-        self.log("Log file: {}".format(log_filename), style=self.style.WARNING)
-
         if settings.GRADER_OUTPUT_LOG:
             self.output_log_file = open(os.path.join(settings.GRADER_LOG_DIR,
                                                 ('output.%d.log' % my_pid)),
                                    'a+')
 
-        while True:
+        # before starting workers, so that they share the headers
+        self.prepare_precompiled_headers()
+
+        if options['workers'] > 1:
+            self.tag = "[supervisor]"
+            self.log("Supervisor started with PID {} for {} workers".format(
+                my_pid, options['workers']), style=self.style.SUCCESS)
+            self.log("Log file: {}".format(log_filename), style=self.style.WARNING)
+            self.supervise(options['workers'])
+        else:
+            self.log("Grader started with PID {}".format(my_pid), style=self.style.SUCCESS)
+            self.log("Log file: {}".format(log_filename), style=self.style.WARNING)
+            self.grade_loop(my_pid)
+
+        self.log_file.close()
+        if settings.GRADER_OUTPUT_LOG:
+            self.output_log_file.close()
+
+
+    def prepare_precompiled_headers(self):
+        for language, message in prepare_precompiled_headers():
+            self.log("Precompiled headers of {}: {}".format(language, message),
+                     style=self.style.WARNING)
+
+
+    def start_worker(self, worker_id):
+        # workers must open their own database connections
+        db.connections.close_all()
+        ctx = multiprocessing.get_context('fork')
+        # not a daemon, as a worker may fork its own test case evaluators
+        worker = ctx.Process(target=self.run_worker, args=(worker_id,))
+        worker.start()
+        self.log("Worker {} started with PID {}".format(worker_id, worker.pid),
+                 style=self.style.SUCCESS)
+        return worker
+
+
+    def run_worker(self, worker_id):
+        self.tag = "[worker {}]".format(worker_id)
+        # let the supervisor decide when to stop
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.grade_loop(os.getpid())
+
+
+    def supervise(self, num_workers):
+        """
+        Starts num_workers grading workers and restarts any of them that
+        exits unexpectedly.  When the supervisor's stop file appears (or
+        the supervisor receives SIGTERM/SIGINT), every worker is asked to
+        stop through its own stop file, and the supervisor waits for all
+        of them to finish their current submissions.
+        """
+        stop_requested = []
+        def request_stop(signum, frame):
+            stop_requested.append(signum)
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        my_pid = os.getpid()
+        workers = {}
+        for worker_id in range(1, num_workers+1):
+            workers[worker_id] = self.start_worker(worker_id)
+
+        while not stop_requested:
             if check_stop_file(my_pid):
                 delete_stop_file(my_pid)
                 break
 
-            submission = Submission.fetch_one_inqueue_submission()
-
-            if submission != None:
-                self.log("Grading (submission:{} task:{} user:{} section:{})"
-                         " submitted at {}".format(
-                    submission.id, 
-                    submission.assignment.task_id, 
-                    submission.user, 
-                    submission.section_id,
-                    timezone.localtime(submission.submitted_at).strftime("%Y-%m-%d %H:%M:%S"),
-                    ), style=self.style.WARNING)
-                submission.make_task_concrete()
-                task = submission.assignment.task
-                if settings.GRADER_OUTPUT_LOG:
-                    output_buffer = []
-                else:
-                    output_buffer = None
-                start_time = timezone.now()
-
-                os.putenv("SUBMITTER",submission.user.username)
-
-                # XXX get into codeSeg.sequence to get the list of blanks
+            for worker_id, worker in list(workers.items()):
+                if not worker.is_alive():
+                    worker.join()
+                    self.log("Worker {} (PID {}) exited with code {}, "
+                             "restarting".format(
+                                worker_id, worker.pid, worker.exitcode),
+                             style=self.style.ERROR)
+                    workers[worker_id] = self.start_worker(worker_id)
+
+            time.sleep(SUPERVISE_INTERVAL)
+
+        self.log("Stopping workers", style=self.style.WARNING)
+        for worker in workers.values():
+            if worker.is_alive():
+                create_stop_file(worker.pid)
+                wake_grader(worker.pid)
+        for worker_id, worker in workers.items():
+            worker.join()
+            # remove the stop file of a worker that died before seeing it
+            if check_stop_file(worker.pid):
+                delete_stop_file(worker.pid)
+            self.log("Worker {} (PID {}) stopped".format(worker_id, worker.pid),
+                     style=self.style.WARNING)
+
+
+    def grade_submission(self, submission):
+        self.log("Grading (submission:{} task:{} user:{} section:{})"
+                 " submitted at {}".format(
+            submission.id, 
+            submission.assignment.task_id, 
+            submission.user, 
+            submission.section_id,
+            timezone.localtime(submission.submitted_at).strftime("%Y-%m-%d %H:%M:%S"),
+            ), style=self.style.WARNING)
+        timing.start()
+        with timing.span('concrete'):
+            submission.make_task_concrete()
+        task = submission.assignment.task
+        if settings.GRADER_OUTPUT_LOG:
+            output_buffer = []
+        else:
+            output_buffer = None
+        start_time = timezone.now()
+        observe_queue_wait(submission, start_time)
+
+        # also visible to sandboxes started with their own environment
+        os.environ["SUBMITTER"] = submission.user.username
+
+        # XXX get into codeSeg.sequence to get the list of blanks
 
+        # outputs are not cached, so always grade when they are to be logged
+        use_cache = CachedGradingResult.enabled() and output_buffer is None
+        cached = None
+        if use_cache:
+            with timing.span('cache_lookup'):
+                cached = CachedGradingResult.lookup(task,submission.answer)
+            self.cache_lookups += 1
+
+        if cached:
+            self.cache_hits += 1
+            grading_results = [{'passed': r} for r in cached.get_results()]
+            messages = cached.compiler_messages
+        else:
+            with timing.span('verify'):
                 grading_results, messages = task.verify_with_messages(submission.answer,output_buffer)
-                manual_grading_results = task.verify_manual_auto_gradable_fields(submission.answer)
-                save_grading_result(submission, 
-                                    grading_results, 
-                                    manual_grading_results,
-                                    messages,
-                                    start_time)
-
-                self.log("result [{}]".format(
-                    "".join(str(r) for r in submission.results),
-                    ), style=self.style.SUCCESS)
-
-                if settings.GRADER_OUTPUT_LOG:
-                    log_output(output_log_file, submission, 
-                               messages, output_buffer)
+            # timeouts depend on the grader's load, so do not reuse them
+            if use_cache and not any(r['passed'].timeout()
+                                     for r in grading_results):
+                CachedGradingResult.store(task,
+                                          submission.answer,
+                                          [r['passed'] for r in grading_results],
+                                          messages)
+        with timing.span('manual'):
+            manual_grading_results = task.verify_manual_auto_gradable_fields(submission.answer)
+        with timing.span('save'):
+            save_grading_result(submission, 
+                                grading_results, 
+                                manual_grading_results,
+                                messages,
+                                start_time)
+        record_timing(submission, task, timing.stop(), cached)
+
+        scratch_report = get_scratch_space().report()
+        self.log("result [{}]{}{}".format(
+            "".join(str(r) for r in submission.results),
+            self.cache_report(cached) if use_cache else "",
+            " ({})".format(scratch_report) if scratch_report else "",
+            ), style=self.style.SUCCESS)
+
+        if settings.GRADER_OUTPUT_LOG:
+            self.log_output(submission, messages, output_buffer)
+
+
+    def reap_expired_claims(self):
+        requeued, abandoned = Submission.reap_expired_claims()
+        for submission in requeued:
+            self.log("Requeued submission:{} claimed by {} "
+                     "(attempt {} of {})".format(
+                submission.id,
+                submission.claimed_by or "unknown grader",
+                submission.grading_attempts,
+                settings.GRADER_MAX_ATTEMPTS,
+                ), style=self.style.ERROR)
+        for submission in abandoned:
+            self.log("Abandoned submission:{} claimed by {} "
+                     "after {} attempts".format(
+                submission.id,
+                submission.claimed_by or "unknown grader",
+                submission.grading_attempts,
+                ), style=self.style.ERROR)
+
+
+    def cache_report(self, cached):
+        return " ({}, cache hit rate {:.1f}% of {})".format(
+            "cached" if cached else "graded",
+            100.0 * self.cache_hits / self.cache_lookups,
+            self.cache_lookups)
+
+
+    def grade_loop(self, my_pid):
+        self.cache_lookups = 0
+        self.cache_hits = 0
+
+        if wakeup_supported():
+            wakeup = WakeupListener(my_pid)
+        else:
+            wakeup = None
+
+        grader_id = get_grader_id(my_pid)
+        last_reaped_at = 0
+
+        # each worker builds Java submissions with its own compile server
+        compileserver.enable()
+
+        # submissions claimed by this grader but not yet graded
+        batch = []
+
+        while True:
+            if check_stop_file(my_pid):
+                delete_stop_file(my_pid)
+                break
+
+            if time.time() - last_reaped_at >= REAP_INTERVAL:
+                self.reap_expired_claims()
+                last_reaped_at = time.time()
+
+            if not batch:
+                claim_started_at = time.time()
+                batch = Submission.claim_inqueue_submissions(
+                        settings.GRADER_CLAIM_BATCH_SIZE, grader_id)
+                metrics.CLAIM_LATENCY.observe(time.time() - claim_started_at)
+
+            if batch:
+                with LeaseRenewer(grader_id):
+                    self.grade_submission(batch.pop(0))
+            elif wakeup:
+                wakeup.wait(settings.GRADER_WAKEUP_TIMEOUT)
             else:
                 time.sleep(SLEEP_INTERVAL)
 
-        self.log_file.close()
-        if settings.GRADER_OUTPUT_LOG:
-            self.output_log_file.close()
+        if batch:
+            # let other graders take the rest
+            Submission.release_submissions(batch)
+
+        compileserver.disable()
 
+        if wakeup:
+            wakeup.close()
@@ -0,0 +1,114 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.utils import timezone
+from commons.models import TestCaseResult
+from grader.lease import get_grader_id
+from sandbox.pch import prepare_precompiled_headers
+from sandbox import compileserver
+from grader.remote import GraderClient, RemoteLeaseRenewer, \
+        JobApiError, ClaimLost
+from grader.stopfile import check_stop_file, delete_stop_file
+
+
+class Command(BaseCommand):
+
+    help = ('Run a grader that claims submissions from the job API of a '
+            'web app, without database access')
+
+    # with remote_grader_settings, the URLconf cannot be checked
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('server',
+                help='URL of the web app, e.g., https://elab.example.com/')
+        parser.add_argument('--token',
+                default=os.environ.get('ELAB_GRADER_API_TOKEN',
+                                       settings.GRADER_API_TOKEN),
+                help='Token of the job API (default: $ELAB_GRADER_API_TOKEN '
+                     'or GRADER_API_TOKEN)')
+        parser.add_argument('--batch', type=int,
+                default=settings.GRADER_CLAIM_BATCH_SIZE,
+                help='Number of submissions claimed at once '
+                     '(default: GRADER_CLAIM_BATCH_SIZE)')
+        parser.add_argument('--poll-interval', type=float, default=1,
+                help='Seconds to wait before claiming again when there is '
+                     'nothing to grade (default: 1)')
+        parser.add_argument('--supplement-dir',
+                default=os.path.join(settings.BASE_DIR, 'tmp',
+                                     'remote-supplements'),
+                help='Directory of downloaded grading supplements')
+
+    def log(self, msg, style=lambda x:x):
+        now = timezone.localtime(
+                timezone.now()).strftime("[%Y-%m-%d %H:%M:%S.%f]")
+        self.stdout.write(now + " " + style(msg))
+
+    def handle(self, *args, **options):
+        if not options['token']:
+            raise CommandError('No token of the job API given')
+
+        my_pid = os.getpid()
+        client = GraderClient(options['server'],
+                              options['token'],
+                              get_grader_id(my_pid),
+                              options['supplement_dir'])
+        self.log("Remote grader started with PID {} for {}".format(
+            my_pid, client.api_url), style=self.style.SUCCESS)
+        for language, message in prepare_precompiled_headers():
+            self.log("Precompiled headers of {}: {}".format(language, message),
+                     style=self.style.WARNING)
+
+        compileserver.enable()
+
+        # bundles claimed by this grader but not yet graded
+        batch = []
+        try:
+            while True:
+                if check_stop_file(my_pid):
+                    delete_stop_file(my_pid)
+                    break
+
+                if not batch:
+                    try:
+                        batch = client.claim(options['batch'])
+                    except JobApiError as e:
+                        self.log("Cannot claim submissions: {}".format(e),
+                                 style=self.style.ERROR)
+
+                if batch:
+                    with RemoteLeaseRenewer(client):
+                        self.grade_bundle(client, batch.pop(0))
+                else:
+                    time.sleep(options['poll_interval'])
+        finally:
+            if batch:
+                # let other graders take the rest
+                try:
+                    client.release(batch)
+                except JobApiError:
+                    pass
+            compileserver.disable()
+
+    def grade_bundle(self, client, bundle):
+        self.log("Grading (submission:{} task:{})".format(
+            bundle['submission_id'], bundle['task_id']),
+            style=self.style.WARNING)
+        result = client.grade(bundle)
+        try:
+            client.submit(bundle, result)
+        except ClaimLost:
+            self.log("Claim on submission:{} lost, result dropped".format(
+                bundle['submission_id']), style=self.style.ERROR)
+            return
+        except JobApiError as e:
+            # the submission is graded again once its lease expires
+            self.log("Cannot submit result of submission:{}: {}".format(
+                bundle['submission_id'], e), style=self.style.ERROR)
+            return
+        self.log("result [{}] in {:.3f}s".format(
+            "".join(str(TestCaseResult(r)) for r in result['results']),
+            result['total']),
+            style=self.style.SUCCESS)
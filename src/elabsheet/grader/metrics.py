@@ -0,0 +1,56 @@
+"""
+Exposition of grading metrics (see commons/metrics.py), together with
+gauges of the grading queue read from the database.
+"""
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from commons import metrics
+from lab.models import Submission
+
+QUEUE_STATUSES = [
+    (Submission.CODE_STATUS_INQUEUE, 'inqueue'),
+    (Submission.CODE_STATUS_REGRADE, 'regrade'),
+    (Submission.CODE_STATUS_GRADING, 'grading'),
+]
+
+
+def get_queue_gauges():
+    """
+    Returns gauges of the number of submissions waiting for (or being)
+    graded by status, and of how long the oldest one of each lane has
+    waited.
+    """
+    statuses = dict(QUEUE_STATUSES)
+    counts = dict(Submission.objects
+                  .filter(code_grading_status__in=statuses.keys())
+                  .values_list('code_grading_status')
+                  .annotate(count=Count('id'))
+                  .order_by())
+    depth = [([('status', name)], counts.get(status, 0))
+             for status, name in QUEUE_STATUSES]
+
+    now = timezone.now()
+    oldest = Submission.objects.filter(
+            code_grading_status=Submission.CODE_STATUS_INQUEUE).aggregate(
+            oldest=Min('submitted_at'))['oldest']
+    oldest_regrade = Submission.objects.filter(
+            code_grading_status=Submission.CODE_STATUS_REGRADE).aggregate(
+            oldest=Min('regrade_job__created_at'))['oldest']
+    ages = []
+    for lane, oldest_at in (('live', oldest), ('regrade', oldest_regrade)):
+        age = (now - oldest_at).total_seconds() if oldest_at else 0
+        ages.append(([('lane', lane)], age))
+
+    return [
+        ('elab_queue_depth',
+         'Submissions waiting for or being graded, by status',
+         depth),
+        ('elab_queue_oldest_age_seconds',
+         'How long the oldest submission of each lane has waited',
+         ages),
+    ]
+
+
+def render_metrics():
+    return metrics.registry.render(get_queue_gauges())
@@ -0,0 +1,230 @@
+"""
+Client of remote graders, which grade submissions without database
+access.
+
+A remote grader claims grading bundles from the job API of the web app
+(see grader/jobs.py), grades each one in its own sandboxes and posts the
+result back, while a RemoteLeaseRenewer keeps its claims alive through
+the API.  Supplements are downloaded into a local directory once per
+version, and older versions are removed then.
+
+Bundles are graded by Task's own grading methods (see cms/grading.py),
+run on a BundledTask standing in for the task, so that remote graders
+grade exactly as local ones do.  Nothing here uses the ORM, so remote
+graders run with elabsheet.remote_grader_settings, without a database.
+"""
+import os
+import json
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from cms.grading import GradingMixin, SupplementMixin
+from commons import timing
+from grader.lease import LeaseRenewer
+from sandbox.cache import SupplementCache
+
+API_PATH = 'grader/api/'
+
+
+class JobApiError(Exception):
+    pass
+
+
+class ClaimLost(JobApiError):
+    """
+    Raised when a result is posted for a submission no longer claimed by
+    the grader, e.g., after its lease expired.
+    """
+    pass
+
+
+class BundledCode:
+
+    def __init__(self, body, flags):
+        self.body = body
+        self.flags = flags
+
+    def dump(self, answer):
+        # the code of a bundle is already dumped with the answer
+        return self.body
+
+
+class BundledSupplement(SupplementMixin):
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def archive_path(self):
+        return self.filename
+
+
+class BundledSupplementSet(list):
+
+    def all(self):
+        return self
+
+
+class BundledTask(GradingMixin):
+    """
+    Stands in for the task of a bundle in Task's grading methods.
+    """
+
+    def __init__(self, bundle, supplement_filenames):
+        self.id = bundle['task_id']
+        self.language = bundle['language']
+        self.code = BundledCode(bundle['code'], bundle['flags'])
+        self.stop_on_failure = bundle['stop_on_failure']
+        self.testcases = bundle['testcases']
+        self.supplement_set = BundledSupplementSet(
+                BundledSupplement(filename)
+                for filename in supplement_filenames)
+
+
+def grade_bundle(bundle, supplement_filenames):
+    """
+    Grades a bundle whose supplements have been downloaded into the given
+    files.  Returns the grading results (see Task.verify_with_messages)
+    and compiler messages.
+    """
+    # also visible to sandboxes started with their own environment
+    os.environ['SUBMITTER'] = bundle['submitter']
+    task = BundledTask(bundle, supplement_filenames)
+    with timing.span('verify'):
+        return task.verify_with_messages({})
+
+
+class GraderClient:
+
+    def __init__(self, server_url, token, grader_id, supplement_dir,
+                 timeout=60):
+        self.api_url = urllib.parse.urljoin(server_url.rstrip('/') + '/',
+                                            API_PATH)
+        self.token = token
+        self.grader_id = grader_id
+        self.supplement_dir = supplement_dir
+        self.timeout = timeout
+
+    def open(self, url, data=None):
+        """
+        Returns the response to a request to url, POSTing data as JSON
+        unless it is None.
+        """
+        headers = {'Authorization': 'Bearer ' + self.token}
+        if data is not None:
+            data = json.dumps(data).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(url, data, headers)
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 409:
+                raise ClaimLost(url)
+            raise JobApiError('{} returned {}'.format(url, e.code))
+        except (urllib.error.URLError, OSError) as e:
+            raise JobApiError('{}: {}'.format(url, e))
+
+    def post(self, path, data):
+        data = dict(data, grader_id=self.grader_id)
+        with self.open(self.api_url + path, data) as response:
+            try:
+                return json.loads(response.read().decode('utf-8'))
+            except ValueError:
+                raise JobApiError('{} returned no JSON'.format(path))
+
+    def claim(self, limit=1):
+        return self.post('claim/', {'limit': limit})['bundles']
+
+    def renew(self):
+        return self.post('renew/', {})['renewed']
+
+    def release(self, bundles):
+        self.post('release/', {'submission_ids': [bundle['submission_id']
+                                                   for bundle in bundles]})
+
+    def submit(self, bundle, result):
+        self.post('result/{}/'.format(bundle['submission_id']), result)
+
+    def get_supplement(self, supplement):
+        """
+        Returns the local file of a supplement of a bundle, downloaded
+        unless already there.
+        """
+        filename = os.path.join(self.supplement_dir, '{}-{}-{}'.format(
+            supplement['id'], supplement['version'][:16], supplement['name']))
+        if os.path.exists(filename):
+            return filename
+        os.makedirs(self.supplement_dir, exist_ok=True)
+        url = urllib.parse.urljoin(self.api_url, supplement['url'])
+        fd, temp_filename = tempfile.mkstemp(dir=self.supplement_dir,
+                                             prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f, self.open(url) as response:
+                while True:
+                    chunk = response.read(65536)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            os.rename(temp_filename, filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+        self.remove_old_supplements(supplement['id'], keep=filename)
+        return filename
+
+    def remove_old_supplements(self, supplement_id, keep):
+        """
+        Removes the files of other versions of a supplement, and their
+        extracted copies (see SupplementCache), as the job API only hands
+        out the current version.
+        """
+        prefix = '{}-'.format(supplement_id)
+        cache = SupplementCache.from_settings()
+        for name in os.listdir(self.supplement_dir):
+            filename = os.path.join(self.supplement_dir, name)
+            if not name.startswith(prefix) or filename == keep:
+                continue
+            if cache:
+                cache.remove(filename)
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def grade(self, bundle):
+        """
+        Grades a bundle and returns the result to be submitted.
+        """
+        timing.start()
+        try:
+            with timing.span('download'):
+                filenames = [self.get_supplement(supplement)
+                             for supplement in bundle['supplements']]
+            results, messages = grade_bundle(bundle, filenames)
+        finally:
+            grading_timing = timing.stop()
+        return {
+            'results': [r['passed'].to_db() for r in results],
+            'stats': [r['stats'] for r in results],
+            'compiler_messages': messages,
+            'phases': grading_timing.to_dict(),
+            'total': round(grading_timing.total, 3),
+        }
+
+
+class RemoteLeaseRenewer(LeaseRenewer):
+
+    def __init__(self, client):
+        super().__init__(client.grader_id)
+        self.client = client
+
+    def renew(self):
+        try:
+            self.client.renew()
+        except JobApiError:
+            # try again before the lease expires
+            pass
+
+    def close(self):
+        pass
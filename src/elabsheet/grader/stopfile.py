@@ -0,0 +1,20 @@
+"""
+Stop files, through which graders are asked to stop after their current
+submission.
+"""
+import os
+
+from django.conf import settings
+
+
+def get_stop_filename(pid):
+    return os.path.join(settings.BASE_DIR, 'grader', 'stop.%d' % pid)
+
+def check_stop_file(pid):
+    return os.path.exists(get_stop_filename(pid))
+
+def delete_stop_file(pid):
+    os.remove(get_stop_filename(pid))
+
+def create_stop_file(pid):
+    open(get_stop_filename(pid),'w').close()
@@ -0,0 +1,393 @@
+import io
+import os
+import sys
+import json
+import shutil
+import zipfile
+import tempfile
+import subprocess
+from unittest import mock
+from datetime import date
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, LiveServerTestCase, \
+        override_settings
+from django.core.files.base import ContentFile
+from django.urls import reverse
+from django.contrib.auth.models import User
+
+from cms.models import Task, Lab, Assignment, GradingSupplement, Course
+from commons.models import TestCaseResult
+from lab.models import Submission, Semester, Section
+from . import jobs
+from .remote import GraderClient, BundledSupplement
+
+from .wakeup import WakeupListener, notify_graders, wake_grader, \
+        get_socket_filename
+
+
+class WakeupTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.wakeup_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+                GRADER_WAKEUP_DIR=self.wakeup_dir)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.wakeup_dir)
+
+    def test_notify_wakes_all_listeners(self):
+        listeners = [WakeupListener(pid) for pid in (1001,1002)]
+        for listener in listeners:
+            self.assertFalse(listener.wait(0))
+        notify_graders()
+        notify_graders()
+        for listener in listeners:
+            self.assertTrue(listener.wait(1))
+            # pending notifications are consumed at once
+            self.assertFalse(listener.wait(0))
+            listener.close()
+        self.assertEqual(os.listdir(self.wakeup_dir),[])
+
+    def test_wake_single_grader(self):
+        first = WakeupListener(1001)
+        second = WakeupListener(1002)
+        wake_grader(1002)
+        self.assertFalse(first.wait(0))
+        self.assertTrue(second.wait(1))
+        first.close()
+        second.close()
+
+    def test_stale_socket_removed(self):
+        listener = WakeupListener(1001)
+        # simulate a grader killed without cleaning up its socket
+        listener.sock.close()
+        notify_graders()
+        self.assertFalse(os.path.exists(get_socket_filename(1001)))
+
+
+@override_settings(METRICS_ALLOWED_ADDRESSES='10.0.0.1')
+class MetricsViewTestCase(TestCase):
+
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(METRICS_DIR=self.metrics_dir)
+        self.settings_override.enable()
+
+        task = Task(name="Task",source="Task\n====\n",language="python3")
+        task.save()
+        lab = Lab(name="Lab")
+        lab.save()
+        assignment = Assignment.objects.create(task=task,lab=lab,number="1")
+        user = User.objects.create(username="student")
+        for status in (Submission.CODE_STATUS_INQUEUE,
+                       Submission.CODE_STATUS_INQUEUE,
+                       Submission.CODE_STATUS_GRADING):
+            Submission.objects.create(assignment=assignment,user=user,
+                                      answer={},code_grading_status=status)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.metrics_dir)
+
+    def test_metrics_from_allowed_address(self):
+        response = self.client.get(reverse('metrics'),REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code,200)
+        lines = response.content.decode().splitlines()
+        self.assertIn('elab_queue_depth{status="inqueue"} 2',lines)
+        self.assertIn('elab_queue_depth{status="grading"} 1',lines)
+        self.assertIn('elab_queue_depth{status="regrade"} 0',lines)
+        self.assertIn('# TYPE elab_queue_wait_seconds histogram',lines)
+
+    def test_metrics_forbidden_elsewhere(self):
+        response = self.client.get(reverse('metrics'),REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code,403)
+
+
+MD_TASK_WITH_SUPPLEMENT = """\
+Task with Supplement
+====================
+
+::elab:begincode language="python3"
+x = int(input())
+print(open('data/a.txt').read().strip()*{{x}})
+::elab:endcode
+
+::elab:begintest
+1
+::elab:endtest
+
+::elab:begintest
+3
+::elab:endtest"""
+
+SUPERTASK_GENERATOR = """\
+def generate(seed,difficulty):
+    return locals()
+"""
+
+MD_SUPERTASK = """\
+Super Task
+==========
+
+::elab:begincode language="python3"
+print(int(input())+{{@seed@}})
+::elab:endcode
+
+::elab:begintest
+10
+::elab:endtest"""
+
+
+class JobApiTestMixin:
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root,
+                                                   GRADER_API_TOKEN='secret')
+        self.settings_override.enable()
+
+        zip_data = io.BytesIO()
+        with zipfile.ZipFile(zip_data,'w') as zf:
+            zf.writestr('data/a.txt','ab\n')
+        self.task = Task(name="Task",source=MD_TASK_WITH_SUPPLEMENT,
+                         language="python3")
+        self.task.save()
+        supplement = GradingSupplement(task=self.task)
+        supplement.data_file.save('data.zip',ContentFile(zip_data.getvalue()))
+        self.task.save()
+        lab = Lab(name="Lab")
+        lab.save()
+        assignment = Assignment.objects.create(task=self.task,lab=lab,number="1")
+        user = User.objects.create(username="student")
+        self.passing = Submission.objects.create(
+                assignment=assignment,user=user,answer={0:"x"},
+                code_grading_status=Submission.CODE_STATUS_INQUEUE)
+        self.failing = Submission.objects.create(
+                assignment=assignment,user=user,answer={0:"1"},
+                code_grading_status=Submission.CODE_STATUS_INQUEUE)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+
+class JobApiTestCase(JobApiTestMixin,TestCase):
+
+    def post(self,name,data,args=(),token='secret'):
+        return self.client.post(reverse('grader:'+name,args=args),
+                                json.dumps(data),
+                                content_type='application/json',
+                                HTTP_AUTHORIZATION='Bearer '+token)
+
+    def test_token_required(self):
+        response = self.post('api-claim',{'grader_id':'remote:1'},token='wrong')
+        self.assertEqual(response.status_code,403)
+        with self.settings(GRADER_API_TOKEN=None):
+            response = self.post('api-claim',{'grader_id':'remote:1'})
+        self.assertEqual(response.status_code,404)
+
+    def test_claim_bundle(self):
+        response = self.post('api-claim',{'grader_id':'remote:1'})
+        self.assertEqual(response.status_code,200)
+        bundle, = response.json()['bundles']
+        self.assertEqual(bundle['submission_id'],self.passing.id)
+        self.assertEqual(bundle['language'],'python3')
+        self.assertIn("*x)",bundle['code'])
+        self.assertEqual([t['output'] for t in bundle['testcases']],
+                         ["ab\n","ababab\n"])
+        supplement, = bundle['supplements']
+        self.assertEqual(supplement['name'],'data.zip')
+        self.passing.refresh_from_db()
+        self.assertEqual(self.passing.code_grading_status,
+                         Submission.CODE_STATUS_GRADING)
+        self.assertEqual(self.passing.claimed_by,'remote:1')
+
+        response = self.client.get(supplement['url'],
+                                   HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code,200)
+        self.assertTrue(zipfile.is_zipfile(io.BytesIO(b''.join(response))))
+
+    def test_claim_supertask_bundle(self):
+        task = Task(name="SuperTask",source=MD_SUPERTASK,language="python3",
+                    generator=SUPERTASK_GENERATOR)
+        task.save()
+        lab = Lab.objects.get()
+        assignment = Assignment.objects.create(task=task,lab=lab,number="2")
+        course = Course.objects.create(number="01204111",name="Course")
+        semester = Semester.objects.create(year=2561,term=1,
+                                           start_date=date(2018,8,1))
+        section = Section.objects.create(course=course,semester=semester,
+                                         name="1")
+        user = User.objects.get()
+        Submission.objects.filter(assignment__task=self.task).delete()
+        submission = Submission.objects.create(
+                assignment=assignment,user=user,section=section,
+                answer={0:"0"},
+                code_grading_status=Submission.CODE_STATUS_INQUEUE)
+
+        response = self.post('api-claim',{'grader_id':'remote:1'})
+        bundle, = response.json()['bundles']
+        self.assertEqual(bundle['submission_id'],submission.id)
+        seed = user.id+section.id+lab.id
+        self.assertEqual(bundle['testcases'],
+                         [{'input':'10','output':'%d\n' % (10+seed)}])
+
+    def test_claim_broken_bundle(self):
+        make_bundle = jobs.make_bundle
+        def fail_passing(submission):
+            if submission.id == self.passing.id:
+                raise IOError('bad supplement')
+            return make_bundle(submission)
+
+        with mock.patch('grader.jobs.make_bundle',side_effect=fail_passing), \
+             self.assertLogs('grader.jobs','ERROR'):
+            response = self.post('api-claim',{'grader_id':'remote:1','limit':2})
+        self.assertEqual(response.status_code,200)
+        bundle, = response.json()['bundles']
+        self.assertEqual(bundle['submission_id'],self.failing.id)
+        self.passing.refresh_from_db()
+        self.assertEqual(self.passing.code_grading_status,
+                         Submission.CODE_STATUS_INQUEUE)
+        self.assertEqual(self.passing.claimed_by,'')
+        self.assertEqual(self.passing.grading_attempts,1)
+
+        # given up on after too many attempts
+        Submission.objects.filter(id=self.passing.id).update(
+                grading_attempts=settings.GRADER_MAX_ATTEMPTS-1)
+        with mock.patch('grader.jobs.make_bundle',side_effect=fail_passing), \
+             self.assertLogs('grader.jobs','ERROR'):
+            response = self.post('api-claim',{'grader_id':'remote:1'})
+        self.assertEqual(response.json()['bundles'],[])
+        self.passing.refresh_from_db()
+        self.assertTrue(self.passing.graded())
+        self.assertEqual([str(r) for r in self.passing.results],["N","N"])
+
+    def test_result_of_lost_claim(self):
+        self.post('api-claim',{'grader_id':'remote:1'})
+        result = {'grader_id':'remote:2',
+                  'results':[TestCaseResult.RESULT_PASSED]*2,
+                  'stats':[None,None],
+                  'compiler_messages':''}
+        response = self.post('api-result',result,args=[self.passing.id])
+        self.assertEqual(response.status_code,409)
+        result['grader_id'] = 'remote:1'
+        result['results'] = ['x','y']
+        response = self.post('api-result',result,args=[self.passing.id])
+        self.assertEqual(response.status_code,400)
+        self.passing.refresh_from_db()
+        self.assertFalse(self.passing.graded())
+
+    def test_invalid_results(self):
+        self.post('api-claim',{'grader_id':'remote:1'})
+        for results in [[1],[1,1,1],[1,9],["1","1"],[1.0,1],[True,1]]:
+            result = {'grader_id':'remote:1',
+                      'results':results,
+                      'stats':[None]*len(results),
+                      'compiler_messages':''}
+            response = self.post('api-result',result,args=[self.passing.id])
+            self.assertEqual(response.status_code,400,results)
+        self.passing.refresh_from_db()
+        self.assertFalse(self.passing.graded())
+
+        result['results'] = [TestCaseResult.RESULT_PASSED,
+                             TestCaseResult.RESULT_TIMEOUT]
+        result['stats'] = [None,None]
+        response = self.post('api-result',result,args=[self.passing.id])
+        self.assertEqual(response.status_code,200)
+        self.passing.refresh_from_db()
+        self.assertEqual([str(r) for r in self.passing.results],["P","T"])
+
+    def test_release(self):
+        self.post('api-claim',{'grader_id':'remote:1','limit':2})
+        self.post('api-release',{'grader_id':'remote:2',
+                                 'submission_ids':[self.passing.id]})
+        self.post('api-release',{'grader_id':'remote:1',
+                                 'submission_ids':[self.failing.id]})
+        self.passing.refresh_from_db()
+        self.failing.refresh_from_db()
+        self.assertEqual(self.passing.code_grading_status,
+                         Submission.CODE_STATUS_GRADING)
+        self.assertEqual(self.failing.code_grading_status,
+                         Submission.CODE_STATUS_INQUEUE)
+
+
+class RemoteGraderTestCase(JobApiTestMixin,LiveServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.supplement_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.supplement_dir)
+        self.grader = GraderClient(self.live_server_url,'secret','remote:1',
+                                   self.supplement_dir)
+
+    @override_settings(GRADER_TIMING_SAMPLE_RATE=1.0)
+    def test_grade_remotely(self):
+        bundles = self.grader.claim(2)
+        self.assertEqual(len(bundles),2)
+        self.assertEqual(self.grader.renew(),2)
+        for bundle in bundles:
+            self.grader.submit(bundle,self.grader.grade(bundle))
+        # supplements are downloaded once
+        self.assertEqual(len(os.listdir(self.supplement_dir)),1)
+
+        self.passing.refresh_from_db()
+        self.failing.refresh_from_db()
+        self.assertTrue(self.passing.graded())
+        self.assertEqual([str(r) for r in self.passing.results],["P","P"])
+        self.assertEqual(self.passing.claimed_by,'')
+        self.assertEqual([str(r) for r in self.failing.results],["P","-"])
+        self.assertEqual(self.failing.stats[1]['status'],'ok')
+        self.assertEqual(self.passing.timings.get().task_id,self.task.id)
+
+
+class RemoteSupplementTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.supplement_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree,self.supplement_dir)
+        self.client = GraderClient('http://elab','secret','remote:1',
+                                   self.supplement_dir)
+
+    def download(self,version):
+        zip_data = io.BytesIO()
+        with zipfile.ZipFile(zip_data,'w') as zf:
+            zf.writestr('a.txt',version)
+        zip_data.seek(0)
+        with mock.patch.object(self.client,'open',return_value=zip_data):
+            return self.client.get_supplement({'id':3,'name':'data.zip',
+                                               'version':version*16,
+                                               'url':'/supplement/3/'})
+
+    def test_old_versions_removed(self):
+        cache_dir = os.path.join(self.supplement_dir,'cache')
+        with override_settings(SUPPLEMENT_CACHE_DIR=cache_dir):
+            other = os.path.join(self.supplement_dir,'31-x-other.zip')
+            open(other,'w').close()
+            old = self.download('a')
+            BundledSupplement(old).unzip_to(tempfile.mkdtemp(dir=self.supplement_dir))
+            self.assertEqual(len(os.listdir(cache_dir)),1)
+            new = self.download('b')
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        self.assertTrue(os.path.exists(other))
+        self.assertEqual(os.listdir(cache_dir),[])
+
+
+class RemoteGraderSettingsTestCase(SimpleTestCase):
+
+    def test_no_models_loaded(self):
+        script = ("import sys, django\n"
+                  "django.setup()\n"
+                  "import grader.management.commands.run_remote_grader\n"
+                  "print(' '.join(sorted(m for m in sys.modules\n"
+                  "                      if m.endswith('.models'))))\n")
+        env = dict(os.environ,
+                   DJANGO_SETTINGS_MODULE='elabsheet.remote_grader_settings')
+        modules = subprocess.check_output([sys.executable,'-c',script],
+                                          cwd=settings.BASE_DIR,env=env,
+                                          universal_newlines=True).split()
+        self.assertNotIn('cms.models',modules)
+        self.assertNotIn('lab.models',modules)
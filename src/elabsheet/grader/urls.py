@@ -0,0 +1,23 @@
+from django.urls import path
+from . import views
+
+app_name = 'grader'
+
+# job API of remote graders (see grader/jobs.py)
+urlpatterns = [
+    path('api/claim/',
+        views.api_claim,
+        name='api-claim'),
+    path('api/renew/',
+        views.api_renew,
+        name='api-renew'),
+    path('api/release/',
+        views.api_release,
+        name='api-release'),
+    path('api/result/<int:submission_id>/',
+        views.api_result,
+        name='api-result'),
+    path('api/supplement/<int:supplement_id>/',
+        views.api_supplement,
+        name='api-supplement'),
+]
@@ -0,0 +1,139 @@
+import hmac
+import json
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, \
+        HttpResponseBadRequest, JsonResponse, FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+
+from cms.models import GradingSupplement
+from commons.utils import parse_address_list, address_in_list, \
+        get_remote_addr_from_request
+from lab.models import Submission
+from .metrics import render_metrics
+from . import jobs
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def metrics_allowed(request):
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    remote_addr = get_remote_addr_from_request(request)
+    if not remote_addr or not settings.METRICS_ALLOWED_ADDRESSES:
+        return False
+    try:
+        return address_in_list(
+                remote_addr,
+                parse_address_list(settings.METRICS_ALLOWED_ADDRESSES))
+    except ValueError:
+        # e.g., an IPv6 address
+        return False
+
+
+def metrics(request):
+    """
+    Serves grading metrics in the Prometheus text exposition format.
+    """
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
+
+
+# most submissions a remote grader may claim at once
+MAX_CLAIM_LIMIT = 50
+
+# how often (in seconds) the job API looks for expired claims, as there
+# may be no grader with database access to do so
+REAP_INTERVAL = 30
+last_reaped_at = 0
+
+
+def grader_api(view):
+    """
+    Lets only requests bearing settings.GRADER_API_TOKEN in their
+    Authorization header through.  For POST requests, the JSON body,
+    which must include the grader's id, is passed to view as data.
+    """
+    @csrf_exempt
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if not settings.GRADER_API_TOKEN:
+            raise Http404
+        expected = 'Bearer ' + settings.GRADER_API_TOKEN
+        if not hmac.compare_digest(
+                request.META.get('HTTP_AUTHORIZATION', '').encode('utf-8'),
+                expected.encode('utf-8')):
+            return HttpResponseForbidden()
+        if request.method != 'POST':
+            return view(request, *args, **kwargs)
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            return HttpResponseBadRequest()
+        if not isinstance(data, dict) or not data.get('grader_id'):
+            return HttpResponseBadRequest()
+        return view(request, data, *args, **kwargs)
+    return wrapped
+
+
+@grader_api
+def api_claim(request, data):
+    global last_reaped_at
+    if time.time() - last_reaped_at >= REAP_INTERVAL:
+        Submission.reap_expired_claims()
+        last_reaped_at = time.time()
+    try:
+        limit = max(1, min(int(data.get('limit', 1)), MAX_CLAIM_LIMIT))
+    except (TypeError, ValueError):
+        return HttpResponseBadRequest()
+    return JsonResponse({
+        'bundles': jobs.claim_bundles(data['grader_id'], limit),
+    })
+
+
+@grader_api
+def api_renew(request, data):
+    return JsonResponse({
+        'renewed': Submission.renew_leases(data['grader_id']),
+    })
+
+
+@grader_api
+def api_release(request, data):
+    submissions = Submission.objects.filter(
+            id__in=data.get('submission_ids', []),
+            claimed_by=data['grader_id'])
+    Submission.release_submissions(list(submissions))
+    return JsonResponse({})
+
+
+@grader_api
+def api_result(request, data, submission_id):
+    """
+    Saves the result of grading a submission, unless the grader's claim
+    on it has been lost (e.g., its lease expired), in which case 409 is
+    returned and the result is dropped.  A result that does not match the
+    task's test cases is rejected with 400 (see jobs.save_bundle_result).
+    """
+    submission = Submission.objects.filter(
+            id=submission_id,
+            code_grading_status=Submission.CODE_STATUS_GRADING,
+            claimed_by=data['grader_id']).first()
+    if submission is None:
+        return JsonResponse({'error': 'claim lost'}, status=409)
+    try:
+        jobs.save_bundle_result(submission, data)
+    except (KeyError, TypeError, ValueError):
+        return HttpResponseBadRequest()
+    return JsonResponse({})
+
+
+@grader_api
+def api_supplement(request, supplement_id):
+    supplement = get_object_or_404(GradingSupplement, id=supplement_id)
+    return FileResponse(supplement.data_file.open('rb'),
+                        content_type='application/octet-stream')
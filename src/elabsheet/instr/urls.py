@@ -75,4 +75,7 @@ urlpatterns = [
     path('lab/status/<int:lab_id>/',
         views.lab_status,
         name='lab-status'),
+    path('regrade/progress/<int:sec_id>/<int:job_id>/',
+        views.regrade_progress,
+        name='regrade-progress'),
 ]
@@ -13,8 +13,9 @@ from commons.decorators import instructor_required, ajax_login_required
 from commons.utils import find_extension
 from django.contrib.auth.models import User
 from lab.models import Section, Submission, Assignment, LabInSection, \
-        AddressAcl, DirectToLabAccount
+        AddressAcl, DirectToLabAccount, RegradeJob
 from lab.views import get_section_statistic_for_user
+from grader.wakeup import notify_graders
 from logger.models import Log
 
 import codecs
@@ -25,10 +26,12 @@ def section_menu(request,sec_id):
     '''Displays the main menu for a section in the instructor's view.'''
     sec = get_object_or_404(Section, pk=sec_id)
     inqueue_count = Submission.count_inqueue_submissions()
+    regrade_count = Submission.count_regrade_submissions()
     return render(request, 'instr/section_menu.html', 
             {
                 'sec' : sec,
                 'inqueue_count': inqueue_count,
+                'regrade_count': regrade_count,
             })
 
 
@@ -37,7 +40,13 @@ def section_menu(request,sec_id):
 def list_assignments(request,sec_id):
     '''Lists all assignments in the chosen section.'''
     sec = get_object_or_404(Section, pk=sec_id)
-    return render(request, 'instr/assignments.html', { 'sec' : sec })
+    regrade_jobs = [(job, job.progress())
+            for job in RegradeJob.objects.filter(section=sec)[:5]]
+    return render(request, 'instr/assignments.html',
+            {
+                'sec' : sec,
+                'regrade_jobs' : regrade_jobs,
+            })
 
 
 @login_required
@@ -202,7 +211,9 @@ def regrade_submission(request,sec_id,submission_id):
     previous_url = request.GET['next']
     submission = get_object_or_404(Submission,pk=submission_id)
     submission.code_grading_status = Submission.CODE_STATUS_INQUEUE
+    submission.regrade_job = None
     submission.save()
+    notify_graders()
     return HttpResponseRedirect(previous_url)
 
 @login_required
@@ -217,19 +228,23 @@ def delete_submission(request,sec_id,submission_id):
 @login_required
 @instructor_required
 def regrade_submissions(request,sec_id,assign_id):
-    '''Triggers all recent submissions for this assignment to be
-    regraded.'''
+    '''Starts a job regrading all recent submissions for this assignment
+    in a low-priority lane.'''
     assignment = get_object_or_404(Assignment, pk=assign_id)
     sec = get_object_or_404(Section, pk=sec_id)
-    recent_submissions = [(std, assignment.get_recent_submission_for_user(std,sec))
-            for std in sec.students.all()]
-    for std, submission in recent_submissions:
-        if submission!=None:
-            submission.code_grading_status = Submission.CODE_STATUS_INQUEUE
-            submission.save()
+    RegradeJob.start(assignment,sec,request.user)
+    notify_graders()
     return redirect("instr:list-assignments",sec_id)
 
 
+@ajax_login_required
+@instructor_required
+def regrade_progress(request,sec_id,job_id):
+    '''Returns the progress of a regrade job as JSON.'''
+    job = get_object_or_404(RegradeJob, pk=job_id, section_id=sec_id)
+    return JsonResponse(job.progress())
+
+
 @login_required
 @instructor_required
 def zip_submissions(request,sec_id,assign_id):
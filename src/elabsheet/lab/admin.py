@@ -3,6 +3,7 @@ from django import forms
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils.safestring import mark_safe
+from django.utils.html import format_html_join
 
 
 from .models import \
@@ -41,7 +42,7 @@ class SectionAdmin(admin.ModelAdmin):
 
 @admin.register(LabInSection)
 class LabInSectionAdmin(admin.ModelAdmin):
-    fields = ['hidden_tasks']
+    fields = ['hidden_tasks', 'coalesce_submissions']
     list_display = [
             'lab_display',
             'course_display',
@@ -111,8 +112,8 @@ class DirectToLabAccountAdmin(admin.ModelAdmin):
 
 @admin.register(Submission)
 class SubmissionAdmin(admin.ModelAdmin):
-    fields = ['user_info','section_link','assignment_link','submitted_at','grading_results']
-    readonly_fields = ['user_info','section_link','assignment_link','submitted_at','grading_results']
+    fields = ['user_info','section_link','assignment_link','submitted_at','grading_results','grading_stats']
+    readonly_fields = ['user_info','section_link','assignment_link','submitted_at','grading_results','grading_stats']
     change_form_template = 'admin/lab/submission/change_form.html'
 
     def has_module_permission(self, request):
@@ -144,3 +145,16 @@ class SubmissionAdmin(admin.ModelAdmin):
         manual_full = obj.assignment.task.manual_full_score()
         return mark_safe('<tt>[{}] {}/{}</tt>'.format(status['results'],manual,manual_full))
     grading_results.short_description = 'Grading Results'
+
+    def grading_stats(self, obj):
+        if not obj.stats:
+            return '-'
+        lines = []
+        for i,stats in enumerate(obj.stats,1):
+            if stats:
+                lines.append('#{}: {} wall {:.3f}s user {:.3f}s sys {:.3f}s mem {}KB'.format(
+                    i, stats['status'], stats['wall'], stats['user'], stats['sys'], stats['mem']))
+            else:
+                lines.append('#{}: -'.format(i))
+        return format_html_join(mark_safe('<br>'), '<tt>{}</tt>', ((line,) for line in lines))
+    grading_stats.short_description = 'Grading Statistics'
@@ -205,6 +205,7 @@ class LabNumberForm(forms.Form):
     number = forms.CharField()
     disabled = forms.BooleanField(required=False)
     read_only = forms.BooleanField(required=False)
+    coalesce_submissions = forms.BooleanField(required=False)
 
 class LabSelectionForm(forms.Form):
     selected = forms.BooleanField(required=False)
@@ -230,7 +231,9 @@ def list_labs_in_section(request, section_id,
     # current labs
     labs_insection = section.labinsection_set.all()
     LabNumberFormSet = formset_factory(LabNumberForm, can_delete=True, extra=0)
-    form_initial = [{'number': ls.number, 'disabled': ls.disabled, 'read_only': ls.read_only} for ls in labs_insection]
+    form_initial = [{'number': ls.number, 'disabled': ls.disabled, 'read_only': ls.read_only,
+                     'coalesce_submissions': ls.coalesce_submissions}
+                    for ls in labs_insection]
     cur_lab_formset = old_cur_lab_formset or LabNumberFormSet(initial=form_initial)
 
     cur_lab_forms_with_labs = zip(cur_lab_formset.forms,labs_insection)
@@ -279,6 +282,7 @@ def update_labs_in_section(request, section_id):
                 lab_insection.number = form.cleaned_data['number']
                 lab_insection.disabled = form.cleaned_data['disabled']
                 lab_insection.read_only = form.cleaned_data['read_only']
+                lab_insection.coalesce_submissions = form.cleaned_data['coalesce_submissions']
                 lab_insection.save()
         return HttpResponseRedirect(reverse("lab:admin-lab-section-labs",
                                             args=[section.id]))
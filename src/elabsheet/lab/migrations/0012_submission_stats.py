@@ -0,0 +1,19 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:01
+
+import commons.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lab', '0011_directtolabaccount_submission_allowed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='stats',
+            field=commons.fields.JSONField(blank=True, null=True),
+        ),
+    ]
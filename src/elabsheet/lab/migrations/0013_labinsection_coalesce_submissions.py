@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lab', '0012_submission_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='labinsection',
+            name='coalesce_submissions',
+            field=models.BooleanField(default=False, help_text='Skip grading queued submissions of students who submit the same task again before they are graded'),
+        ),
+    ]
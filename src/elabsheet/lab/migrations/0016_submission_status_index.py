@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lab', '0015_submission_claim_lease'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='submission',
+            name='code_grading_status',
+            field=models.IntegerField(db_index=True, default=3),
+        ),
+    ]
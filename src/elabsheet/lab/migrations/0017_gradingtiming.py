@@ -0,0 +1,31 @@
+# Generated by Django 2.0.13 on 2026-10-18 12:26
+
+import commons.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0017_task_stop_on_failure'),
+        ('lab', '0016_submission_status_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradingTiming',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('graded_at', models.DateTimeField(db_index=True)),
+                ('cached', models.BooleanField(default=False)),
+                ('total', models.FloatField()),
+                ('phases', commons.fields.JSONField(blank=True, null=True)),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timings', to='lab.Submission')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cms.Task')),
+            ],
+            options={
+                'ordering': ['-graded_at'],
+            },
+        ),
+    ]
@@ -2,7 +2,9 @@ import random
 import pickle
 import ipaddress
 
-from django.db import models
+from django.db import models, connection, transaction
+from django.db.models import Q, F, Count, OuterRef, Subquery
+from django.conf import settings
 from django.template import Context, Template
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
@@ -10,6 +12,8 @@ from django.utils.safestring import mark_safe
 from django.utils import timezone
 
 from .fields import AnswerField, GradingResultField
+from commons.models import TestCaseResult
+from .scheduling import fair_order
 from cms.models import Assignment, Task, Course, Lab
 from commons.fields import JSONField
 from commons.utils import \
@@ -188,6 +192,10 @@ class LabInSection(models.Model):
     number = models.CharField(max_length=20)
     disabled = models.BooleanField(blank=True, default=False)
     read_only = models.BooleanField(default=False)
+    coalesce_submissions = models.BooleanField(
+            default=False,
+            help_text='Skip grading queued submissions of students who '
+            'submit the same task again before they are graded')
     hidden_tasks = models.CharField(max_length=200,
                                     blank=True,
                                     default='',
@@ -307,6 +315,11 @@ class LabInSection(models.Model):
         return False
 
 
+MSG_GRADING_ABANDONED = ("Grading was abandoned because it could not be "
+                         "completed after several attempts.  Please "
+                         "contact your instructor.")
+
+
 class Submission(models.Model):
     """
     Submission model keeps students' submission with grading result.
@@ -316,6 +329,10 @@ class Submission(models.Model):
     CODE_STATUS_INQUEUE = 1
     CODE_STATUS_GRADING = 2
     CODE_STATUS_GRADED = 3
+    # replaced by a newer submission of the same task before being graded
+    CODE_STATUS_SUPERSEDED = 4
+    # waiting in the low-priority lane of bulk regrades (see RegradeJob)
+    CODE_STATUS_REGRADE = 5
 
     assignment = models.ForeignKey(Assignment,on_delete=models.CASCADE)
     section = models.ForeignKey(Section,blank=True,null=True,on_delete=models.CASCADE)
@@ -328,12 +345,30 @@ class Submission(models.Model):
     # results stores code grading result as a Boolean list.
     results = GradingResultField()
 
+    # stats keeps, for each test case in results, a dict of wall, user and
+    # system times (seconds), peak memory (KB) and status reported by the
+    # sandbox, or None when not available (e.g., cached results)
+    stats = JSONField(blank=True, null=True)
+
     compiler_messages = models.TextField(blank=True, null=True)
     submitted_at = models.DateTimeField(auto_now_add=True,db_index=True)
     remote_addr = models.CharField(max_length=40, blank=True, default='')
     start_grading_at = models.DateTimeField(blank=True, null=True)
     graded_at = models.DateTimeField(blank=True, null=True)
-    code_grading_status = models.IntegerField(default=CODE_STATUS_GRADED)
+    code_grading_status = models.IntegerField(default=CODE_STATUS_GRADED,
+                                              db_index=True)
+    regrade_job = models.ForeignKey('RegradeJob',
+                                    blank=True,
+                                    null=True,
+                                    related_name='submissions',
+                                    on_delete=models.SET_NULL)
+
+    # grader holding the claim on a submission being graded, until when,
+    # and how many times grading has been started since it was queued
+    # (see reap_expired_claims)
+    claimed_by = models.CharField(max_length=100, blank=True, default='')
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    grading_attempts = models.IntegerField(default=0)
 
     # manual_scores keeps a dict of integer indexed by blank id (as
     # string, e.g., "b1", "b2", ...)
@@ -345,6 +380,9 @@ class Submission(models.Model):
     def graded(self):
         return self.code_grading_status == Submission.CODE_STATUS_GRADED
 
+    def superseded(self):
+        return self.code_grading_status == Submission.CODE_STATUS_SUPERSEDED
+
     def passed(self):
         if not self.graded():
             return False
@@ -415,22 +453,250 @@ class Submission(models.Model):
                 assignment_ids[sub.assignment.id] = True
         return submissions
 
+    def enqueue(self, coalesce=False):
+        """
+        Saves this submission to be graded by a separate grader.  With
+        coalesce, older submissions of the same task by the same user in
+        the same section that are still in the queue are marked as
+        superseded, so that graders skip them.  Submissions already
+        claimed by a grader are left alone.
+        """
+        self.code_grading_status = Submission.CODE_STATUS_INQUEUE
+        with transaction.atomic():
+            self.save()
+            if coalesce:
+                (Submission.objects
+                    .filter(assignment_id=self.assignment_id,
+                            section_id=self.section_id,
+                            user_id=self.user_id,
+                            id__lt=self.id,
+                            code_grading_status=Submission.CODE_STATUS_INQUEUE)
+                    .update(code_grading_status=Submission.CODE_STATUS_SUPERSEDED))
+
+    @staticmethod
+    def count_recently_served(field, ids, since):
+        """
+        Returns a dict mapping each of ids to the number of its
+        submissions (grouped by field, e.g., 'user_id') being graded or
+        graded since the given time.
+        """
+        ids = [i for i in ids if i is not None]
+        if not ids:
+            return {}
+        rows = (Submission.objects
+                .filter(**{field + "__in": ids})
+                .filter(Q(code_grading_status=Submission.CODE_STATUS_GRADING) |
+                        Q(code_grading_status=Submission.CODE_STATUS_GRADED,
+                          graded_at__gte=since))
+                .values(field)
+                .annotate(count=Count("id")))
+        return {row[field]: row["count"] for row in rows}
+
+    @staticmethod
+    def get_claim_candidates(inqueue, count):
+        """
+        Returns ids of up to count submissions from the inqueue queryset
+        (ordered by submission time) in the order they should be claimed,
+        interleaving users and sections when settings.GRADER_FAIR_SHARE is
+        set.
+        """
+        if not settings.GRADER_FAIR_SHARE:
+            return list(inqueue.values_list("id",flat=True)[:count])
+
+        window = max(count,settings.GRADER_FAIR_SHARE_WINDOW)
+        candidates = list(inqueue.values_list("id","user_id","section_id",
+                                              "submitted_at")[:window])
+        now = timezone.now()
+        since = now - timezone.timedelta(
+                seconds=settings.GRADER_FAIR_SHARE_HISTORY)
+        user_served = Submission.count_recently_served(
+                "user_id",set(c[1] for c in candidates),since)
+        section_served = Submission.count_recently_served(
+                "section_id",set(c[2] for c in candidates),since)
+        overdue_before = now - timezone.timedelta(
+                seconds=settings.GRADER_FAIR_SHARE_MAX_WAIT)
+        return fair_order(candidates,
+                          user_served,
+                          section_served,
+                          settings.GRADER_FAIR_SHARE_SECTION_WEIGHTS,
+                          overdue_before)[:count]
+
+    @staticmethod
+    def get_lease_expiry():
+        return timezone.now() + timezone.timedelta(
+                seconds=settings.GRADER_LEASE_DURATION)
+
+    @staticmethod
+    def claim_queued_submissions(status, limit=1, grader_id=''):
+        """
+        Claims up to limit submissions with the given queued status (i.e.,
+        in the live queue or the regrade lane) for grader_id, by marking
+        them as being graded with a lease of settings.GRADER_LEASE_DURATION
+        seconds, and returns them in the order they should be graded:
+        oldest first, or interleaved by user and section when
+        settings.GRADER_FAIR_SHARE is set (see get_claim_candidates).
+        Submissions locked or claimed by other graders are skipped instead
+        of waited for.
+
+        On databases supporting SELECT ... FOR UPDATE SKIP LOCKED, the
+        candidates are locked and marked with a single UPDATE statement.
+        Elsewhere (e.g., SQLite or MySQL 5.7), each candidate is marked
+        with a conditional UPDATE, which has no effect when another grader
+        got the submission first.
+        """
+        queued = (Submission.objects
+                  .filter(code_grading_status=status)
+                  .order_by("submitted_at"))
+
+        claim = {
+            'code_grading_status': Submission.CODE_STATUS_GRADING,
+            'claimed_by': grader_id,
+            'lease_expires_at': Submission.get_lease_expiry(),
+            'grading_attempts': F('grading_attempts') + 1,
+        }
+        claimed_ids = []
+        tried_ids = set()
+        while len(claimed_ids) < limit:
+            candidate_ids = Submission.get_claim_candidates(
+                    queued.exclude(id__in=tried_ids),
+                    limit-len(claimed_ids))
+            if not candidate_ids:
+                break
+            tried_ids.update(candidate_ids)
+
+            if connection.features.has_select_for_update_skip_locked:
+                with transaction.atomic():
+                    locked_ids = set(queued
+                                     .filter(id__in=candidate_ids)
+                                     .select_for_update(skip_locked=True)
+                                     .values_list("id",flat=True))
+                    Submission.objects.filter(id__in=locked_ids).update(**claim)
+                claimed_ids.extend(i for i in candidate_ids if i in locked_ids)
+            else:
+                for submission_id in candidate_ids:
+                    updated = (Submission.objects
+                               .filter(id=submission_id,
+                                       code_grading_status=status)
+                               .update(**claim))
+                    if updated:
+                        claimed_ids.append(submission_id)
+
+        if not claimed_ids:
+            return []
+        submissions = Submission.objects.in_bulk(claimed_ids)
+        return [submissions[i] for i in claimed_ids]
+
+    @staticmethod
+    def claim_inqueue_submissions(limit=1, grader_id=''):
+        """
+        Claims up to limit submissions from the live queue (see
+        claim_queued_submissions).  Only when there is none to claim, a
+        single submission is claimed from the regrade lane, so that live
+        submissions never wait behind a batch of regrades.
+        """
+        submissions = Submission.claim_queued_submissions(
+                Submission.CODE_STATUS_INQUEUE,limit,grader_id)
+        if not submissions:
+            submissions = Submission.claim_queued_submissions(
+                    Submission.CODE_STATUS_REGRADE,1,grader_id)
+        return submissions
+
+    @staticmethod
+    def requeue(claimed, **changes):
+        """
+        Puts submissions of the claimed queryset back to the queue, or to
+        the regrade lane for those of regrade jobs.
+        """
+        changes.update(claimed_by='', lease_expires_at=None)
+        (claimed.filter(regrade_job__isnull=True)
+            .update(code_grading_status=Submission.CODE_STATUS_INQUEUE,
+                    **changes))
+        (claimed.filter(regrade_job__isnull=False)
+            .update(code_grading_status=Submission.CODE_STATUS_REGRADE,
+                    **changes))
+
+    @staticmethod
+    def release_submissions(submissions):
+        """
+        Puts claimed submissions that have not been graded back to the
+        queue.  Their claims do not count as grading attempts.
+        """
+        Submission.requeue(
+                Submission.objects.filter(
+                    id__in=[s.id for s in submissions],
+                    code_grading_status=Submission.CODE_STATUS_GRADING),
+                grading_attempts=F('grading_attempts') - 1)
+
+    @staticmethod
+    def expire_claims(submissions):
+        """
+        Ends the claims on submissions that could not be graded, so that
+        reap_expired_claims puts them back to the queue, or gives up on
+        those claimed settings.GRADER_MAX_ATTEMPTS times.
+        """
+        (Submission.objects
+            .filter(id__in=[s.id for s in submissions],
+                    code_grading_status=Submission.CODE_STATUS_GRADING)
+            .update(lease_expires_at=timezone.now()-timezone.timedelta(seconds=1)))
+
+    @staticmethod
+    def renew_leases(grader_id):
+        """
+        Extends the leases of all submissions claimed by grader_id.
+        Returns the number of submissions renewed.
+        """
+        return (Submission.objects
+                .filter(code_grading_status=Submission.CODE_STATUS_GRADING,
+                        claimed_by=grader_id)
+                .update(lease_expires_at=Submission.get_lease_expiry()))
+
+    @staticmethod
+    def reap_expired_claims():
+        """
+        Recovers submissions left being graded by graders that stopped
+        renewing their leases (e.g., killed ones), including those claimed
+        before claims had leases.  Each one is put back to the queue,
+        unless grading has already been started
+        settings.GRADER_MAX_ATTEMPTS times: such a submission probably
+        brings graders down, so it is marked as graded with no test case
+        run instead.  Returns the lists of requeued and abandoned
+        submissions.
+        """
+        expired = (Submission.objects
+                   .filter(code_grading_status=Submission.CODE_STATUS_GRADING)
+                   .filter(Q(lease_expires_at__lt=timezone.now()) |
+                           Q(lease_expires_at__isnull=True)))
+        expired_ids = list(expired.values_list("id",flat=True))
+        if not expired_ids:
+            return [], []
+        expired = expired.filter(id__in=expired_ids)
+
+        abandoned = []
+        for submission in expired.filter(
+                grading_attempts__gte=settings.GRADER_MAX_ATTEMPTS):
+            submission.make_task_concrete()
+            testcases = submission.assignment.task.testcases or []
+            updated = (expired
+                       .filter(id=submission.id)
+                       .update(code_grading_status=Submission.CODE_STATUS_GRADED,
+                               results=[TestCaseResult.NOTRUN] * max(1,len(testcases)),
+                               compiler_messages=MSG_GRADING_ABANDONED,
+                               graded_at=timezone.now(),
+                               claimed_by='',
+                               lease_expires_at=None))
+            if updated:
+                abandoned.append(submission)
+
+        requeued = list(expired.exclude(id__in=[s.id for s in abandoned]))
+        Submission.requeue(expired.filter(id__in=[s.id for s in requeued]))
+        return requeued, abandoned
+
     @staticmethod
     def fetch_one_inqueue_submission(use_transaction=True):
         if use_transaction:
-            from django.db import connection
-
-            cursor = connection.cursor()
-            cursor.execute("START TRANSACTION;")
-            num = cursor.execute("SELECT id from lab_submission WHERE code_grading_status=%d ORDER BY submitted_at LIMIT 1 FOR UPDATE;" % (Submission.CODE_STATUS_INQUEUE,))
-            if num==1:
-                submission_id = cursor.fetchone()[0]
-                cursor.execute("UPDATE lab_submission SET code_grading_status=%d WHERE id=%d;" % (Submission.CODE_STATUS_GRADING, submission_id))
-            else:
-                submission_id = None
-            cursor.execute("COMMIT;")
-            if submission_id!=None:
-                return Submission.objects.get(id=submission_id)
+            submissions = Submission.claim_inqueue_submissions(1)
+            if len(submissions)==1:
+                return submissions[0]
             else:
                 return None
         else:
@@ -450,9 +716,16 @@ class Submission(models.Model):
                 .filter(code_grading_status=Submission.CODE_STATUS_INQUEUE)
                 .count())
 
+    @staticmethod
+    def count_regrade_submissions():
+        return (Submission.objects
+                .filter(code_grading_status=Submission.CODE_STATUS_REGRADE)
+                .count())
+
     def status_summary(self):
         status = {
             'graded': self.graded(),
+            'superseded': self.superseded(),
             'passed': self.passed(),
             'results': ''.join([str(r) for r in self.results]),
             'compiler_messages': self.compiler_messages,
@@ -466,6 +739,168 @@ class Submission(models.Model):
         ordering = ['submitted_at']
 
 
+class RegradeJob(models.Model):
+    """
+    Bulk regrading of the most recent submissions of an assignment by the
+    students of a section.  The submissions wait in a low-priority lane
+    (Submission.CODE_STATUS_REGRADE), from which graders take only when
+    the live queue is empty.
+    """
+    assignment = models.ForeignKey(Assignment,on_delete=models.CASCADE)
+    section = models.ForeignKey(Section,on_delete=models.CASCADE)
+    created_by = models.ForeignKey(User,blank=True,null=True,on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return "Regrade {} in {}".format(self.assignment, self.section)
+
+    @staticmethod
+    def start(assignment, section, user=None):
+        """
+        Creates a job and puts the most recent submission of every student
+        of section for assignment into the regrade lane.  Submissions
+        already in the live queue or being graded are left alone.
+        """
+        latest = (Submission.objects
+                  .filter(assignment=OuterRef("assignment"),
+                          section=OuterRef("section"),
+                          user=OuterRef("user"))
+                  .order_by("-submitted_at","-id")
+                  .values("id")[:1])
+        # some databases (e.g., MySQL) cannot update a table selected in
+        # a subquery, so the ids are selected first
+        latest_ids = list(Submission.objects
+                          .filter(assignment=assignment,
+                                  section=section,
+                                  user__in=section.students.all())
+                          .filter(id=Subquery(latest))
+                          .values_list("id",flat=True))
+
+        with transaction.atomic():
+            job = RegradeJob.objects.create(assignment=assignment,
+                                            section=section,
+                                            created_by=user)
+            job.total = (Submission.objects
+                         .filter(id__in=latest_ids)
+                         .exclude(code_grading_status__in=[
+                             Submission.CODE_STATUS_INQUEUE,
+                             Submission.CODE_STATUS_GRADING])
+                         .update(code_grading_status=Submission.CODE_STATUS_REGRADE,
+                                 regrade_job=job))
+            job.save()
+        return job
+
+    def progress(self):
+        """
+        Returns a dict with the total number of submissions to regrade,
+        how many of them have been regraded and how many remain.
+        Submissions taken over by a later job or regraded individually
+        count as neither.
+        """
+        counts = dict(self.submissions
+                      .values_list("code_grading_status")
+                      .annotate(count=Count("id"))
+                      .order_by())
+        remaining = (counts.get(Submission.CODE_STATUS_REGRADE,0) +
+                     counts.get(Submission.CODE_STATUS_GRADING,0))
+        return {
+            'total': self.total,
+            'regraded': counts.get(Submission.CODE_STATUS_GRADED,0),
+            'remaining': remaining,
+            'finished': remaining == 0,
+        }
+
+
+class GradingTiming(models.Model):
+    """
+    Time spent in each phase of grading a submission (see
+    commons/timing.py), kept for a random sample of gradings
+    (settings.GRADER_TIMING_SAMPLE_RATE) so that hot tasks and slow
+    phases can be found (see summarize).  Timings older than
+    settings.GRADER_TIMING_RETENTION_DAYS are deleted as new ones are
+    recorded.
+    """
+    submission = models.ForeignKey(Submission,related_name='timings',on_delete=models.CASCADE)
+    task = models.ForeignKey(Task,on_delete=models.CASCADE)
+    graded_at = models.DateTimeField(db_index=True)
+    # whether the grading result was taken from CachedGradingResult
+    cached = models.BooleanField(default=False)
+    total = models.FloatField()
+    # phases keeps a dict of [seconds, count] indexed by phase name
+    phases = JSONField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-graded_at']
+
+    def __str__(self):
+        return "Timing of submission-id:{} ({:.3f}s)".format(self.submission_id, self.total)
+
+    @staticmethod
+    def sampled():
+        """
+        Returns whether the timing of the next grading should be kept.
+        """
+        return random.random() < settings.GRADER_TIMING_SAMPLE_RATE
+
+    @staticmethod
+    def record(submission,task,timing,cached=False):
+        grading_timing = GradingTiming.objects.create(
+                submission=submission,
+                task=task,
+                graded_at=submission.graded_at or timezone.now(),
+                cached=cached,
+                total=round(timing.total,3),
+                phases=timing.to_dict())
+        if settings.GRADER_TIMING_RETENTION_DAYS:
+            GradingTiming.prune(settings.GRADER_TIMING_RETENTION_DAYS)
+        return grading_timing
+
+    @staticmethod
+    def prune(days):
+        """
+        Deletes timings of gradings older than the given number of days
+        and returns how many were deleted.
+        """
+        count,_ = (GradingTiming.objects
+                   .filter(graded_at__lt=timezone.now()-timezone.timedelta(days=days))
+                   .delete())
+        return count
+
+    @staticmethod
+    def summarize(timings):
+        """
+        Returns, for each task of the given timings, a dict with the
+        task id, the number of timings, the total and 95th percentile
+        grading time, and the mean time per grading of each phase.  Tasks
+        taking the most grading time in total come first.
+        """
+        by_task = {}
+        for task_id,total,phases in timings.values_list("task_id","total","phases"):
+            by_task.setdefault(task_id,[]).append((total,phases or {}))
+
+        summaries = []
+        for task_id,rows in by_task.items():
+            totals = sorted(total for total,phases in rows)
+            phase_sums = {}
+            for total,phases in rows:
+                for phase,(seconds,count) in phases.items():
+                    phase_sums[phase] = phase_sums.get(phase,0) + seconds
+            summaries.append({
+                'task_id': task_id,
+                'count': len(rows),
+                'total': sum(totals),
+                'p95': totals[min(len(totals)-1,int(len(totals)*0.95))],
+                'phases': {phase: seconds/len(rows)
+                           for phase,seconds in phase_sums.items()},
+            })
+        summaries.sort(key=lambda summary: -summary['total'])
+        return summaries
+
+
 ADDR_LIST_HELP_TEXT = mark_safe(
     "Enter a single IP (e.g., <tt style='color:green'>158.108.32.8</tt>) "
     "or an IP range (e.g., <tt style='color:green'>10.16.5.0 - 10.16.5.255</tt>) in each line.<br/>"
@@ -0,0 +1,83 @@
+"""
+Fair-share ordering of in-queue submissions (see
+Submission.claim_inqueue_submissions).
+
+Strict FIFO lets one student submitting many times in a row, or one
+section taking an exam, delay every other student.  Instead, candidates
+are interleaved with a weighted round-robin over sections, and a plain
+round-robin over the users of each section:
+
+* the k-th queued submission of a user gets user round
+  served(user) + k, where served(user) is the number of the user's
+  submissions graded (or being graded) recently;
+
+* within a section, submissions are taken by user round, then by
+  submission time; the j-th one gets section tag
+  (served(section) + j + 1) / weight(section);
+
+* submissions of all sections are taken by section tag, then by
+  submission time.
+
+The rounds start from recent history rather than from zero because
+graders claim a few submissions at a time: without it, every claim
+would start a new round and take the oldest submission, just like FIFO.
+
+Submissions that have waited longer than the maximum wait are taken
+first, in submission order, so that no submission waits forever however
+the queue is weighted.
+"""
+from collections import OrderedDict
+
+
+def fair_order(candidates,
+               user_served=None,
+               section_served=None,
+               section_weights=None,
+               overdue_before=None):
+    """
+    Returns ids of candidates in the order they should be graded.
+
+    Keyworded arguments:
+    * candidates : (id, user_id, section_id, submitted_at) tuples, ordered
+      by submission time
+    * user_served, section_served : dicts mapping user and section ids to
+      the number of their submissions graded recently
+    * section_weights : dict mapping section ids to positive weights
+      (default 1); a section with weight 2 gets twice as many submissions
+      graded as a section with weight 1 when both have queued ones
+    * overdue_before : submissions submitted at or before this time are
+      taken first
+    """
+    user_served = user_served or {}
+    section_served = section_served or {}
+    section_weights = section_weights or {}
+
+    overdue = []
+    by_section = OrderedDict()
+    for candidate in candidates:
+        if overdue_before is not None and candidate[3] <= overdue_before:
+            overdue.append(candidate)
+        else:
+            by_section.setdefault(candidate[2], []).append(candidate)
+
+    tagged = []
+    for section_id, section_candidates in by_section.items():
+        rounds = {}
+        user_ordered = []
+        for candidate in section_candidates:
+            user_id = candidate[1]
+            user_round = rounds.get(user_id, user_served.get(user_id, 0))
+            rounds[user_id] = user_round + 1
+            user_ordered.append((user_round, candidate[3], candidate[0]))
+        user_ordered.sort()
+
+        weight = section_weights.get(section_id, 1)
+        served = section_served.get(section_id, 0)
+        for j, (user_round, submitted_at, submission_id) in enumerate(user_ordered):
+            tagged.append(((served + j + 1) / weight,
+                           submitted_at,
+                           submission_id))
+    tagged.sort()
+
+    return ([candidate[0] for candidate in overdue] +
+            [submission_id for tag, submitted_at, submission_id in tagged])
@@ -1,7 +1,16 @@
 import unittest
 import doctest
+from datetime import date
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.contrib.auth.models import User
+
 from . import admin_views
 from . import views
+from cms.models import Task, Lab, Assignment, Course
+from commons.timing import Timing
+from .models import Semester, Section, Submission, RegradeJob, GradingTiming
 
 def suite():
     # An easy way of finding all the unittests in this module
@@ -9,3 +18,328 @@ def suite():
     suite.addTest(doctest.DocTestSuite(views))
     suite.addTest(doctest.DocTestSuite(admin_views))
     return suite
+
+
+MD_TASK = """\
+Task
+====
+
+::elab:begincode language="python3"
+print(int(input())+1)
+::elab:endcode
+
+::elab:begintest
+1
+::elab:endtest"""
+
+class QueueTestCase(TestCase):
+
+    def setUp(self):
+        task = Task(name="Task",source=MD_TASK,language="python3")
+        task.save()
+        lab = Lab(name="Lab")
+        lab.save()
+        self.assignment = Assignment.objects.create(task=task,lab=lab,number="1")
+        course = Course.objects.create(number="01204111",name="Course")
+        semester = Semester.objects.create(year=2561,term=1,
+                                           start_date=date(2018,8,1))
+        self.section = Section.objects.create(course=course,
+                                              semester=semester,
+                                              name="1")
+        self.user = User.objects.create(username="student")
+
+    def enqueue(self,count,user=None,section=None):
+        submissions = []
+        for i in range(count):
+            submissions.append(Submission.objects.create(
+                assignment=self.assignment,
+                section=section or self.section,
+                user=user or self.user,
+                answer={},
+                code_grading_status=Submission.CODE_STATUS_INQUEUE))
+        return submissions
+
+
+class SubmissionQueueTestCase(QueueTestCase):
+
+    def test_claim_batch_in_submission_order(self):
+        queued = self.enqueue(5)
+        claimed = Submission.claim_inqueue_submissions(3)
+        self.assertEqual([s.id for s in claimed],[s.id for s in queued[:3]])
+        for s in claimed:
+            self.assertEqual(s.code_grading_status,Submission.CODE_STATUS_GRADING)
+        self.assertEqual(Submission.count_inqueue_submissions(),2)
+
+        claimed = Submission.claim_inqueue_submissions(3)
+        self.assertEqual([s.id for s in claimed],[s.id for s in queued[3:]])
+        self.assertEqual(Submission.claim_inqueue_submissions(3),[])
+
+    def test_claim_skips_submissions_taken_by_others(self):
+        queued = self.enqueue(3)
+        # another grader got the oldest one
+        (Submission.objects.filter(id=queued[0].id)
+            .update(code_grading_status=Submission.CODE_STATUS_GRADING))
+        claimed = Submission.claim_inqueue_submissions(2)
+        self.assertEqual([s.id for s in claimed],[s.id for s in queued[1:]])
+
+    def test_release_submissions(self):
+        self.enqueue(3)
+        claimed = Submission.claim_inqueue_submissions(3)
+        Submission.release_submissions(claimed[1:])
+        self.assertEqual(Submission.count_inqueue_submissions(),2)
+        submission = Submission.fetch_one_inqueue_submission()
+        self.assertEqual(submission.id,claimed[1].id)
+
+    @override_settings(GRADER_FAIR_SHARE=True)
+    def test_claim_interleaves_users(self):
+        flood = self.enqueue(4)
+        other = User.objects.create(username="other")
+        queued = self.enqueue(2,user=other)
+        claimed = Submission.claim_inqueue_submissions(4)
+        self.assertEqual([s.id for s in claimed],
+                         [flood[0].id,queued[0].id,flood[1].id,queued[1].id])
+
+    @override_settings(GRADER_FAIR_SHARE=True)
+    def test_claim_counts_recently_graded_submissions(self):
+        flood = self.enqueue(3)
+        (Submission.objects.filter(id=flood[0].id)
+            .update(code_grading_status=Submission.CODE_STATUS_GRADED,
+                    graded_at=timezone.now()))
+        other = User.objects.create(username="other")
+        queued = self.enqueue(1,user=other)
+        # the flooding user has just had a turn
+        claimed = Submission.claim_inqueue_submissions(1)
+        self.assertEqual([s.id for s in claimed],[queued[0].id])
+
+    @override_settings(GRADER_FAIR_SHARE=True)
+    def test_claim_weights_sections(self):
+        exam = Section.objects.create(course=self.section.course,
+                                      semester=self.section.semester,
+                                      name="2")
+        queued = self.enqueue(3)
+        users = [User.objects.create(username="exam%d" % i) for i in range(4)]
+        exam_queued = [self.enqueue(1,user=u,section=exam)[0] for u in users]
+        with self.settings(GRADER_FAIR_SHARE_SECTION_WEIGHTS={exam.id: 2}):
+            claimed = Submission.claim_inqueue_submissions(6)
+        self.assertEqual([s.id for s in claimed],
+                         [exam_queued[0].id,queued[0].id,exam_queued[1].id,
+                          exam_queued[2].id,queued[1].id,exam_queued[3].id])
+
+    @override_settings(GRADER_FAIR_SHARE=True)
+    def test_claim_overdue_submissions_first(self):
+        flood = self.enqueue(3)
+        other = User.objects.create(username="other")
+        queued = self.enqueue(1,user=other)
+        (Submission.objects.filter(id__in=[s.id for s in flood])
+            .update(submitted_at=timezone.now()-timezone.timedelta(hours=1)))
+        claimed = Submission.claim_inqueue_submissions(4)
+        self.assertEqual([s.id for s in claimed],
+                         [s.id for s in flood+queued])
+
+    @override_settings(GRADER_FAIR_SHARE=False)
+    def test_claim_in_submission_order_without_fair_share(self):
+        flood = self.enqueue(3)
+        other = User.objects.create(username="other")
+        queued = self.enqueue(1,user=other)
+        claimed = Submission.claim_inqueue_submissions(4)
+        self.assertEqual([s.id for s in claimed],
+                         [s.id for s in flood+queued])
+
+    def test_enqueue_coalesces_queued_submissions(self):
+        queued = self.enqueue(2)
+        other = User.objects.create(username="other")
+        others = self.enqueue(1,user=other)
+        # already claimed by a grader
+        (Submission.objects.filter(id=queued[0].id)
+            .update(code_grading_status=Submission.CODE_STATUS_GRADING))
+
+        submission = Submission(assignment=self.assignment,
+                                section=self.section,
+                                user=self.user,
+                                answer={})
+        submission.enqueue(coalesce=True)
+
+        queued[0].refresh_from_db()
+        queued[1].refresh_from_db()
+        others[0].refresh_from_db()
+        self.assertEqual(queued[0].code_grading_status,Submission.CODE_STATUS_GRADING)
+        self.assertTrue(queued[1].superseded())
+        self.assertEqual(others[0].code_grading_status,Submission.CODE_STATUS_INQUEUE)
+        claimed = Submission.claim_inqueue_submissions(3)
+        self.assertEqual(sorted(s.id for s in claimed),
+                         sorted([others[0].id,submission.id]))
+
+    def test_enqueue_without_coalescing(self):
+        self.enqueue(1)
+        submission = Submission(assignment=self.assignment,
+                                section=self.section,
+                                user=self.user,
+                                answer={})
+        submission.enqueue()
+        self.assertEqual(Submission.count_inqueue_submissions(),2)
+
+
+class RegradeJobTestCase(QueueTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.students = [User.objects.create(username="std%d" % i) for i in range(3)]
+        for std in self.students:
+            self.section.students.add(std)
+
+    def submit(self,user,status=Submission.CODE_STATUS_GRADED):
+        return Submission.objects.create(assignment=self.assignment,
+                                         section=self.section,
+                                         user=user,
+                                         answer={},
+                                         code_grading_status=status)
+
+    def test_start_regrades_latest_submissions(self):
+        self.submit(self.students[0])
+        latest0 = self.submit(self.students[0])
+        latest1 = self.submit(self.students[1])
+        self.submit(self.students[2],Submission.CODE_STATUS_INQUEUE)
+        # not a student of the section
+        self.submit(self.user)
+
+        job = RegradeJob.start(self.assignment,self.section)
+        self.assertEqual(job.total,2)
+        self.assertEqual(sorted(job.submissions.values_list("id",flat=True)),
+                         sorted([latest0.id,latest1.id]))
+        self.assertEqual(job.progress(),
+                         {'total': 2, 'regraded': 0, 'remaining': 2, 'finished': False})
+
+    def test_regrades_wait_for_live_queue(self):
+        regraded = self.submit(self.students[0])
+        job = RegradeJob.start(self.assignment,self.section)
+        live = self.enqueue(2)
+
+        claimed = Submission.claim_inqueue_submissions(3)
+        self.assertEqual([s.id for s in claimed],[s.id for s in live])
+        claimed = Submission.claim_inqueue_submissions(3)
+        self.assertEqual([s.id for s in claimed],[regraded.id])
+        self.assertEqual(job.progress()['remaining'],1)
+
+        Submission.release_submissions(claimed)
+        self.assertEqual(Submission.count_regrade_submissions(),1)
+        claimed = Submission.claim_inqueue_submissions(1)
+        (Submission.objects.filter(id=claimed[0].id)
+            .update(code_grading_status=Submission.CODE_STATUS_GRADED))
+        self.assertEqual(job.progress(),
+                         {'total': 1, 'regraded': 1, 'remaining': 0, 'finished': True})
+
+
+class ClaimLeaseTestCase(QueueTestCase):
+
+    def expire(self,submissions):
+        (Submission.objects.filter(id__in=[s.id for s in submissions])
+            .update(lease_expires_at=timezone.now()-timezone.timedelta(seconds=1)))
+
+    def test_claim_records_grader_and_lease(self):
+        self.enqueue(2)
+        claimed = Submission.claim_inqueue_submissions(1,"host:1")
+        self.assertEqual(claimed[0].claimed_by,"host:1")
+        self.assertGreater(claimed[0].lease_expires_at,timezone.now())
+        self.assertEqual(claimed[0].grading_attempts,1)
+
+        Submission.release_submissions(claimed)
+        claimed[0].refresh_from_db()
+        self.assertEqual(claimed[0].code_grading_status,Submission.CODE_STATUS_INQUEUE)
+        self.assertEqual(claimed[0].claimed_by,"")
+        self.assertEqual(claimed[0].grading_attempts,0)
+
+    def test_renew_leases_of_grader(self):
+        self.enqueue(2)
+        mine = Submission.claim_inqueue_submissions(1,"host:1")
+        others = Submission.claim_inqueue_submissions(1,"host:2")
+        self.expire(mine+others)
+        self.assertEqual(Submission.renew_leases("host:1"),1)
+        requeued, abandoned = Submission.reap_expired_claims()
+        self.assertEqual([s.id for s in requeued],[others[0].id])
+        self.assertEqual(abandoned,[])
+        others[0].refresh_from_db()
+        self.assertEqual(others[0].code_grading_status,Submission.CODE_STATUS_INQUEUE)
+        self.assertIsNone(others[0].lease_expires_at)
+        self.assertEqual(others[0].grading_attempts,1)
+
+    def test_reap_claims_without_lease(self):
+        queued = self.enqueue(1)
+        (Submission.objects.filter(id=queued[0].id)
+            .update(code_grading_status=Submission.CODE_STATUS_GRADING))
+        requeued, abandoned = Submission.reap_expired_claims()
+        self.assertEqual([s.id for s in requeued],[queued[0].id])
+
+    def test_abandon_after_max_attempts(self):
+        queued = self.enqueue(1)
+        with self.settings(GRADER_MAX_ATTEMPTS=2):
+            for attempt in range(2):
+                claimed = Submission.claim_inqueue_submissions(1,"host:1")
+                self.assertEqual(len(claimed),1)
+                self.expire(claimed)
+                requeued, abandoned = Submission.reap_expired_claims()
+        self.assertEqual([s.id for s in abandoned],[queued[0].id])
+        submission = Submission.objects.get(id=queued[0].id)
+        self.assertTrue(submission.graded())
+        self.assertFalse(submission.passed())
+        self.assertEqual([str(r) for r in submission.results],["N"])
+        self.assertEqual(Submission.claim_inqueue_submissions(1),[])
+
+
+class GradingTimingTestCase(QueueTestCase):
+
+    def record(self,task,total,phases):
+        timing = Timing()
+        timing.add_phases(phases)
+        timing.total = total
+        submission = self.enqueue(1)[0]
+        return GradingTiming.record(submission,task,timing)
+
+    def test_summarize_per_task(self):
+        task = self.assignment.task
+        hot = Task(name="Hot",source=MD_TASK,language="python3")
+        hot.save()
+        self.record(task,1.0,{'build':[0.5,1],'run':[0.25,1]})
+        for i in range(3):
+            self.record(hot,2.0,{'build':[0.1,1],'run':[1.5,4]})
+        timing = GradingTiming.objects.filter(task=task).get()
+        self.assertEqual(timing.phases,{'build':[0.5,1],'run':[0.25,1]})
+
+        summaries = GradingTiming.summarize(GradingTiming.objects.all())
+        self.assertEqual([s['task_id'] for s in summaries],[hot.id,task.id])
+        self.assertEqual(summaries[0]['count'],3)
+        self.assertEqual(summaries[0]['total'],6.0)
+        self.assertEqual(summaries[0]['p95'],2.0)
+        self.assertAlmostEqual(summaries[0]['phases']['run'],1.5)
+        self.assertAlmostEqual(summaries[1]['phases']['build'],0.5)
+
+    def test_sampling(self):
+        with self.settings(GRADER_TIMING_SAMPLE_RATE=0):
+            self.assertFalse(GradingTiming.sampled())
+        with self.settings(GRADER_TIMING_SAMPLE_RATE=1):
+            self.assertTrue(GradingTiming.sampled())
+
+    def test_retention(self):
+        task = self.assignment.task
+        old = self.record(task,1.0,{})
+        (GradingTiming.objects.filter(id=old.id)
+            .update(graded_at=timezone.now()-timezone.timedelta(days=10)))
+        with self.settings(GRADER_TIMING_RETENTION_DAYS=0):
+            self.record(task,1.0,{})
+        self.assertEqual(GradingTiming.objects.count(),2)
+        with self.settings(GRADER_TIMING_RETENTION_DAYS=7):
+            self.record(task,1.0,{})
+        self.assertEqual(GradingTiming.objects.count(),2)
+        self.assertFalse(GradingTiming.objects.filter(id=old.id).exists())
+
+    def test_prune_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+        task = self.assignment.task
+        for days in (1,3,5):
+            timing = self.record(task,1.0,{})
+            (GradingTiming.objects.filter(id=timing.id)
+                .update(graded_at=timezone.now()-timezone.timedelta(days=days)))
+        out = StringIO()
+        call_command('grading_timings',prune=2,stdout=out)
+        self.assertEqual(out.getvalue().strip(),'2 timing(s) deleted')
+        self.assertEqual(GradingTiming.objects.count(),1)
@@ -12,9 +12,11 @@ from django.urls import reverse
 from django import template
 
 from commons.decorators import ajax_login_required
+from commons import metrics
 from commons.utils import get_svn_revision, get_remote_addr_from_request
 from cms.models import Lab, Assignment
 from .models import Submission, Section, LabInSection, DirectToLabAccount
+from grader.wakeup import notify_graders
 from logger.models import Log
 
 MSG_LAB_CLOSED = \
@@ -270,7 +272,9 @@ def submit(request, sec_id, labinsec_id, assignment_id):
                             remote_addr=remote_addr)
 
     if settings.SEPARATE_GRADING:
-        submission.code_grading_status = Submission.CODE_STATUS_INQUEUE
+        submission.enqueue(coalesce=labinsec.coalesce_submissions)
+        notify_graders()
+        metrics.SUBMISSIONS.inc(grading='separate')
     else:
         grading_results, messages = task.verify_with_messages(answer)
         manual_grading_results = task.verify_manual_auto_gradable_fields(answer)
@@ -278,10 +282,11 @@ def submit(request, sec_id, labinsec_id, assignment_id):
         result_list = [r['passed'] for r in grading_results]
         submission.compiler_messages = messages
         submission.results = result_list
+        submission.stats = [r['stats'] for r in grading_results]
         submission.manual_scores = manual_grading_results
         submission.graded_at = datetime.datetime.now()
-
-    submission.save()
+        submission.save()
+        metrics.SUBMISSIONS.inc(grading='inline')
 
     Log.create("submit", request,
                comment=("id: %d, task-id: %d, sect-id: %s" % 
@@ -458,7 +463,8 @@ def get_submission_status(request, submission_id):
     if submission.user!=user:
         return error_page(request, MSG_NOT_OWNER)
     if not submission.graded():
-        return JsonResponse({'graded': False}) 
+        return JsonResponse({'graded': False,
+                             'superseded': submission.superseded()})
 
     submission.make_task_concrete()
 
@@ -1,7 +1,12 @@
 import os
+import copy
 import stat
+import shlex
 import shutil
+import time
 import tempfile
+import multiprocessing
+import multiprocessing.pool
 try:
     import pwd
 except ImportError:
@@ -12,6 +17,12 @@ from random import randint
 from django.conf import settings
 
 from .builders import BuilderFactory, BuildError
+from .cache import BuildCache
+from .executors import get_executor
+from .forkserver import ForkServerError, run_script
+from .scratch import make_child_scratch_dir, release_child_scratch_dir
+from .stats import RunStats
+from commons import metrics, timing
 
 class NoInputProvided(Exception):
     pass
@@ -31,12 +42,71 @@ DEFAULT_TIME_LIMIT = settings.DEFAULT_TIME_LIMIT
 # mem limit in megabytes
 DEFAULT_MEMORY_LIMIT = settings.DEFAULT_MEMORY_LIMIT  
 
+# size limit of written files in megabytes
+DEFAULT_OUTPUT_LIMIT = settings.DEFAULT_OUTPUT_LIMIT
+
+# the output file is read (or compared) in chunks of this many characters
+OUTPUT_CHUNK_SIZE = 65536
+
+# only this many characters of the output are read (or compared), so that
+# outputs compare alike with expected outputs, which are read as well
+OUTPUT_READ_LIMIT = 1000000
+
 INPUT_FILENAME = 'sandbox-input.txt'
 OUTPUT_FILENAME = 'sandbox-output.txt'
 
 BOX_FILENAME = 'box'
 BOX_STAT_FILENAME = 'box.out'
 
+def available_cpus():
+    """
+    Returns the number of CPUs this process is allowed to run on.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _evaluate_job(job):
+    sandbox, built_source, input_string, comparator = job
+    output = sandbox.evaluate(built_source=built_source,
+                              input_string=input_string,
+                              comparator=comparator)
+    return output, sandbox.get_stats()
+
+def _evaluate_job_in_process(job):
+    # metrics and phases recorded in pool processes are counted by the parent
+    metrics.registry.autoflush = False
+    # a fork server started here would serve a single test case
+    job[0].use_forkserver = False
+    output, stats = _evaluate_job(job)
+    return output, stats, metrics.registry.take_values(), timing.take_phases()
+
+def evaluate_in_parallel(jobs, workers):
+    """
+    Evaluates a list of (sandbox, built_source, input_string, comparator)
+    jobs using up to the given number of workers (see Sandbox.evaluate
+    for comparator, which may be None).  Each job should have its own
+    sandbox (see Sandbox.create_child) as evaluation writes input and
+    output files into the scratch dir.
+
+    Workers are threads when every sandbox uses a thread-safe executor,
+    and processes otherwise (as evaluation may then change the working
+    directory of the whole process).
+
+    Returns (output, stats) pairs in the same order as the jobs.
+    """
+    if all(job[0].executor.thread_safe for job in jobs):
+        with multiprocessing.pool.ThreadPool(workers) as pool:
+            return pool.map(_evaluate_job, jobs, chunksize=1)
+
+    with multiprocessing.get_context('fork').Pool(workers) as pool:
+        results = pool.map(_evaluate_job_in_process, jobs, chunksize=1)
+    for output, stats, values, phases in results:
+        metrics.registry.add_values(values)
+        timing.add_phases(phases)
+    return [(output, stats) for output, stats, values, phases in results]
+
 class SourceCode:
     """
     SourceCode is the minimal container for (language,body) pair.
@@ -52,11 +122,17 @@ class BuiltSourceCode:
     This is used to separate compilation from source code evaluation
     to improve evaluation speed for compile languages.
 
-    It only keeps the executable filename and compiler messages.
+    It only keeps the executable filename and compiler messages, whether
+    the build succeeded, for Python, the (interpreter, script) pair to
+    be run by a fork server, and the language (for metrics).
     """
-    def __init__(self,executable_filename, compiler_messages):
+    def __init__(self,executable_filename, compiler_messages,
+                 forkserver_args=None, succeeded=True, language=None):
         self.executable_filename = executable_filename
         self.compiler_messages = compiler_messages
+        self.forkserver_args = forkserver_args
+        self.succeeded = succeeded
+        self.language = language
 
 class Sandbox:
     """
@@ -68,14 +144,21 @@ class Sandbox:
     file permission can be enforced.
     """
 
+    # whether Python scripts may run with a fork server (see
+    # settings.PYTHON_FORKSERVER)
+    use_forkserver = True
+
     def __init__(self, scratch_dir, 
                  temp_subdir=False,
                  create_scratch_dir=False,
                  time_limit=DEFAULT_TIME_LIMIT,
                  memory_limit=DEFAULT_MEMORY_LIMIT,
+                 output_limit=DEFAULT_OUTPUT_LIMIT,
                  clean_dir=False,
                  builder_factory=BuilderFactory,
                  use_box=None, verify_box=True,
+                 build_cache=None,
+                 executor=None,
                  flags={}): 
         """
         Initialize a sandbox.  
@@ -90,6 +173,8 @@ class Sandbox:
 
         * time_limit : in seconds
         * memory_limit : in megabytes
+        * output_limit : size limit of each written file in megabytes,
+          None for no limit
 
         * builder_factory : a factory used to create a builder,
           some object that builds an executable from a sourcecode,
@@ -98,6 +183,13 @@ class Sandbox:
         * use_box : use settings.USE_BOX_IN_SANDBOX if None
         * verify_box : check existance and permissions of box before use
 
+        * build_cache : a BuildCache for builds of cacheable languages,
+          use settings.SANDBOX_BUILD_CACHE_DIR if None, or False to
+          always build
+
+        * executor : runs the evaluated program (see executors.py),
+          use settings.SANDBOX_EXECUTOR if None
+
         * flags : indicate 'build' and 'run' flags to be given to the
                   builder and application loader, respectively
 
@@ -112,10 +204,12 @@ class Sandbox:
         self.sandbox_dir = os.path.abspath(os.path.dirname(__file__))
         self.time_limit = time_limit
         self.memory_limit = memory_limit
+        self.output_limit = output_limit
         self.builder_factory = builder_factory
         self.clean_dir = clean_dir
         self.verify_box = verify_box
         self.flags = flags
+        self.stats = None
 
         if use_box==None:
             # check settings
@@ -126,6 +220,18 @@ class Sandbox:
         else:
             self.use_box = use_box
 
+        if build_cache==None:
+            self.build_cache = BuildCache.from_settings(
+                ignored_filenames=(INPUT_FILENAME,
+                                   OUTPUT_FILENAME,
+                                   BOX_STAT_FILENAME))
+        else:
+            self.build_cache = build_cache or None
+
+        if executor==None:
+            self.executor = get_executor()
+        else:
+            self.executor = executor
 
     @staticmethod
     def prepare_scratch_dir(scratch_dir, temp_subdir, create_scratch_dir):
@@ -139,6 +245,30 @@ class Sandbox:
             os.makedirs(sdir)
         return sdir
 
+    def create_child(self):
+        """
+        Creates a new sandbox working in a fresh temporary directory next
+        to this sandbox's scratch dir (or on disk when a memory-backed
+        scratch space is full, see sandbox.scratch).  The new directory is
+        populated with copies of the files currently in the scratch dir
+        (e.g., a built executable and extracted supplements), so that a
+        source built once can be evaluated in many places at the same time.
+
+        The child shares limits and flags with this sandbox.  Its scratch
+        dir must be removed with clean_scratch_dir() when no longer used.
+        """
+        child_dir = make_child_scratch_dir(self.scratch_dir)
+        os.rmdir(child_dir)
+        shutil.copytree(self.scratch_dir, child_dir, symlinks=True)
+
+        child = copy.copy(self)
+        child.input_scratch_dir = os.path.dirname(child_dir)
+        child.scratch_dir = child_dir
+        child.scratch_dir_created = False
+        child.temp_subdir_created = True
+        child.clean_dir = False
+        return child
+
     def clean_scratch_dir(self):
         if self.scratch_dir_created:
             target = self.input_scratch_dir
@@ -164,6 +294,7 @@ class Sandbox:
             pass
 
         if self.temp_subdir_created:
+            release_child_scratch_dir(self.scratch_dir)
             shutil.rmtree(self.scratch_dir)
 
         if self.scratch_dir_created:
@@ -210,39 +341,90 @@ class Sandbox:
         if box_stat.st_mode & stat.S_ISUID == 0:  # check mode
             raise BoxNotReady('box\'s mode is invalid.')
 
-    def prepare_command_line_without_box(self, executable_filename,
-                                         input_filename,
-                                         output_filename):
-        return (executable_filename + " < " + input_filename + 
-                " > " + output_filename)
+    def prepare_args_without_box(self, executable_filename):
+        return shlex.split(executable_filename)
 
-    def prepare_command_line_with_box(self, executable_filename,
-                                      input_filename,
-                                      output_filename):
+    def prepare_args_with_box(self, executable_filename,
+                              input_filename,
+                              output_filename):
         box_filename = os.path.join(self.sandbox_dir,BOX_FILENAME)
-        box_stat_filename = os.path.join(self.scratch_dir, BOX_STAT_FILENAME)
-        return (box_filename + ' -T ' + 
-                ' -e ' +
-                ' -t ' + str(self.time_limit) + 
-                ' -m ' + str(self.memory_limit * 1024) +
-                ' -i ' + input_filename +
-                ' -o ' + output_filename +
-                (' -w ' if settings.USE_WALL_CLOCK else '') +
-                ' ' + executable_filename +
-                ' 2> ' + box_stat_filename)
+        args = [box_filename, '-T', '-e',
+                '-t', str(self.time_limit),
+                '-m', str(self.memory_limit * 1024),
+                '-i', input_filename,
+                '-o', output_filename]
+        # box binaries built before -s existed reject it; the executor
+        # limits the output of boxed programs either way
+        if self.output_limit and getattr(settings, 'BOX_OUTPUT_LIMIT', False):
+            args += ['-s', str(self.output_limit * 1024)]
+        if settings.USE_WALL_CLOCK:
+            args.append('-w')
+        return args + shlex.split(executable_filename)
 
     def build(self, source):
+        start_time = time.time()
+        with timing.span('build'):
+            built_source = self.build_without_metrics(source)
+        metrics.BUILD_TIME.observe(time.time() - start_time,
+                                   language=source.language,
+                                   cached=built_source.cached)
+        return built_source
+
+    def build_without_metrics(self, source):
         builder = self.builder_factory.get(source.language)
+
+        cache = None
+        if self.build_cache and getattr(builder, 'cacheable', False):
+            cache = self.build_cache
+            files_before = cache.scan(self.scratch_dir)
+            key = cache.get_key(builder, source.body, self.flags,
+                                self.scratch_dir, files_before)
+            cached = cache.fetch(key, self.scratch_dir)
+            if cached:
+                executable_filename, compiler_messages, succeeded = cached
+                built_source = BuiltSourceCode(executable_filename,
+                                               compiler_messages,
+                                               succeeded=succeeded,
+                                               language=source.language)
+                built_source.cached = True
+                return built_source
+
         executable_filename = builder.build(source.body, self.scratch_dir, self.flags)
         compiler_messages = builder.get_compiler_messages()
-        return BuiltSourceCode(executable_filename, compiler_messages)
+        if hasattr(builder, 'build_succeeded'):
+            succeeded = builder.build_succeeded()
+        else:
+            succeeded = True
+
+        if cache:
+            cache.store(key, self.scratch_dir, files_before,
+                        executable_filename, compiler_messages, succeeded)
+        built_source = BuiltSourceCode(executable_filename, compiler_messages,
+                                       getattr(builder, 'forkserver_args', None),
+                                       succeeded, source.language)
+        built_source.cached = False
+        return built_source
+
+    def get_output_limit_bytes(self):
+        if self.output_limit:
+            return self.output_limit * 1024 * 1024
+        return None
 
     def evaluate(self, source=None, built_source=None, 
                  input_string=None, input_filename=None, 
-                 output_filename=None, capture=False):
-
-        # set a flag in case the evaluated code needs to know
-        os.putenv("ELAB_GRADING","1")
+                 output_filename=None, capture=False,
+                 comparator=None):
+        """
+        Evaluates the source (or the already built source) with the given
+        input and returns the output (up to OUTPUT_READ_LIMIT characters),
+        or None if it cannot be read.  If output_filename is given, the
+        output is kept in that file of the scratch dir instead.
+
+        If comparator is given, the output (again up to OUTPUT_READ_LIMIT
+        characters) is fed to comparator.feed() in chunks until it returns
+        False, without keeping it in memory, and the comparator is returned
+        instead (None if the output cannot be read).
+        """
 
         if input_string == None and input_filename == None:
             raise NoInputProvided()
@@ -251,20 +433,15 @@ class Sandbox:
             raise NoSourceProvided()
 
         if built_source==None:
-            builder = self.builder_factory.get(source.language)
-            executable_filename = builder.build(source.body, self.scratch_dir, self.flags)
-            self.compiler_messages = builder.get_compiler_messages()
-        else:
-            executable_filename = built_source.executable_filename
-            self.compiler_messages = built_source.compiler_messages
+            built_source = self.build(source)
+        executable_filename = built_source.executable_filename
+        self.compiler_messages = built_source.compiler_messages
 
         if input_string != None:
             input_filename = self.prepare_input_file(input_string)
 
         real_output_filename = self.prepare_output_file(output_filename)
 
-        initial_dir = os.getcwd()
-        os.chdir(self.scratch_dir)
         os.chmod(self.scratch_dir,
                 stat.S_IRUSR |
                 stat.S_IWUSR |
@@ -273,25 +450,62 @@ class Sandbox:
                 stat.S_IWGRP |
                 stat.S_IXGRP)
 
-        if self.use_box:
-            if self.verify_box:
-                self.check_box()
-            cmd = self.prepare_command_line_with_box(executable_filename,
-                                                     input_filename,
-                                                     real_output_filename)
-        else:
-            cmd = self.prepare_command_line_without_box(executable_filename,
-                                                        input_filename,
-                                                        real_output_filename)
-        os.system(cmd)
-
-        os.chdir(initial_dir)
+        # set a flag in case the evaluated code needs to know
+        env = {'ELAB_GRADING': '1'}
+
+        with timing.span('run'):
+            if self.use_box:
+                if self.verify_box:
+                    self.check_box()
+                args = self.prepare_args_with_box(executable_filename,
+                                                  input_filename,
+                                                  real_output_filename)
+                box_stat_filename = os.path.join(self.scratch_dir,
+                                                 BOX_STAT_FILENAME)
+                # box passes the limit set by the executor on to the
+                # program, so output is limited even without its -s option
+                self.executor.run(args, self.scratch_dir, env,
+                                  stderr_filename=box_stat_filename,
+                                  output_limit=self.get_output_limit_bytes())
+                self.stats = self.read_box_stats(box_stat_filename)
+                self.check_output_limit(real_output_filename)
+            else:
+                stdin_filename = os.path.join(self.scratch_dir, input_filename)
+                self.stats = None
+                if (getattr(settings, 'PYTHON_FORKSERVER', False) and
+                        getattr(built_source, 'forkserver_args', None) and
+                        self.use_forkserver and
+                        not self.executor.isolated):
+                    self.stats = self.run_with_forkserver(
+                        built_source.forkserver_args, env,
+                        stdin_filename, real_output_filename)
+                if self.stats == None:
+                    args = self.prepare_args_without_box(executable_filename)
+                    self.stats = self.executor.run(args, self.scratch_dir, env,
+                                      stdin_filename=stdin_filename,
+                                      stdout_filename=real_output_filename,
+                                      output_limit=self.get_output_limit_bytes(),
+                                      time_limit=self.time_limit,
+                                      memory_limit=self.memory_limit * 1024,
+                                      wall_clock=settings.USE_WALL_CLOCK)
+                self.check_output_limit(real_output_filename)
+
+        language = getattr(built_source, 'language', None) or 'unknown'
+        metrics.SANDBOX_LAUNCHES.inc(language=language)
+        if self.stats is not None:
+            metrics.RUN_TIME.observe(self.stats.wall_time, language=language)
 
         # TODO: FIX THIS: this part is a bit ugly
-        if output_filename == None:
+        if output_filename == None and comparator != None:
+            with timing.span('compare'):
+                output = self.compare_output_file(real_output_filename,
+                                                  comparator)
+            if self.clean_dir:
+                self.clean_scratch_dir()
+            return output
+        elif output_filename == None:
             try:
-                # TODO: get rid of the hard-coded number
-                output_str = open(real_output_filename).read(1000000)
+                output_str = open(real_output_filename).read(OUTPUT_READ_LIMIT)
             except:
                 #import traceback
                 #traceback.print_exc()
@@ -304,9 +518,70 @@ class Sandbox:
             if self.clean_dir:
                 self.clean_scratch_dir()
 
+    def run_with_forkserver(self, forkserver_args, env,
+                            stdin_filename, output_filename):
+        """
+        Runs a Python script with a fork server.  Returns None when the
+        fork server cannot be used, so that the script is run as usual.
+        """
+        interpreter, script = forkserver_args
+        full_env = dict(os.environ)
+        full_env.update(env)
+        try:
+            return run_script(interpreter, script, self.scratch_dir,
+                              full_env, stdin_filename, output_filename,
+                              self.time_limit, self.memory_limit * 1024,
+                              settings.USE_WALL_CLOCK,
+                              self.get_output_limit_bytes())
+        except ForkServerError:
+            return None
+
+    def check_output_limit(self, output_filename):
+        """
+        Programs that ignore SIGXFSZ (e.g., Python) fail with a write error
+        instead of getting killed at the output limit; report these too.
+        """
+        limit = self.get_output_limit_bytes()
+        if not limit or self.stats.status != RunStats.ERROR:
+            return
+        try:
+            if os.path.getsize(output_filename) >= limit:
+                self.stats.status = RunStats.OUTPUT_LIMIT
+        except OSError:
+            pass
+
+    @staticmethod
+    def compare_output_file(output_filename, comparator):
+        try:
+            with open(output_filename) as f:
+                remaining = OUTPUT_READ_LIMIT
+                while remaining > 0:
+                    chunk = f.read(min(OUTPUT_CHUNK_SIZE, remaining))
+                    if not chunk or not comparator.feed(chunk):
+                        break
+                    remaining -= len(chunk)
+        except (OSError, ValueError):
+            # e.g., the output is not valid text
+            return None
+        return comparator
+
+    def read_box_stats(self, box_stat_filename):
+        try:
+            with open(box_stat_filename) as f:
+                output = f.read()
+        except OSError:
+            output = ''
+        return RunStats.from_box_output(output, self.memory_limit * 1024)
+
     def get_compiler_messages(self):
         return self.compiler_messages
 
+    def get_stats(self):
+        """
+        Returns RunStats of the last evaluation.
+        """
+        return self.stats
+
     @staticmethod
     def get_languages():
         return BuilderFactory.get_languages()
@@ -37,6 +37,7 @@ static int use_wall_clock;
 static int file_access;
 static int verbose;
 static int memory_limit;
+static int output_limit;
 static int allow_times;
 static char *redir_stdin, *redir_stdout;
 static char *set_cwd;
@@ -505,7 +506,10 @@ boxkeeper(void)
       if (WIFSIGNALED(stat))
 	{
 	  box_pid = 0;
-	  fprintf(stderr,"Caught fatal signal %d.\n", WTERMSIG(stat));
+	  if (WTERMSIG(stat) == SIGXFSZ)
+	    fprintf(stderr,"Output limit exceeded.\n");
+	  else
+	    fprintf(stderr,"Caught fatal signal %d.\n", WTERMSIG(stat));
 
 	  struct timeval total;
 	  int wall;
@@ -558,6 +562,8 @@ boxkeeper(void)
 	      log(">> Signal %d\n", sig);
 	      ptrace(PTRACE_SYSCALL, box_pid, 0, sig);
 	    }
+	  else if (sig == SIGXFSZ)
+	    die("Output limit exceeded.");
 	  else
 	    die("Received signal %d.", sig);
 	}
@@ -597,6 +603,12 @@ box_inside(int argc, char **argv)
       if (setrlimit(RLIMIT_AS, &rl) < 0)
 	die("setrlimit: %m");
     }
+  if (output_limit)
+    {
+      rl.rlim_cur = rl.rlim_max = (rlim_t) output_limit * 1024;
+      if (setrlimit(RLIMIT_FSIZE, &rl) < 0)
+	die("setrlimit: %m");
+    }
   rl.rlim_cur = rl.rlim_max = 64;
   if (setrlimit(RLIMIT_NOFILE, &rl) < 0)
     die("setrlimit: %m");
@@ -621,6 +633,7 @@ Options:\n\
 -i <file>\tRedirect stdin from <file>\n\
 -m <size>\tLimit address space to <size> KB\n\
 -o <file>\tRedirect stdout to <file>\n\
+-s <size>\tLimit size of written files to <size> KB\n\
 -t <time>\tStop after <time> seconds\n\
 -T\t\tAllow syscalls for measuring run time\n\
 -v\t\tBe verbose\n\
@@ -635,7 +648,7 @@ main(int argc, char **argv)
   int c;
   uid_t uid;
 
-  while ((c = getopt(argc, argv, "a:c:efi:m:o:t:Tvw")) >= 0)
+  while ((c = getopt(argc, argv, "a:c:efi:m:o:s:t:Tvw")) >= 0)
     switch (c)
       {
       case 'a':
@@ -659,6 +672,9 @@ main(int argc, char **argv)
       case 'o':
 	redir_stdout = optarg;
 	break;
+      case 's':
+	output_limit = atol(optarg);
+	break;
       case 't':
 	timeout = atof(optarg);
 	break;
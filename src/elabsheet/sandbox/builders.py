@@ -5,6 +5,9 @@ import re
 from pygments import lexers
 from django.conf import settings
 
+from .pch import find_pch_dir
+from . import compileserver
+
 # A builder for each language is responsible for building an excutable
 # given a sourcecode (as string).  Each builder should support: 
 #
@@ -12,6 +15,17 @@ from django.conf import settings
 #   filename (callable from box or shell), can write anything
 #   (including output executable) to directory scratch_dir.
 #
+# A builder of a compiled language also supports:
+#
+# * build_succeeded(): returns False when the last build failed (e.g.,
+#   with compile errors), so that the executable need not be run.
+#   Builders without it are assumed to always succeed.
+#
+# A builder whose class attribute cacheable is True has its results
+# kept in the build cache (see cache.py).  Its build must depend only
+# on the source, the flags and the files in scratch_dir, and must put
+# everything the executable needs inside scratch_dir.
+#
 
 # This dictionary is to be populated by builder registration and will later be
 # used by CMS's syntax highlighter
@@ -94,6 +108,14 @@ class PythonBuilder:
                 python_source_filename,
                 )
 
+        # without interpreter flags, the source may also be run by a
+        # fork server of the same interpreter (see forkserver.py)
+        if flags['run'].strip():
+            self.forkserver_args = None
+        else:
+            self.forkserver_args = (self.python_executable(),
+                                    python_source_filename)
+
         return executable_filename
 
     def get_compiler_messages(self):
@@ -140,6 +162,7 @@ class CSharpBuilder:
     - For Cygwin, it calls 'csc' with all paths translated to Windows'
       paths.
     """
+    cacheable = True
 
     def read_compiler_messages(self, filename):
         try:
@@ -158,7 +181,7 @@ class CSharpBuilder:
 
         if os.name=='nt':
             # for windows
-            os.system("csc -lib:%s %s -out:%s %s > %s" % (
+            self.build_status = os.system("csc -lib:%s %s -out:%s %s > %s" % (
                 scratch_dir,
                 flags['build'],
                 executable_filename, 
@@ -170,7 +193,7 @@ class CSharpBuilder:
 
         elif os.uname()[0].startswith('CYGWIN'):
             # for cygwin
-            os.system("csc -lib:%s %s -out:'%s' '%s'> '%s'" % (
+            self.build_status = os.system("csc -lib:%s %s -out:'%s' '%s'> '%s'" % (
                 scratch_dir,
                 flags['build'],
                 cygpath(executable_filename),
@@ -182,7 +205,7 @@ class CSharpBuilder:
 
         elif os.name=='posix':
             # for posix (or linux)
-            os.system("gmcs -lib:%s %s %s -out:%s > %s 2>&1" % (
+            self.build_status = os.system("gmcs -lib:%s %s %s -out:%s > %s 2>&1" % (
                 scratch_dir,
                 flags['build'],
                 source_filename, 
@@ -195,6 +218,9 @@ class CSharpBuilder:
 
         raise BuildError("Don't know how to build")
 
+    def build_succeeded(self):
+        return self.build_status == 0
+
     def get_compiler_messages(self):
         return self.compiler_messages
 
@@ -247,6 +273,8 @@ class JavaBuilder:
     Running under normal box works fine.
 
     """
+    cacheable = True
+
     @staticmethod
     def class_name_from_filename(filename):
         """
@@ -312,6 +340,28 @@ class JavaBuilder:
         return {'files': files,
                 'main_class': main_class}
 
+    @staticmethod
+    def java_options():
+        """
+        Returns the JVM options used to run the built program.  With
+        settings.JAVA_CDS_ARCHIVE, the JVM maps the preloaded classes from
+        the shared archive; -Xshare:auto makes it load them as usual when
+        the archive is missing or does not match the JVM.  The JVM then
+        logs a warning, which goes to standard output by default and would
+        end up in the output of the program, so JVM logs are sent to
+        standard error instead.
+        """
+        options = "-cp . -Xmx32m"
+        archive = getattr(settings, 'JAVA_CDS_ARCHIVE', None)
+        if archive:
+            options += (" -Xshare:auto -XX:SharedArchiveFile=%s"
+                        " -Xlog:disable -Xlog:all=warning:stderr" % archive)
+        return options
+
+    def cache_options(self):
+        # the run script embeds the JVM options
+        return JavaBuilder.java_options()
+
     def read_compiler_messages(self, filename):
         try:
             self.compiler_messages = open(filename).read()
@@ -345,23 +395,53 @@ class JavaBuilder:
     def build_for_nt(self, scratch_dir, sources, message_filename, flags):
         initial_dir = os.getcwd()
         os.chdir(scratch_dir)
-        os.system("javac %s %s > %s" % (flags['build'], sources, message_filename))
+        status = os.system("javac %s %s > %s" % (flags['build'], sources, message_filename))
         os.chdir(initial_dir)
+        return status
 
     def build_for_cygwin(self, scratch_dir, sources, message_filename, flags):
         initial_dir = os.getcwd()
         new_sources = ' '.join([("'%s'" % cygpath(fname)) 
                                 for fname in sources.split(' ')])
         os.chdir(scratch_dir)
-        os.system("javac %s %s > '%s'" % (flags['build'], new_sources, 
-                                       cygpath(message_filename)))
+        status = os.system("javac %s %s > '%s'" % (flags['build'], new_sources, 
+                                                cygpath(message_filename)))
         os.chdir(initial_dir)
+        return status
+
+    def build_with_server(self, server, scratch_dir, sources,
+                          message_filename, flags):
+        """
+        Builds with the compile server of the grader (see
+        compileserver.py).  Returns the status of javac, or None if the
+        server cannot build the sources.
+        """
+        args = compileserver.get_javac_args(flags['build'], sources.split(),
+                                            scratch_dir)
+        if args is None:
+            return None
+        try:
+            status, messages = server.compile(args)
+        except compileserver.CompileServerError:
+            return None
+        with open(message_filename, 'wb') as f:
+            f.write(messages)
+        return status
 
     def build_for_posix(self, scratch_dir, sources, message_filename, flags):
-        initial_dir = os.getcwd()
-        os.chdir(scratch_dir)
-        os.system("javac %s %s > %s 2>&1" % (flags['build'], sources, message_filename))
-        os.chdir(initial_dir)
+        server = compileserver.get_server()
+        if server:
+            status = self.build_with_server(server, scratch_dir, sources,
+                                            message_filename, flags)
+            if status is not None:
+                return status
+        # change directory in the shell only, so that builds running in
+        # other threads are not affected
+        return os.system("cd %s && javac %s %s > %s 2>&1" % (scratch_dir, flags['build'],
+                                                            sources, message_filename))
+
+    def build_succeeded(self):
+        return self.build_status == 0
 
     def get_compiler_messages(self):
         return self.compiler_messages
@@ -377,11 +457,11 @@ class JavaBuilder:
         source_list = JavaBuilder.find_all_java_files(scratch_dir)
         source_list_str = ' '.join(source_list)
 
-        java_options = "-cp . -Xmx32m"
+        java_options = JavaBuilder.java_options()
 
         if os.name=='nt':
             # windows
-            self.build_for_nt(scratch_dir, 
+            self.build_status = self.build_for_nt(scratch_dir, 
                               source_list_str, 
                               message_filename,
                               flags)
@@ -390,7 +470,7 @@ class JavaBuilder:
 
         elif os.uname()[0].startswith('CYGWIN'):
             # cygwin
-            self.build_for_cygwin(scratch_dir, 
+            self.build_status = self.build_for_cygwin(scratch_dir, 
                                   source_list_str, 
                                   message_filename,
                                   flags)
@@ -399,7 +479,7 @@ class JavaBuilder:
 
         elif os.name=='posix':
             # linux (or other posix)
-            self.build_for_posix(scratch_dir, 
+            self.build_status = self.build_for_posix(scratch_dir, 
                                  source_list_str, 
                                  message_filename,
                                  flags)
@@ -424,8 +504,10 @@ BuilderFactory.register('java', 'java', JavaBuilder, lexers.JavaLexer)
 
 class CBuilder:
     """
-    Builds C executable using gcc.
+    Builds C executable using gcc, with the headers precompiled for gcc
+    when there are any (see pch.py).
     """
+    cacheable = True
 
     def compiler_command(self):
         return 'gcc'
@@ -455,7 +537,7 @@ class CBuilder:
 
         elif os.uname()[0].startswith('CYGWIN'):
             # for cygwin
-            os.system("%s %s -o '%s' '%s' 2> '%s' -lm" % (
+            self.build_status = os.system("%s %s -o '%s' '%s' 2> '%s' -lm" % (
                     self.compiler_command(),
                     flags['build'],
                     cygpath(executable_filename),
@@ -467,18 +549,40 @@ class CBuilder:
 
         elif os.name=='posix':
             # for posix (or linux)
-            os.system("%s %s -o %s %s > %s 2>&1 -lm" % (
-                    self.compiler_command(),
-                    source_filename, 
-                    executable_filename,
-                    flags['build'],
-                    message_filename))
-            
+            pch_dir = find_pch_dir(self.compiler_command())
+            if pch_dir:
+                # messages differ with precompiled headers (see pch.py),
+                # so keep this build only if there is none
+                self.build_status = self.build_for_posix(
+                        source_filename,
+                        executable_filename,
+                        "-I %s %s" % (pch_dir, flags['build']),
+                        message_filename)
+                self.read_compiler_messages(message_filename)
+                if self.build_status == 0 and self.compiler_messages == '':
+                    return executable_filename
+
+            self.build_status = self.build_for_posix(source_filename,
+                                                     executable_filename,
+                                                     flags['build'],
+                                                     message_filename)
             self.read_compiler_messages(message_filename)
             return executable_filename
 
         raise BuildError("Don't know how to build")
 
+    def build_for_posix(self, source_filename, executable_filename,
+                        build_flags, message_filename):
+        return os.system("%s %s -o %s %s > %s 2>&1 -lm" % (
+                self.compiler_command(),
+                source_filename, 
+                executable_filename,
+                build_flags,
+                message_filename))
+
+    def build_succeeded(self):
+        return self.build_status == 0
+
     def get_compiler_messages(self):
         return self.compiler_messages
 
@@ -0,0 +1,401 @@
+"""
+File caches shared by all sandboxes: a content-addressed cache of build
+results and a cache of extracted grading supplements.
+
+Compiling C, C++, Java and C# sources takes most of the grading time,
+while many builds are repeated (e.g., the task solution built for every
+change in the test cases, or the same code submitted again).  Each build
+is identified by a hash of its inputs: the builder, the source, the flags
+and the files already in the scratch dir (i.e., the extracted
+supplements).  The files created by the build are kept read-only in the
+cache directory and later put into other scratch dirs, as hardlinks when
+evaluated programs run under box (see can_link) and as copies otherwise.
+
+Scratch dir paths in executable filenames and compiler messages are
+stored as a placeholder and substituted back when an entry is used.
+
+The cache is bounded by size; least recently used entries are removed
+first.  Entries are written into a temporary directory and renamed into
+place, so graders sharing the cache never see incomplete entries.
+
+Grading supplements are extracted once per archive into a read-only
+directory whose files are then linked into each scratch dir (see
+SupplementCache).
+"""
+import os
+import json
+import stat
+import time
+import shutil
+import hashlib
+import tempfile
+
+from django.conf import settings
+
+# bump this when the way builders lay out files changes
+CACHE_VERSION = 2
+
+SCRATCH_DIR_PLACEHOLDER = '@ELAB_SCRATCH_DIR@'
+
+META_FILENAME = 'meta.json'
+FILES_DIRNAME = 'files'
+TEMP_PREFIX = '.tmp-'
+
+# temporary entries older than this (in seconds) are left over by crashed
+# graders and can be removed
+STALE_TEMP_AGE = 3600
+
+WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+
+def scan_dir(path):
+    """
+    Returns a dictionary mapping relative filenames of all regular files
+    under path to their (size, mtime) pairs.
+    """
+    files = {}
+    for root, dirs, filenames in os.walk(path):
+        for fname in filenames:
+            full_name = os.path.join(root, fname)
+            st = os.lstat(full_name)
+            if stat.S_ISREG(st.st_mode):
+                files[os.path.relpath(full_name, path)] = (st.st_size,
+                                                           st.st_mtime_ns)
+    return files
+
+
+def get_cache_options(builder):
+    """
+    Returns builder settings that end up in its build results (other than
+    the flags), e.g., options embedded in a run script.
+    """
+    if hasattr(builder, 'cache_options'):
+        return builder.cache_options()
+    return None
+
+
+def can_link():
+    """
+    Checks if cached files may be hardlinked into scratch dirs.  Only box
+    runs evaluated programs as another user (settings.BOX_USER), who
+    cannot write the read-only cached files; other programs run as the
+    owner of the caches, who could make them writable and change them for
+    every later build or submission.
+    """
+    return getattr(settings, 'USE_BOX_IN_SANDBOX', False)
+
+
+def link_or_copy(src, dest):
+    if can_link():
+        try:
+            os.link(src, dest)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dest)
+
+
+class BuildCache:
+
+    def __init__(self, cache_dir, max_size, ignored_filenames=()):
+        """
+        Keyworded arguments:
+        * max_size : in bytes
+        * ignored_filenames : files in the scratch dir that are never part
+          of a build, e.g., sandbox input and output files
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        self.ignored_filenames = set(ignored_filenames)
+
+    @staticmethod
+    def from_settings(ignored_filenames=()):
+        """
+        Returns the cache configured in settings.SANDBOX_BUILD_CACHE_DIR
+        or None if the cache is disabled.
+        """
+        cache_dir = getattr(settings, 'SANDBOX_BUILD_CACHE_DIR', None)
+        if not cache_dir:
+            return None
+        max_size = settings.SANDBOX_BUILD_CACHE_SIZE * 1024 * 1024
+        return BuildCache(cache_dir, max_size, ignored_filenames)
+
+    def scan(self, scratch_dir):
+        files = scan_dir(scratch_dir)
+        for fname in self.ignored_filenames:
+            files.pop(fname, None)
+        return files
+
+    def get_key(self, builder, source, flags, scratch_dir, files):
+        """
+        Returns the key of the build of source with builder and flags in
+        scratch_dir, whose files (as returned by scan) are also hashed.
+        """
+        h = hashlib.sha256()
+        header = json.dumps([CACHE_VERSION,
+                             builder.__class__.__module__,
+                             builder.__class__.__name__,
+                             flags,
+                             get_cache_options(builder)],
+                            sort_keys=True)
+        h.update(header.encode('utf-8'))
+        h.update(b'\0')
+        h.update(source.encode('utf-8'))
+        for fname in sorted(files):
+            h.update(b'\0')
+            h.update(fname.encode('utf-8', 'surrogateescape'))
+            h.update(b'\0')
+            with open(os.path.join(scratch_dir, fname), 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    h.update(chunk)
+        return h.hexdigest()
+
+    def get_entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def fetch(self, key, scratch_dir):
+        """
+        Puts the files of the cached build into scratch_dir.  Returns the
+        triple (executable_filename, compiler_messages, succeeded), or None
+        when the build is not in the cache.
+        """
+        entry_dir = self.get_entry_dir(key)
+        meta_filename = os.path.join(entry_dir, META_FILENAME)
+        try:
+            with open(meta_filename) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        linked = []
+        try:
+            for fname in meta['files']:
+                src = os.path.join(entry_dir, FILES_DIRNAME, fname)
+                dest = os.path.join(scratch_dir, fname)
+                if os.path.lexists(dest):
+                    # a file the build modified, e.g., a supplement, which
+                    # may be a link itself; replace it with a writable copy
+                    os.remove(dest)
+                    shutil.copyfile(src, dest)
+                    continue
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                link_or_copy(src, dest)
+                linked.append(dest)
+            # mark the entry as recently used
+            os.utime(meta_filename)
+        except OSError:
+            # the entry has just been evicted; leave the dir as it was
+            for dest in linked:
+                try:
+                    os.remove(dest)
+                except OSError:
+                    pass
+            return None
+
+        return (meta['executable_filename'].replace(SCRATCH_DIR_PLACEHOLDER,
+                                                    scratch_dir),
+                meta['compiler_messages'].replace(SCRATCH_DIR_PLACEHOLDER,
+                                                  scratch_dir),
+                meta['succeeded'])
+
+    def store(self, key, scratch_dir, files_before,
+              executable_filename, compiler_messages, succeeded=True):
+        """
+        Stores files created or modified in scratch_dir since files_before
+        was scanned, together with the build results.  Errors are ignored;
+        the build simply does not get cached.
+        """
+        entry_dir = self.get_entry_dir(key)
+        if os.path.exists(entry_dir):
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_dir = tempfile.mkdtemp(prefix=TEMP_PREFIX, dir=self.cache_dir)
+        except OSError:
+            return
+
+        try:
+            size = 0
+            stored_files = []
+            for fname, fstat in self.scan(scratch_dir).items():
+                if files_before.get(fname) == fstat:
+                    continue
+                src = os.path.join(scratch_dir, fname)
+                dest = os.path.join(temp_dir, FILES_DIRNAME, fname)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.copy2(src, dest)
+                os.chmod(dest, stat.S_IMODE(os.stat(dest).st_mode) & ~WRITE_BITS)
+                size += fstat[0]
+                stored_files.append(fname)
+
+            meta = {
+                'files': stored_files,
+                'size': size,
+                'executable_filename':
+                    executable_filename.replace(scratch_dir,
+                                                SCRATCH_DIR_PLACEHOLDER),
+                'compiler_messages':
+                    compiler_messages.replace(scratch_dir,
+                                              SCRATCH_DIR_PLACEHOLDER),
+                'succeeded': succeeded,
+            }
+            with open(os.path.join(temp_dir, META_FILENAME), 'w') as f:
+                json.dump(meta, f)
+
+            # fails when another grader has stored the same build
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits in
+        max_size.
+        """
+        entries = []
+        total_size = 0
+        now = time.time()
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(TEMP_PREFIX):
+                try:
+                    if os.stat(path).st_mtime < now - STALE_TEMP_AGE:
+                        shutil.rmtree(path, ignore_errors=True)
+                except OSError:
+                    pass
+                continue
+            meta_filename = os.path.join(path, META_FILENAME)
+            try:
+                mtime = os.stat(meta_filename).st_mtime
+                with open(meta_filename) as f:
+                    size = json.load(f)['size']
+            except (OSError, ValueError, KeyError):
+                continue
+            entries.append((mtime, path, size))
+            total_size += size
+
+        entries.sort()
+        for mtime, path, size in entries:
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total_size -= size
+
+
+def same_file(st1, st2):
+    """
+    Checks if stat results st1 and st2 refer to the same (or an identical
+    copy of the same) file.
+    """
+    return (os.path.samestat(st1, st2) or
+            (st1.st_size == st2.st_size and
+             st1.st_mtime_ns == st2.st_mtime_ns))
+
+
+def link_tree(src_dir, dest_dir):
+    """
+    Makes every file under src_dir available at the same relative path
+    under dest_dir, by hardlinks or copies (see link_or_copy).  Files in
+    dest_dir that are already links to (or unchanged copies of) the
+    source files are left alone, so calling this again only restores
+    files changed or removed in between.
+    """
+    for root, dirs, filenames in os.walk(src_dir):
+        dest_root = os.path.join(dest_dir, os.path.relpath(root, src_dir))
+        os.makedirs(dest_root, exist_ok=True)
+        for fname in filenames:
+            src = os.path.join(root, fname)
+            dest = os.path.join(dest_root, fname)
+            try:
+                dest_stat = os.lstat(dest)
+            except OSError:
+                dest_stat = None
+            if dest_stat is not None:
+                if same_file(dest_stat, os.stat(src)):
+                    continue
+                os.remove(dest)
+            link_or_copy(src, dest)
+
+
+class SupplementCache:
+    """
+    Keeps each supplement archive extracted in a read-only directory
+    under cache_dir, named after the archive's path and modification
+    time.  A replaced archive gets a new directory; the old ones are
+    removed.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(cache_dir)
+
+    @staticmethod
+    def from_settings():
+        """
+        Returns the cache configured in settings.SUPPLEMENT_CACHE_DIR or
+        None if the cache is disabled.
+        """
+        cache_dir = getattr(settings, 'SUPPLEMENT_CACHE_DIR', None)
+        if not cache_dir:
+            return None
+        return SupplementCache(cache_dir)
+
+    @staticmethod
+    def get_prefix(archive_filename):
+        path = os.path.abspath(archive_filename)
+        return hashlib.sha1(path.encode('utf-8')).hexdigest() + '-'
+
+    def get_dir(self, archive_filename, extract):
+        """
+        Returns the directory holding the files of archive_filename,
+        calling extract(path) to extract the archive into path first if
+        needed.
+        """
+        prefix = SupplementCache.get_prefix(archive_filename)
+        st = os.stat(archive_filename)
+        name = '%s%d-%d' % (prefix, st.st_mtime_ns, st.st_size)
+        extracted_dir = os.path.join(self.cache_dir, name)
+        if os.path.isdir(extracted_dir):
+            return extracted_dir
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix=TEMP_PREFIX, dir=self.cache_dir)
+        try:
+            extract(temp_dir)
+            for root, dirs, filenames in os.walk(temp_dir):
+                for fname in filenames:
+                    full_name = os.path.join(root, fname)
+                    if not os.path.islink(full_name):
+                        mode = stat.S_IMODE(os.stat(full_name).st_mode)
+                        os.chmod(full_name, (mode | stat.S_IRUSR) & ~WRITE_BITS)
+            os.rename(temp_dir, extracted_dir)
+        except OSError:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            # another grader may have extracted the same archive
+            if not os.path.isdir(extracted_dir):
+                raise
+            return extracted_dir
+
+        self.remove(archive_filename, keep=name)
+        return extracted_dir
+
+    def remove(self, archive_filename, keep=None):
+        """
+        Removes every extracted copy of archive_filename, except the one
+        named keep.
+        """
+        prefix = SupplementCache.get_prefix(archive_filename)
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith(prefix) and name != keep:
+                shutil.rmtree(os.path.join(self.cache_dir, name),
+                              ignore_errors=True)
@@ -0,0 +1,334 @@
+"""
+Java compile server of the graders.
+
+Starting the JVM of javac and warming up the compiler takes most of the
+time of building a small Java submission.  After enable() with
+settings.JAVA_COMPILE_SERVER, a grader worker keeps a JVM running
+java/CompileServer.java, which compiles with the entry point of the javac
+command itself (com.sun.tools.javac.Main) and returns the status and the
+messages exactly as the command writes them.  The server talks through a
+socket pair connected to its standard input and output, so that only the
+grader that started it can use it.
+
+A server is started by the first build, pinged before builds after it
+has been idle, and restarted after settings.JAVA_COMPILE_SERVER_MAX_COMPILES
+builds or once its resident memory exceeds
+settings.JAVA_COMPILE_SERVER_MAX_MEMORY, as javac leaves classes and
+cached files behind.  JavaBuilder runs the javac command as before when
+the server cannot build the sources the same way (see get_javac_args) or
+fails to answer.
+
+C# builds still run gmcs for every submission.
+"""
+import os
+import time
+import shlex
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import subprocess
+
+from django.conf import settings
+
+SERVER_SOURCE = os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                             'java', 'CompileServer.java')
+
+# a server idle for longer than this (in seconds) is pinged before a build
+HEALTH_CHECK_INTERVAL = 60
+
+# how long (in seconds) a new server may take to answer its first ping
+STARTUP_TIMEOUT = 30
+
+# javac options whose value, given as the next argument, is not a path
+VALUE_OPTIONS = {
+    '-encoding', '-source', '--source', '-target', '--target', '--release',
+    '-Xmaxerrs', '-Xmaxwarns',
+}
+
+# javac options taking paths, which would be resolved against the
+# directory of the server instead of the scratch dir
+PATH_OPTIONS = {
+    '-cp', '-classpath', '--class-path', '-sourcepath', '--source-path',
+    '-d', '-s', '-h', '-p', '--module-path', '--module-source-path',
+    '--upgrade-module-path', '--system', '-processorpath',
+    '--processor-path', '--processor-module-path', '-bootclasspath',
+    '--boot-class-path', '-extdirs', '-endorseddirs', '-Xstdout',
+}
+
+# characters that the shell running the javac command would expand
+SHELL_CHARACTERS = set('$`*?[]~;&|<>(){}!#')
+
+
+class CompileServerError(Exception):
+    pass
+
+
+def get_javac_args(build_flags, sources, cwd):
+    """
+    Returns the javac arguments compiling sources in cwd with build_flags
+    just like the javac command run in cwd, or None if the compile server
+    cannot build them the same way.
+    """
+    if (SHELL_CHARACTERS.intersection(build_flags)
+            or os.environ.get('JDK_JAVAC_OPTIONS')):
+        return None
+    try:
+        flags = shlex.split(build_flags)
+    except ValueError:
+        return None
+
+    expects_value = False
+    for flag in flags:
+        if expects_value:
+            expects_value = False
+        elif not flag.startswith('-') or flag.startswith('-J'):
+            # sources, argument files and JVM options
+            return None
+        elif flag.partition('=')[0] in PATH_OPTIONS:
+            return None
+        else:
+            expects_value = flag in VALUE_OPTIONS
+    if expects_value:
+        return None
+
+    # without -cp, javac searches the classpath (and sources) in $CLASSPATH,
+    # or else in the current directory
+    classpath = os.pathsep.join(
+            os.path.join(cwd, path)
+            for path in (os.environ.get('CLASSPATH') or '.').split(os.pathsep))
+    return ['-cp', classpath] + flags + list(sources)
+
+
+def encode_utf(s):
+    """
+    Encodes s as DataOutputStream.writeUTF does.
+    """
+    if '\0' in s or any(ord(c) > 0xffff for c in s):
+        # encoded differently in modified UTF-8
+        raise CompileServerError('cannot send %r' % s)
+    data = s.encode('utf-8', 'surrogatepass')
+    if len(data) > 0xffff:
+        raise CompileServerError('argument too long')
+    return struct.pack('>H', len(data)) + data
+
+
+def get_memory_usage(pid):
+    """
+    Returns the resident memory of process pid in KB, or None if unknown.
+    """
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class JavaCompileServer:
+
+    def __init__(self, javac='javac', max_compiles=500, max_memory=512,
+                 timeout=60):
+        self.javac = javac
+        self.max_compiles = max_compiles
+        self.max_memory = max_memory
+        self.timeout = timeout
+        self.process = None
+        self.socket = None
+        self.class_dir = None
+        # why no server can be started, e.g., without a JDK
+        self.unavailable = None
+        self.compiles = 0
+        self.last_used_at = 0
+        self.lock = threading.Lock()
+
+    def find_jdk(self):
+        """
+        Returns the javac and java executables of the JDK of self.javac.
+        """
+        javac = shutil.which(self.javac)
+        if not javac:
+            raise CompileServerError('%s not found' % self.javac)
+        javac = os.path.realpath(javac)
+        java = os.path.join(os.path.dirname(javac), 'java')
+        if not os.path.exists(java):
+            raise CompileServerError('%s not found' % java)
+        return javac, java
+
+    def get_classpath(self, javac):
+        classpath = [self.class_dir]
+        # javac of Java 8 and older is not on the default classpath
+        tools_jar = os.path.join(os.path.dirname(os.path.dirname(javac)),
+                                 'lib', 'tools.jar')
+        if os.path.exists(tools_jar):
+            classpath.append(tools_jar)
+        return os.pathsep.join(classpath)
+
+    def compile_server_class(self, javac):
+        class_dir = tempfile.mkdtemp(prefix='elab-compile-server-')
+        status = subprocess.call([javac, '-d', class_dir, SERVER_SOURCE],
+                                 stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.DEVNULL)
+        if status != 0:
+            shutil.rmtree(class_dir, ignore_errors=True)
+            raise CompileServerError('cannot compile %s' % SERVER_SOURCE)
+        self.class_dir = class_dir
+
+    def start(self):
+        if self.unavailable:
+            raise CompileServerError(self.unavailable)
+        try:
+            javac, java = self.find_jdk()
+            if self.class_dir is None:
+                self.compile_server_class(javac)
+        except CompileServerError as e:
+            self.unavailable = str(e)
+            raise
+        parent_socket, child_socket = socket.socketpair()
+        try:
+            self.process = subprocess.Popen(
+                    [java, '-XX:+UseSerialGC', '-Xshare:auto',
+                     '-cp', self.get_classpath(javac), 'CompileServer'],
+                    stdin=child_socket,
+                    stdout=child_socket,
+                    stderr=subprocess.DEVNULL)
+        except OSError as e:
+            parent_socket.close()
+            raise CompileServerError(str(e))
+        finally:
+            child_socket.close()
+        self.socket = parent_socket
+        self.compiles = 0
+        self.ping(STARTUP_TIMEOUT)
+
+    def stop(self):
+        if self.socket:
+            self.socket.close()
+            self.socket = None
+        if self.process:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def close(self):
+        self.stop()
+        if self.class_dir:
+            shutil.rmtree(self.class_dir, ignore_errors=True)
+            self.class_dir = None
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def receive(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            if not chunk:
+                raise EOFError('compile server closed the connection')
+            data += chunk
+        return data
+
+    def request(self, request, timeout=None):
+        """
+        Sends an encoded request and returns the status and body of the
+        response.  The server is stopped if it does not answer in time.
+        """
+        try:
+            self.socket.settimeout(timeout or self.timeout)
+            self.socket.sendall(request)
+            status, length = struct.unpack('>ii', self.receive(8))
+            body = self.receive(length)
+        except (OSError, EOFError) as e:
+            self.stop()
+            raise CompileServerError(str(e) or 'compile server timed out')
+        if status < 0:
+            raise CompileServerError(body.decode('utf-8', 'replace'))
+        return status, body
+
+    def ping(self, timeout=None):
+        """
+        Returns the heap used by the server in bytes.
+        """
+        status, body = self.request(encode_utf('ping'), timeout)
+        return int(body)
+
+    def check_health(self):
+        """
+        Restarts the server unless it is running and answers a ping.
+        """
+        if self.is_running():
+            try:
+                self.ping()
+                return
+            except CompileServerError:
+                pass
+        self.stop()
+        self.start()
+
+    def is_leaking(self):
+        if self.compiles >= self.max_compiles:
+            return True
+        memory = get_memory_usage(self.process.pid)
+        return memory is not None and memory > self.max_memory * 1024
+
+    def compile(self, args):
+        """
+        Compiles with the javac arguments args.  Returns the status of
+        javac and its messages as bytes.
+        """
+        request = (encode_utf('compile') + struct.pack('>i', len(args)) +
+                   b''.join(encode_utf(arg) for arg in args))
+        with self.lock:
+            if not self.is_running():
+                self.stop()
+                self.start()
+            elif time.time() - self.last_used_at > HEALTH_CHECK_INTERVAL:
+                self.check_health()
+            status, messages = self.request(request)
+            self.compiles += 1
+            self.last_used_at = time.time()
+            if self.is_leaking():
+                # started again by the next build
+                self.stop()
+        return status, messages
+
+
+_server = None
+
+
+def enable():
+    """
+    Makes Java builds in this process use a compile server if
+    settings.JAVA_COMPILE_SERVER is set.  The server is started by the
+    first build.
+    """
+    global _server
+    if getattr(settings, 'JAVA_COMPILE_SERVER', False) and _server is None:
+        _server = JavaCompileServer(
+                max_compiles=settings.JAVA_COMPILE_SERVER_MAX_COMPILES,
+                max_memory=settings.JAVA_COMPILE_SERVER_MAX_MEMORY,
+                timeout=settings.JAVA_COMPILE_SERVER_TIMEOUT)
+
+
+def disable():
+    global _server
+    if _server is not None:
+        _server.close()
+        _server = None
+
+
+def get_server():
+    return _server
+
+
+def _forget_server():
+    # the server belongs to the parent process
+    global _server
+    _server = None
+
+
+os.register_at_fork(after_in_child=_forget_server)
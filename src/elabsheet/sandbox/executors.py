@@ -0,0 +1,409 @@
+"""
+Executors run a command line prepared by Sandbox, i.e., an executable
+(possibly wrapped by box) with its input, output and error streams
+redirected to files inside the scratch dir.
+
+Each executor supports:
+
+* run(args, cwd, env, stdin_filename, stdout_filename, stderr_filename,
+  output_limit, time_limit, memory_limit, wall_clock): runs the argument
+  list args in directory cwd with additional environment variables env
+  (a dict).  Streams whose filenames are None are inherited from the
+  calling process.  When output_limit (in bytes) is given, the command is
+  killed with SIGXFSZ when it writes a file beyond that size
+  (RLIMIT_FSIZE, set by a shell before it execs the command).  Returns a
+  RunStats of the command.
+
+  time_limit (in seconds of wall clock time, or CPU time if wall_clock is
+  False) and memory_limit (in KB) are enforced only by executors that
+  can (see CgroupExecutor); others leave them to box.
+
+An executor whose thread_safe attribute is True can be used by many
+threads of the same process at the same time.  One whose isolated
+attribute is True confines the command in a way that other runners (e.g.,
+the Python fork server) do not, so Sandbox always runs commands with it.
+"""
+import os
+import time
+import shlex
+import signal
+import resource
+import itertools
+import subprocess
+
+# unit of "ulimit -f" in POSIX shells
+SHELL_BLOCK_SIZE = 512
+
+from django.conf import settings
+
+from .stats import RunStats
+
+
+class UnknownExecutor(Exception):
+    pass
+
+
+def get_ulimit_blocks(output_limit):
+    """
+    Returns the argument of "ulimit -f" limiting files to output_limit
+    bytes (or not at all if None).
+    """
+    if not output_limit:
+        return 'unlimited'
+    return str(-(-output_limit // SHELL_BLOCK_SIZE))
+
+
+class ShellExecutor:
+    """
+    Runs the command through the shell, like os.system.  It changes the
+    working directory and environment of the whole process, so only one
+    command may run in a process at a time.
+    """
+    thread_safe = False
+    isolated = False
+
+    def run(self, args, cwd, env,
+            stdin_filename=None, stdout_filename=None, stderr_filename=None,
+            output_limit=None, time_limit=None, memory_limit=None,
+            wall_clock=True):
+        cmd = ' '.join(shlex.quote(arg) for arg in args)
+        if output_limit:
+            cmd = 'ulimit -f %s && exec %s' % (get_ulimit_blocks(output_limit),
+                                               cmd)
+        if stdin_filename:
+            cmd += ' < ' + shlex.quote(stdin_filename)
+        if stdout_filename:
+            cmd += ' > ' + shlex.quote(stdout_filename)
+        if stderr_filename:
+            cmd += ' 2> ' + shlex.quote(stderr_filename)
+
+        for name, value in env.items():
+            os.putenv(name, value)
+        initial_dir = os.getcwd()
+        os.chdir(cwd)
+        usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start_time = time.monotonic()
+        try:
+            # unlike os.system, Popen restores signals that Python ignores,
+            # e.g., SIGXFSZ, which enforces the output limit
+            process = subprocess.Popen(cmd, shell=True)
+            pid, wait_status = os.waitpid(process.pid, 0)
+            process.returncode = wait_status
+        finally:
+            os.chdir(initial_dir)
+        wall_time = time.monotonic() - start_time
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        # times of all children (including the shell) add up; peak memory
+        # is the largest of all children so far
+        stats = RunStats.from_rusage(wait_status, usage, wall_time)
+        stats.user_time -= usage_before.ru_utime
+        stats.system_time -= usage_before.ru_stime
+        return stats
+
+
+class SubprocessExecutor:
+    """
+    Runs the command directly (without a shell) with subprocess, giving
+    it its own working directory and environment.
+    """
+    thread_safe = True
+    isolated = False
+
+    # the command first sets its output limit (RLIMIT_FSIZE), then execs;
+    # a preexec_fn would not be safe in threads
+    LIMIT_OUTPUT = 'ulimit -f "$0" && exec "$@"'
+
+
+    @staticmethod
+    def open_or_none(filename, mode):
+        if filename:
+            return open(filename, mode)
+        return None
+
+    def run(self, args, cwd, env,
+            stdin_filename=None, stdout_filename=None, stderr_filename=None,
+            output_limit=None, time_limit=None, memory_limit=None,
+            wall_clock=True):
+        full_env = dict(os.environ)
+        full_env.update(env)
+
+        stdin = SubprocessExecutor.open_or_none(stdin_filename, 'rb')
+        stdout = SubprocessExecutor.open_or_none(stdout_filename, 'wb')
+        stderr = SubprocessExecutor.open_or_none(stderr_filename, 'wb')
+        if output_limit:
+            args = (['/bin/sh', '-c', self.LIMIT_OUTPUT,
+                     get_ulimit_blocks(output_limit)] +
+                    list(args))
+        start_time = time.monotonic()
+        try:
+            process = subprocess.Popen(args, cwd=cwd, env=full_env,
+                                       stdin=stdin, stdout=stdout,
+                                       stderr=stderr)
+        except OSError:
+            # e.g., the executable does not exist because the build failed;
+            # the output file is left empty as with the shell
+            return RunStats(status=RunStats.ERROR)
+        finally:
+            for f in (stdin, stdout, stderr):
+                if f:
+                    f.close()
+
+        # reap the process ourselves to get its resource usage
+        pid, wait_status, rusage = os.wait4(process.pid, 0)
+        wall_time = time.monotonic() - start_time
+        if os.WIFEXITED(wait_status):
+            process.returncode = os.WEXITSTATUS(wait_status)
+        else:
+            process.returncode = -os.WTERMSIG(wait_status)
+        return RunStats.from_rusage(wait_status, rusage, wall_time)
+
+
+class CgroupNotReady(Exception):
+    pass
+
+
+class CgroupExecutor(SubprocessExecutor):
+    """
+    Runs the command like SubprocessExecutor, but inside its own cgroup
+    (v2), created under settings.SANDBOX_CGROUP_DIR and removed
+    afterwards.  The cgroup limits memory (memory.max, without swap) and
+    CPU bandwidth (cpu.max), and gives exact CPU time and peak memory of
+    the whole process tree, which is killed at once (cgroup.kill) when the
+    time limit is exceeded.
+
+    SANDBOX_CGROUP_DIR must be a cgroup delegated to the user running the
+    graders (e.g., with systemd's Delegate=yes), containing no processes,
+    with the memory and cpu controllers available.  See INSTALL_NOTES.
+    """
+    thread_safe = True
+    isolated = True
+
+    # the command first moves itself into the cgroup and sets its output
+    # limit, then execs; a preexec_fn would not be safe in threads
+    ENTER_CGROUP = 'echo $$ > "$0" && ulimit -f "$1" && shift && exec "$@"'
+
+    REQUIRED_CONTROLLERS = ('memory', 'cpu')
+
+    # CPU bandwidth period for cpu.max, in microseconds
+    CPU_PERIOD = 100000
+
+    # polling intervals (in seconds) while waiting for the command
+    MIN_POLL_INTERVAL = 0.001
+    MAX_POLL_INTERVAL = 0.02
+
+    # without wall clock limits, sleeping programs are still killed after
+    # this many times the time limit
+    IDLE_TIME_FACTOR = 3
+
+    _counter = itertools.count()
+
+    def __init__(self, cgroup_dir=None, cpus=None):
+        if cgroup_dir is None:
+            cgroup_dir = settings.SANDBOX_CGROUP_DIR
+        if cpus is None:
+            cpus = settings.SANDBOX_CGROUP_CPUS
+        self.cgroup_dir = cgroup_dir
+        self.cpus = cpus
+        self.enable_controllers()
+
+    @staticmethod
+    def read_file(filename):
+        with open(filename) as f:
+            return f.read()
+
+    @staticmethod
+    def write_file(filename, value):
+        with open(filename, 'w') as f:
+            f.write(value)
+
+    @staticmethod
+    def read_keyed_file(filename):
+        """
+        Reads a flat keyed file such as cpu.stat into a dictionary.
+        """
+        values = {}
+        try:
+            for line in CgroupExecutor.read_file(filename).splitlines():
+                key, _, value = line.partition(' ')
+                values[key] = int(value)
+        except (OSError, ValueError):
+            pass
+        return values
+
+    def enable_controllers(self):
+        try:
+            available = self.read_file(
+                os.path.join(self.cgroup_dir, 'cgroup.controllers')).split()
+            enabled = self.read_file(
+                os.path.join(self.cgroup_dir, 'cgroup.subtree_control')).split()
+        except OSError as e:
+            raise CgroupNotReady('cannot read %s: %s' % (self.cgroup_dir, e))
+        missing = [c for c in self.REQUIRED_CONTROLLERS if c not in enabled]
+        if not missing:
+            return
+        for controller in missing:
+            if controller not in available:
+                raise CgroupNotReady('controller %s is not available in %s'
+                                     % (controller, self.cgroup_dir))
+        try:
+            self.write_file(
+                os.path.join(self.cgroup_dir, 'cgroup.subtree_control'),
+                ' '.join('+' + c for c in missing))
+        except OSError as e:
+            raise CgroupNotReady('cannot enable controllers in %s: %s'
+                                 % (self.cgroup_dir, e))
+
+    def create_cgroup(self, memory_limit):
+        path = os.path.join(self.cgroup_dir, 'run-%d-%d' % (
+            os.getpid(), next(CgroupExecutor._counter)))
+        os.mkdir(path)
+        try:
+            if memory_limit:
+                self.write_file(os.path.join(path, 'memory.max'),
+                                str(memory_limit * 1024))
+                self.write_file(os.path.join(path, 'memory.swap.max'), '0')
+            if self.cpus:
+                self.write_file(os.path.join(path, 'cpu.max'), '%d %d' % (
+                    self.cpus * self.CPU_PERIOD, self.CPU_PERIOD))
+        except OSError:
+            os.rmdir(path)
+            raise
+        return path
+
+    def kill_cgroup(self, path):
+        try:
+            self.write_file(os.path.join(path, 'cgroup.kill'), '1')
+            return
+        except OSError:
+            # kernels before 5.14 have no cgroup.kill
+            pass
+        try:
+            for pid in self.read_file(os.path.join(path,
+                                                   'cgroup.procs')).split():
+                try:
+                    os.kill(int(pid), signal.SIGKILL)
+                except OSError:
+                    pass
+        except OSError:
+            pass
+
+    def remove_cgroup(self, path):
+        """
+        Kills what is left of the process tree and removes the cgroup.
+        """
+        delay = self.MIN_POLL_INTERVAL
+        for attempt in range(50):
+            self.kill_cgroup(path)
+            try:
+                os.rmdir(path)
+                return
+            except OSError:
+                # killed processes have not exited yet
+                time.sleep(delay)
+                delay = min(delay * 2, self.MAX_POLL_INTERVAL)
+
+    def get_cpu_time(self, path):
+        return self.read_keyed_file(
+            os.path.join(path, 'cpu.stat')).get('usage_usec', 0) / 1000000.0
+
+    def wait(self, pid, path, time_limit, wall_clock, start_time):
+        """
+        Waits for the command, killing it when it exceeds the time limit.
+        Returns (wait_status, rusage, timed_out).
+        """
+        timed_out = False
+        delay = self.MIN_POLL_INTERVAL
+        while True:
+            waited_pid, wait_status, rusage = os.wait4(pid, os.WNOHANG)
+            if waited_pid == pid:
+                return wait_status, rusage, timed_out
+            if time_limit and not timed_out:
+                wall_time = time.monotonic() - start_time
+                if wall_clock:
+                    timed_out = wall_time > time_limit
+                else:
+                    timed_out = (self.get_cpu_time(path) > time_limit or
+                                 wall_time > time_limit * self.IDLE_TIME_FACTOR)
+                if timed_out:
+                    self.kill_cgroup(path)
+                    continue
+            time.sleep(delay)
+            delay = min(delay * 2, self.MAX_POLL_INTERVAL)
+
+    def run(self, args, cwd, env,
+            stdin_filename=None, stdout_filename=None, stderr_filename=None,
+            output_limit=None, time_limit=None, memory_limit=None,
+            wall_clock=True):
+        full_env = dict(os.environ)
+        full_env.update(env)
+
+        path = self.create_cgroup(memory_limit)
+        try:
+            stdin = SubprocessExecutor.open_or_none(stdin_filename, 'rb')
+            stdout = SubprocessExecutor.open_or_none(stdout_filename, 'wb')
+            stderr = SubprocessExecutor.open_or_none(stderr_filename, 'wb')
+            start_time = time.monotonic()
+            try:
+                process = subprocess.Popen(
+                    ['/bin/sh', '-c', self.ENTER_CGROUP,
+                     os.path.join(path, 'cgroup.procs'),
+                     get_ulimit_blocks(output_limit)] +
+                    list(args),
+                    cwd=cwd, env=full_env,
+                    stdin=stdin, stdout=stdout, stderr=stderr)
+            finally:
+                for f in (stdin, stdout, stderr):
+                    if f:
+                        f.close()
+
+            wait_status, rusage, timed_out = self.wait(process.pid, path,
+                                                       time_limit, wall_clock,
+                                                       start_time)
+            wall_time = time.monotonic() - start_time
+            if os.WIFEXITED(wait_status):
+                process.returncode = os.WEXITSTATUS(wait_status)
+            else:
+                process.returncode = -os.WTERMSIG(wait_status)
+
+            stats = RunStats.from_rusage(wait_status, rusage, wall_time)
+            cpu_stat = self.read_keyed_file(os.path.join(path, 'cpu.stat'))
+            if 'user_usec' in cpu_stat:
+                stats.user_time = cpu_stat['user_usec'] / 1000000.0
+                stats.system_time = cpu_stat['system_usec'] / 1000000.0
+            try:
+                stats.memory = int(self.read_file(
+                    os.path.join(path, 'memory.peak'))) // 1024
+            except (OSError, ValueError):
+                # memory.peak needs Linux 5.19; keep the peak from rusage
+                pass
+            memory_events = self.read_keyed_file(
+                os.path.join(path, 'memory.events'))
+
+            if timed_out:
+                stats.status = RunStats.TIME_LIMIT
+            elif (stats.status == RunStats.ERROR and
+                  memory_events.get('oom_kill', 0) > 0):
+                stats.status = RunStats.MEMORY_LIMIT
+            return stats
+        finally:
+            self.remove_cgroup(path)
+
+
+EXECUTORS = {
+    'shell': ShellExecutor,
+    'subprocess': SubprocessExecutor,
+    'cgroup': CgroupExecutor,
+}
+
+
+def get_executor(name=None):
+    """
+    Returns an executor by name, settings.SANDBOX_EXECUTOR if None.
+    """
+    if name is None:
+        name = getattr(settings, 'SANDBOX_EXECUTOR', 'shell')
+    try:
+        return EXECUTORS[name]()
+    except KeyError:
+        raise UnknownExecutor(name)
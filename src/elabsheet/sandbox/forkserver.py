@@ -0,0 +1,133 @@
+"""
+Client side of the Python fork server (see pyforkserver.py).
+
+Starting a new interpreter and importing the standard modules takes most
+of the running time of a short Python submission.  A fork server keeps a
+warmed interpreter and forks it for every test case instead.  Servers are
+started lazily, one per interpreter executable for each concurrently
+running evaluation, and reused afterwards.
+
+The fork server only applies resource limits (setrlimit and a timer);
+it does not filter system calls like box, so it is used only when box is
+not (see Sandbox.evaluate).
+"""
+import os
+import json
+import threading
+import subprocess
+
+from .stats import RunStats
+
+SERVER_SCRIPT = os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                             'pyforkserver.py')
+
+
+class ForkServerError(Exception):
+    pass
+
+
+class ForkServer:
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.process = subprocess.Popen([interpreter, SERVER_SCRIPT],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        universal_newlines=True)
+
+    def run(self, script, cwd, env, stdin_filename, stdout_filename,
+            time_limit, memory_limit, wall_clock, output_limit=None):
+        """
+        Runs script in a forked interpreter.  memory_limit is in KB and
+        output_limit in bytes.  Returns a RunStats.
+        """
+        request = {
+            'script': script,
+            'cwd': cwd,
+            'env': env,
+            'stdin': stdin_filename,
+            'stdout': stdout_filename,
+            'time_limit': time_limit,
+            'memory_limit': memory_limit,
+            'wall_clock': wall_clock,
+            'output_limit': output_limit,
+        }
+        try:
+            self.process.stdin.write(json.dumps(request) + '\n')
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        except (OSError, ValueError) as e:
+            raise ForkServerError(str(e))
+        if not line:
+            raise ForkServerError('fork server exited')
+        response = json.loads(line)
+        if response['status'] == 'failed':
+            raise ForkServerError(response.get('message'))
+
+        statuses = {
+            'ok': RunStats.OK,
+            'error': RunStats.ERROR,
+            'time': RunStats.TIME_LIMIT,
+            'memory': RunStats.MEMORY_LIMIT,
+            'output': RunStats.OUTPUT_LIMIT,
+        }
+        return RunStats(status=statuses[response['status']],
+                        wall_time=response['wall'],
+                        user_time=response['user'],
+                        system_time=response['sys'],
+                        memory=response['mem'])
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+
+
+_lock = threading.Lock()
+_idle_servers = {}
+_owner_pid = None
+
+
+def _acquire(interpreter):
+    global _owner_pid, _idle_servers
+    with _lock:
+        if _owner_pid != os.getpid():
+            # servers of the parent must not be used by a forked grader
+            _owner_pid = os.getpid()
+            _idle_servers = {}
+        servers = _idle_servers.setdefault(interpreter, [])
+        if servers:
+            return servers.pop()
+    return ForkServer(interpreter)
+
+
+def _release(server):
+    with _lock:
+        if _owner_pid == os.getpid():
+            _idle_servers.setdefault(server.interpreter, []).append(server)
+            return
+    server.close()
+
+
+def run_script(interpreter, script, cwd, env, stdin_filename,
+               stdout_filename, time_limit, memory_limit, wall_clock,
+               output_limit=None):
+    """
+    Runs script with a fork server for interpreter.  See ForkServer.run.
+    Raises ForkServerError when the server cannot be used; the caller may
+    then run the script normally.
+    """
+    try:
+        server = _acquire(interpreter)
+    except OSError as e:
+        raise ForkServerError(str(e))
+    try:
+        stats = server.run(script, cwd, env, stdin_filename, stdout_filename,
+                           time_limit, memory_limit, wall_clock, output_limit)
+    except ForkServerError:
+        server.close()
+        raise
+    _release(server)
+    return stats
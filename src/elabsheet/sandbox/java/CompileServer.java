@@ -0,0 +1,84 @@
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.EOFException;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.OutputStreamWriter;
+import java.io.PrintWriter;
+import java.nio.charset.Charset;
+
+/**
+ * Server side of the Java compile server (see compileserver.py).
+ *
+ * Reads requests from standard input and writes responses to standard
+ * output, which the grader connects to a socket.  A request is a command,
+ * written as by DataOutputStream.writeUTF, followed for "compile" by the
+ * number of javac arguments and the arguments themselves.  A response is
+ * the status, the length of the messages and the messages, written by
+ * javac just as the javac command writes them to its standard error.
+ */
+public class CompileServer {
+
+    public static void main(String[] args) throws IOException {
+        DataInputStream in = new DataInputStream(
+                new BufferedInputStream(System.in));
+        DataOutputStream out = new DataOutputStream(
+                new BufferedOutputStream(new FileOutputStream(FileDescriptor.out)));
+        // nothing else may write to the socket
+        System.setOut(System.err);
+
+        Charset charset = getMessageCharset();
+        while (true) {
+            String command;
+            try {
+                command = in.readUTF();
+            } catch (EOFException e) {
+                return;
+            }
+            if (command.equals("ping")) {
+                Runtime runtime = Runtime.getRuntime();
+                long used = runtime.totalMemory() - runtime.freeMemory();
+                writeResponse(out, 0, Long.toString(used).getBytes("UTF-8"));
+            } else if (command.equals("compile")) {
+                String[] javacArgs = new String[in.readInt()];
+                for (int i = 0; i < javacArgs.length; i++) {
+                    javacArgs[i] = in.readUTF();
+                }
+                ByteArrayOutputStream messages = new ByteArrayOutputStream();
+                PrintWriter writer = new PrintWriter(
+                        new OutputStreamWriter(messages, charset), true);
+                int status = com.sun.tools.javac.Main.compile(javacArgs, writer);
+                writer.flush();
+                writeResponse(out, status, messages.toByteArray());
+            } else {
+                writeResponse(out, -1, ("unknown command " + command).getBytes("UTF-8"));
+            }
+        }
+    }
+
+    /**
+     * Returns the charset of System.err, in which the javac command
+     * writes its messages.
+     */
+    static Charset getMessageCharset() {
+        for (String property : new String[] {"stderr.encoding", "sun.stderr.encoding"}) {
+            String name = System.getProperty(property);
+            if (name != null && Charset.isSupported(name)) {
+                return Charset.forName(name);
+            }
+        }
+        return Charset.defaultCharset();
+    }
+
+    static void writeResponse(DataOutputStream out, int status, byte[] body)
+            throws IOException {
+        out.writeInt(status);
+        out.writeInt(body.length);
+        out.write(body);
+        out.flush();
+    }
+}
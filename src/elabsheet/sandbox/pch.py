@@ -0,0 +1,178 @@
+"""
+Precompiled headers of the C and C++ builders.
+
+Parsing common headers such as <bits/stdc++.h> or <iostream> takes most
+of the time of compiling small C++ programs.  Graders precompile the
+headers listed in settings.SANDBOX_PCH_HEADERS for the compiler of each
+language once, at startup (prepare_precompiled_headers), into a directory
+that CBuilder and its subclasses then pass to the compiler with -I.
+
+GCC looks for NAME.gch in each include directory before looking for NAME
+itself.  Here, every NAME.gch is a directory holding a header precompiled
+for each build flags in settings.SANDBOX_PCH_BUILD_FLAGS, of which GCC
+uses the one precompiled with options compatible with the build, if any;
+otherwise, it silently parses the header as usual.
+
+A build that uses a precompiled header reports fewer "included from"
+lines in its messages, so CBuilder compiles again without precompiled
+headers unless the first build succeeds without any message (see
+CBuilder.build).
+"""
+import os
+import json
+import time
+import shlex
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+from django.conf import settings
+
+MANIFEST_FILENAME = 'manifest.json'
+
+HEADER_LANGUAGES = {
+    'c': 'c-header',
+    'cpp': 'c++-header',
+}
+
+
+def get_pch_dir(compiler_command):
+    """
+    Returns the directory of headers precompiled for compiler_command.
+    """
+    key = hashlib.sha256(compiler_command.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(settings.SANDBOX_PCH_DIR, key)
+
+
+def find_pch_dir(compiler_command):
+    """
+    Returns the directory of headers precompiled for compiler_command, or
+    None if there is none.
+    """
+    if not getattr(settings, 'SANDBOX_PCH_DIR', None):
+        return None
+    pch_dir = get_pch_dir(compiler_command)
+    if os.path.isdir(pch_dir):
+        return pch_dir
+    return None
+
+
+def get_compiler_version(compiler_command):
+    try:
+        return subprocess.check_output(compiler_command + ' --version',
+                                       shell=True,
+                                       stderr=subprocess.DEVNULL,
+                                       universal_newlines=True)
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def read_manifest(pch_dir):
+    try:
+        with open(os.path.join(pch_dir, MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def precompile(compiler_command, header_language, headers, build_flags,
+               pch_dir):
+    """
+    Precompiles headers into pch_dir, once for each build flags.  Returns
+    the number of headers precompiled for at least one build flags.
+    """
+    precompiled = 0
+    with tempfile.TemporaryDirectory() as source_dir:
+        for header in headers:
+            # a header including the real one stands in for it
+            source_filename = os.path.join(source_dir, header)
+            os.makedirs(os.path.dirname(source_filename), exist_ok=True)
+            with open(source_filename, 'w') as f:
+                f.write('#include <%s>\n' % header)
+            gch_dir = os.path.join(pch_dir, header + '.gch')
+            os.makedirs(gch_dir, exist_ok=True)
+            succeeded = False
+            for i, flags in enumerate(build_flags):
+                status = subprocess.call(
+                    '%s -x %s %s -o %s %s' % (
+                        compiler_command,
+                        header_language,
+                        flags,
+                        shlex.quote(os.path.join(gch_dir, '%d.gch' % i)),
+                        shlex.quote(source_filename)),
+                    shell=True,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL)
+                succeeded = succeeded or status == 0
+            if succeeded:
+                precompiled += 1
+            else:
+                shutil.rmtree(gch_dir)
+    return precompiled
+
+
+def replace_dir(new_dir, pch_dir):
+    """
+    Moves new_dir to pch_dir, in place of any older one.
+    """
+    old_dir = None
+    if os.path.exists(pch_dir):
+        old_dir = tempfile.mkdtemp(dir=os.path.dirname(pch_dir),
+                                   prefix='.old-')
+        os.rename(pch_dir, os.path.join(old_dir, 'pch'))
+    try:
+        os.rename(new_dir, pch_dir)
+    except OSError:
+        # another grader has just put its own there
+        shutil.rmtree(new_dir, ignore_errors=True)
+    if old_dir:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def prepare_precompiled_headers():
+    """
+    Precompiles the headers of each language in
+    settings.SANDBOX_PCH_HEADERS, unless they have already been
+    precompiled with the same compiler version, headers and build flags.
+    Returns (language, message) pairs reporting what has been done.
+    """
+    from .builders import BuilderFactory
+
+    if not getattr(settings, 'SANDBOX_PCH_DIR', None):
+        return []
+    os.makedirs(settings.SANDBOX_PCH_DIR, exist_ok=True)
+    report = []
+    for language, headers in sorted(settings.SANDBOX_PCH_HEADERS.items()):
+        builder = BuilderFactory.get(language)
+        compiler_command = builder.compiler_command()
+        version = get_compiler_version(compiler_command)
+        if version is None:
+            report.append((language, 'compiler not found'))
+            continue
+        manifest = {
+            'compiler': compiler_command,
+            'version': version,
+            'headers': list(headers),
+            'build_flags': list(settings.SANDBOX_PCH_BUILD_FLAGS),
+        }
+        pch_dir = get_pch_dir(compiler_command)
+        if read_manifest(pch_dir) == manifest:
+            report.append((language, 'up to date'))
+            continue
+
+        started_at = time.time()
+        new_dir = tempfile.mkdtemp(dir=settings.SANDBOX_PCH_DIR,
+                                   prefix='.tmp-')
+        precompiled = precompile(compiler_command,
+                                 HEADER_LANGUAGES[builder.source_extension()],
+                                 headers,
+                                 settings.SANDBOX_PCH_BUILD_FLAGS,
+                                 new_dir)
+        with open(os.path.join(new_dir, MANIFEST_FILENAME), 'w') as f:
+            json.dump(manifest, f)
+        os.chmod(new_dir, 0o755)
+        replace_dir(new_dir, pch_dir)
+        report.append((language, 'precompiled %d of %d headers in %.1fs' % (
+            precompiled, len(headers), time.time() - started_at)))
+    return report
@@ -0,0 +1,222 @@
+"""
+A fork server for running Python submissions.  This script is started with
+the interpreter configured for the task's language (see settings.BUILDERS),
+so it must work with both Python 2.7 and Python 3 and must not import
+anything outside the standard library.
+
+It preloads commonly used modules once, then reads requests, one JSON
+object per line, from its stdin.  For each request it forks a child that
+runs the given script as __main__ with stdin and stdout redirected and
+resource limits applied, waits for it, and writes a JSON line with the
+outcome and resource usage to its stdout.  A child that runs out of
+memory tells the server through a pipe of its own rather than with its
+exit status, which the script may set to any value.
+
+Request fields: script, cwd, env, stdin, stdout, time_limit (seconds),
+memory_limit (KB), output_limit (bytes, or null), wall_clock (bool).
+Response fields: status ('ok', 'error', 'time', 'memory' or 'output'),
+wall, user, sys (seconds) and mem (peak resident memory in KB).
+"""
+import os
+import sys
+import json
+import time
+import math
+import select
+import signal
+import resource
+import traceback
+
+# modules imported before forking, so that children do not pay for them
+PRELOADED_MODULES = [
+    'random', 're', 'string', 'collections', 'itertools', 'functools',
+    'operator', 'heapq', 'bisect', 'datetime', 'decimal', 'fractions',
+    'copy', 'io', 'codecs', 'encodings.utf_8', 'locale', 'array',
+    'statistics', 'typing',
+]
+
+# written by a child that ran out of memory to its status pipe
+MEMORY_ERROR_MARKER = b'm'
+
+# file descriptors of the protocol streams, closed in children
+protocol_fds = []
+
+
+def preload():
+    for name in PRELOADED_MODULES:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+
+
+def run_child(request, status_fd):
+    """
+    Runs in the forked child; never returns.
+    """
+    exit_code = 0
+    try:
+        for fd in protocol_fds:
+            os.close(fd)
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        # the interpreter ignores it, but a fresh process would not
+        signal.signal(signal.SIGXFSZ, signal.SIG_DFL)
+
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+
+        memory = request['memory_limit'] * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+        if not request['wall_clock']:
+            cpu = int(math.ceil(request['time_limit']))
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+        if request.get('output_limit'):
+            output = request['output_limit']
+            resource.setrlimit(resource.RLIMIT_FSIZE, (output, output))
+
+        stdin_fd = os.open(request['stdin'], os.O_RDONLY)
+        stdout_fd = os.open(request['stdout'],
+                            os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        os.dup2(stdin_fd, 0)
+        os.dup2(stdout_fd, 1)
+        os.close(stdin_fd)
+        os.close(stdout_fd)
+        sys.stdin = os.fdopen(0, 'r')
+        sys.stdout = os.fdopen(1, 'w')
+
+        # children must not share the server's random state
+        import random
+        random.seed()
+
+        script = request['script']
+        sys.argv = [script]
+        sys.path[0] = os.path.dirname(script)
+        main = type(sys)('__main__')
+        main.__file__ = script
+        main.__builtins__ = sys.modules['__main__'].__builtins__
+        sys.modules['__main__'] = main
+        with open(script, 'rb') as f:
+            code = compile(f.read(), script, 'exec', 0, True)
+        exec(code, main.__dict__)
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            sys.stderr.write('%s\n' % e.code)
+            exit_code = 1
+    except MemoryError:
+        try:
+            os.write(status_fd, MEMORY_ERROR_MARKER)
+        except OSError:
+            pass
+        exit_code = 1
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    except BaseException:
+        pass
+    os._exit(exit_code & 0xff)
+
+
+def serve_one(request):
+    start_time = time.time()
+    status_read_fd, status_write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(status_read_fd)
+        run_child(request, status_write_fd)
+    os.close(status_write_fd)
+
+    killed = [False]
+
+    def kill_child(signum, frame):
+        killed[0] = True
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    if request['wall_clock']:
+        wall_limit = request['time_limit']
+    else:
+        # CPU time is limited by RLIMIT_CPU; this only stops sleepers
+        wall_limit = request['time_limit'] * 3
+    signal.signal(signal.SIGALRM, kill_child)
+    signal.setitimer(signal.ITIMER_REAL, wall_limit)
+    while True:
+        try:
+            _, wait_status, rusage = os.wait4(pid, 0)
+            break
+        except OSError as e:
+            # python 2 does not retry interrupted system calls
+            if e.errno != 4:
+                raise
+    signal.setitimer(signal.ITIMER_REAL, 0)
+    wall_time = time.time() - start_time
+
+    # processes started by the script may still hold the pipe open
+    out_of_memory = False
+    if select.select([status_read_fd], [], [], 0)[0]:
+        out_of_memory = os.read(status_read_fd, 1) == MEMORY_ERROR_MARKER
+    os.close(status_read_fd)
+
+    if (killed[0] or
+            (os.WIFSIGNALED(wait_status) and
+             os.WTERMSIG(wait_status) == signal.SIGXCPU)):
+        status = 'time'
+    elif (os.WIFSIGNALED(wait_status) and
+          os.WTERMSIG(wait_status) == signal.SIGXFSZ):
+        status = 'output'
+    elif out_of_memory:
+        status = 'memory'
+    elif not os.WIFEXITED(wait_status):
+        status = 'error'
+    elif os.WEXITSTATUS(wait_status) != 0:
+        status = 'error'
+    else:
+        status = 'ok'
+
+    return {
+        'status': status,
+        'wall': wall_time,
+        'user': rusage.ru_utime,
+        'sys': rusage.ru_stime,
+        'mem': rusage.ru_maxrss,
+    }
+
+
+def main():
+    # keep the protocol streams away from fds 0 and 1, which children use
+    requests = os.fdopen(os.dup(0), 'r')
+    responses = os.fdopen(os.dup(1), 'w')
+    protocol_fds.extend([requests.fileno(), responses.fileno()])
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    os.dup2(2, 1)
+
+    preload()
+
+    while True:
+        line = requests.readline()
+        if not line:
+            break
+        request = json.loads(line)
+        try:
+            response = serve_one(request)
+        except Exception:
+            response = {'status': 'failed',
+                        'message': traceback.format_exc()}
+        responses.write(json.dumps(response) + '\n')
+        responses.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""
+Scratch space backends, i.e., where sandboxes create their temporary
+scratch dirs (see settings.SANDBOX_SCRATCH_BACKEND).
+
+* 'disk' puts every scratch dir under settings.SANDBOX_SCRATCH_DIR.
+
+* 'memory' puts them under settings.SANDBOX_MEMORY_SCRATCH_DIR, which
+  should be on a memory-backed filesystem (e.g., /dev/shm or a tmpfs
+  mounted for elab), to save the disk I/O of writing sources, inputs and
+  outputs of every evaluation.  Each grader process gets its own
+  subdirectory, whose size is capped by
+  settings.SANDBOX_MEMORY_SCRATCH_SIZE: when a new scratch dir might not
+  fit (the files already there plus the output limit of a program), it
+  is created on disk instead.  Copies of a scratch dir made for
+  evaluating test cases in parallel (see Sandbox.create_child) are
+  counted as well, each reserving the output limit until removed.
+"""
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+
+WORKER_DIR_PREFIX = 'worker-'
+
+
+class UnknownScratchBackend(Exception):
+    pass
+
+
+def get_dir_size(path):
+    """
+    Returns the total size in bytes of regular files under path.
+    """
+    size = 0
+    for root, dirs, filenames in os.walk(path):
+        for fname in filenames:
+            try:
+                size += os.lstat(os.path.join(root, fname)).st_size
+            except OSError:
+                # removed by another sandbox in the meantime
+                pass
+    return size
+
+
+def pid_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # e.g., it belongs to another user
+        pass
+    return True
+
+
+class DiskScratchSpace:
+
+    def __init__(self, scratch_dir):
+        self.scratch_dir = scratch_dir
+
+    def get_dir(self, reserve=0):
+        return self.scratch_dir
+
+    def make_child_dir(self, parent_dir, size, reserve=0):
+        return tempfile.mkdtemp(dir=parent_dir)
+
+    def release(self, path):
+        pass
+
+    def report(self):
+        return ''
+
+
+class MemoryScratchSpace:
+    """
+    Scratch space on a memory-backed filesystem, capped at max_size
+    bytes for this process, falling back to disk_dir.
+    """
+
+    def __init__(self, memory_dir, max_size, disk_dir):
+        self.memory_dir = memory_dir
+        self.max_size = max_size
+        self.disk_dir = disk_dir
+        self.worker_dir = os.path.join(memory_dir,
+                                       '%s%d' % (WORKER_DIR_PREFIX,
+                                                 os.getpid()))
+        self.memory_uses = 0
+        self.disk_uses = 0
+        self.peak_usage = 0
+        # output limits reserved by copies of scratch dirs, by path
+        self.reservations = {}
+        self.remove_stale_dirs()
+
+    def remove_stale_dirs(self):
+        """
+        Removes directories left over by grader processes that are gone.
+        """
+        try:
+            names = os.listdir(self.memory_dir)
+        except OSError:
+            return
+        for name in names:
+            if not name.startswith(WORKER_DIR_PREFIX):
+                continue
+            try:
+                pid = int(name[len(WORKER_DIR_PREFIX):])
+            except ValueError:
+                continue
+            if pid != os.getpid() and not pid_exists(pid):
+                shutil.rmtree(os.path.join(self.memory_dir, name),
+                              ignore_errors=True)
+
+    def get_usage(self):
+        """
+        Returns the number of bytes currently used (or reserved) by this
+        process.
+        """
+        return get_dir_size(self.worker_dir) + sum(self.reservations.values())
+
+    def fits(self, size):
+        usage = self.get_usage()
+        self.peak_usage = max(self.peak_usage, usage)
+        return usage + size <= self.max_size
+
+    def get_dir(self, reserve=0):
+        """
+        Returns the directory for a new scratch dir that may grow by
+        reserve bytes.
+        """
+        try:
+            os.makedirs(self.worker_dir, exist_ok=True)
+        except OSError:
+            self.disk_uses += 1
+            return self.disk_dir
+
+        if not self.fits(reserve):
+            self.disk_uses += 1
+            return self.disk_dir
+        self.memory_uses += 1
+        return self.worker_dir
+
+    def make_child_dir(self, parent_dir, size, reserve=0):
+        """
+        Creates an empty directory for a copy of size bytes of a scratch
+        dir in parent_dir, which may grow by reserve bytes, and returns its
+        path.  A copy in memory keeps its reservation until released.
+        """
+        if os.path.abspath(parent_dir) != os.path.abspath(self.worker_dir):
+            # not in memory
+            return tempfile.mkdtemp(dir=parent_dir)
+        if not self.fits(size + reserve):
+            self.disk_uses += 1
+            return tempfile.mkdtemp(dir=self.disk_dir)
+        self.memory_uses += 1
+        path = tempfile.mkdtemp(dir=self.worker_dir)
+        self.reservations[os.path.abspath(path)] = reserve
+        return path
+
+    def release(self, path):
+        """
+        Releases the reservation of the copy at path, if any.
+        """
+        self.reservations.pop(os.path.abspath(path), None)
+
+    def report(self):
+        return 'scratch: {} in memory (peak {:.1f} of {:.1f} MB), {} on disk'.format(
+            self.memory_uses,
+            self.peak_usage / (1024 * 1024),
+            self.max_size / (1024 * 1024),
+            self.disk_uses)
+
+
+_scratch_space = None
+
+
+def get_scratch_space():
+    """
+    Returns the scratch space of this process as configured in settings.
+    """
+    global _scratch_space
+    backend = getattr(settings, 'SANDBOX_SCRATCH_BACKEND', 'disk')
+    if backend not in ('disk', 'memory'):
+        raise UnknownScratchBackend(backend)
+    if backend == 'memory':
+        config = (backend,
+                  settings.SANDBOX_MEMORY_SCRATCH_DIR,
+                  settings.SANDBOX_MEMORY_SCRATCH_SIZE * 1024 * 1024,
+                  settings.SANDBOX_SCRATCH_DIR,
+                  os.getpid())
+    else:
+        config = (backend, settings.SANDBOX_SCRATCH_DIR)
+
+    # settings may change in tests, and forked graders need their own dirs
+    if _scratch_space is None or _scratch_space[0] != config:
+        if backend == 'memory':
+            space = MemoryScratchSpace(*config[1:4])
+        else:
+            space = DiskScratchSpace(settings.SANDBOX_SCRATCH_DIR)
+        _scratch_space = (config, space)
+    return _scratch_space[1]
+
+
+def get_scratch_dir():
+    """
+    Returns the directory in which a sandbox should create its temporary
+    scratch dir.
+    """
+    return get_scratch_space().get_dir(get_output_reserve())
+
+
+def get_output_reserve():
+    """
+    Returns how many bytes a program may write into a scratch dir.
+    """
+    if settings.DEFAULT_OUTPUT_LIMIT:
+        return settings.DEFAULT_OUTPUT_LIMIT * 1024 * 1024
+    return 0
+
+
+def make_child_scratch_dir(scratch_dir):
+    """
+    Creates an empty directory for a copy of scratch_dir (see
+    Sandbox.create_child) and returns its path.  It must be released with
+    release_child_scratch_dir() once removed.
+    """
+    return get_scratch_space().make_child_dir(
+            os.path.dirname(os.path.abspath(scratch_dir)),
+            get_dir_size(scratch_dir),
+            get_output_reserve())
+
+
+def release_child_scratch_dir(path):
+    get_scratch_space().release(path)
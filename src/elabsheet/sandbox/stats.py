@@ -0,0 +1,93 @@
+"""
+Resource usage and outcome of running an evaluated program.
+"""
+import os
+import re
+import signal
+
+# box's statistics line: wall, user and system times (seconds) and peak
+# memory (KB), see print_running_stat() in box.cc
+BOX_STAT_RE = re.compile(r'^([0-9.]+)r([0-9.]+)u([0-9.]+)s(-?[0-9]+)m$')
+
+# box limits the address space, so a program over the memory limit fails
+# to allocate instead of getting killed.  A failed run whose peak memory
+# (sampled by box) comes this close to the limit is reported as exceeding
+# it.
+MEMORY_LIMIT_THRESHOLD = 0.9
+
+
+class RunStats:
+    """
+    Times are in seconds and memory in kilobytes.
+    """
+    OK = 'ok'
+    ERROR = 'error'
+    TIME_LIMIT = 'time'
+    MEMORY_LIMIT = 'memory'
+    OUTPUT_LIMIT = 'output'
+
+    def __init__(self, status=OK, wall_time=0.0, user_time=0.0,
+                 system_time=0.0, memory=0):
+        self.status = status
+        self.wall_time = wall_time
+        self.user_time = user_time
+        self.system_time = system_time
+        self.memory = memory
+
+    def __repr__(self):
+        return 'RunStats(%r)' % self.to_dict()
+
+    def to_dict(self):
+        return {
+            'status': self.status,
+            'wall': round(self.wall_time, 4),
+            'user': round(self.user_time, 4),
+            'sys': round(self.system_time, 4),
+            'mem': self.memory,
+        }
+
+    @staticmethod
+    def from_box_output(output, memory_limit=None):
+        """
+        Parses the messages box writes to its stderr.  memory_limit (in
+        KB) is the limit given to box.
+        """
+        stats = RunStats(status=RunStats.ERROR)
+        for line in output.splitlines():
+            line = line.strip()
+            match = BOX_STAT_RE.match(line)
+            if match:
+                stats.wall_time = float(match.group(1))
+                stats.user_time = float(match.group(2))
+                stats.system_time = float(match.group(3))
+                stats.memory = int(match.group(4))
+            elif line == 'OK':
+                stats.status = RunStats.OK
+            elif line.startswith('Time limit exceeded'):
+                stats.status = RunStats.TIME_LIMIT
+            elif line.startswith('Output limit exceeded'):
+                stats.status = RunStats.OUTPUT_LIMIT
+
+        if (stats.status == RunStats.ERROR and memory_limit and
+                stats.memory >= memory_limit * MEMORY_LIMIT_THRESHOLD):
+            stats.status = RunStats.MEMORY_LIMIT
+        return stats
+
+    @staticmethod
+    def from_rusage(wait_status, rusage, wall_time):
+        """
+        Creates stats of a child process from its wait status and resource
+        usage (as returned by os.wait4).
+        """
+        if os.WIFEXITED(wait_status) and os.WEXITSTATUS(wait_status) == 0:
+            status = RunStats.OK
+        elif (os.WIFSIGNALED(wait_status) and
+              os.WTERMSIG(wait_status) == signal.SIGXFSZ):
+            status = RunStats.OUTPUT_LIMIT
+        else:
+            status = RunStats.ERROR
+        return RunStats(status=status,
+                        wall_time=wall_time,
+                        user_time=rusage.ru_utime,
+                        system_time=rusage.ru_stime,
+                        memory=rusage.ru_maxrss)
@@ -0,0 +1,195 @@
+"""
+Compare waiting times of submissions graded in submission order (FIFO)
+and in fair-share order (see lab/scheduling.py) by replaying a burst of
+submissions through simulated graders.
+
+By default, a synthetic burst is replayed: students of two sections
+submitting a few times each, one student submitting 30 times in 30
+seconds, and a section taking an exam.  With --since, submissions of the
+last specified number of seconds are replayed from the database instead,
+each taking as long to grade as it actually did.
+
+Waiting times are reported for all submissions, for the first submission
+of each user, for the heaviest submitter and for each section.  Fair
+share mostly shortens the waits of sections and users who submit little
+during the burst, at the expense of those who submit the most and of the
+longest waits overall, which submission order keeps shortest.  The fair
+share order uses the GRADER_FAIR_SHARE_* settings even when
+GRADER_FAIR_SHARE is off, so they can be tuned before enabling it.
+
+    python fair-share-benchmark.py [--graders N] [--since SECONDS]
+"""
+from django_bootstrap import bootstrap
+bootstrap()
+
+import random
+import argparse
+from django.conf import settings
+from lab.models import Submission
+from lab.scheduling import fair_order
+
+
+def synthetic_burst(seed, service):
+    """
+    Returns (arrival, user_id, section_id, service_time) tuples.
+    """
+    rnd = random.Random(seed)
+    jobs = []
+    user_id = 0
+    for section_id in (1, 2):
+        for i in range(30):
+            user_id += 1
+            for j in range(rnd.randint(1, 3)):
+                jobs.append((rnd.uniform(0, 600), user_id, section_id))
+    # one student submitting again and again
+    user_id += 1
+    for i in range(30):
+        jobs.append((60 + i, user_id, 1))
+    # an exam in section 3
+    for i in range(40):
+        user_id += 1
+        for j in range(3):
+            jobs.append((rnd.uniform(120, 420), user_id, 3))
+    return sorted((arrival, user, section, rnd.expovariate(1.0 / service))
+                  for arrival, user, section in jobs)
+
+
+def replayed_burst(seconds, service):
+    from django.utils import timezone
+    start = timezone.now() - timezone.timedelta(seconds=seconds)
+    submissions = (Submission.objects
+                   .filter(submitted_at__gte=start)
+                   .order_by('submitted_at'))
+    jobs = []
+    for s in submissions:
+        if s.start_grading_at is not None and s.graded_at is not None:
+            service_time = (s.graded_at - s.start_grading_at).total_seconds()
+        else:
+            service_time = service
+        jobs.append(((s.submitted_at - start).total_seconds(),
+                     s.user_id, s.section_id, service_time))
+    return jobs
+
+
+def simulate(jobs, graders, fair):
+    """
+    Returns the waiting time of every job, in job order, when graded by
+    the given number of graders, each claiming one job at a time.
+    """
+    window = settings.GRADER_FAIR_SHARE_WINDOW
+    history = settings.GRADER_FAIR_SHARE_HISTORY
+    max_wait = settings.GRADER_FAIR_SHARE_MAX_WAIT
+    weights = settings.GRADER_FAIR_SHARE_SECTION_WEIGHTS
+
+    free_at = [0.0] * graders
+    waits = [None] * len(jobs)
+    served = []   # (finish time, user, section)
+    queue = []    # indices of arrived jobs, in arrival order
+    arrived = 0
+    while arrived < len(jobs) or queue:
+        g = free_at.index(min(free_at))
+        now = free_at[g]
+        if not queue and jobs[arrived][0] > now:
+            now = jobs[arrived][0]
+        while arrived < len(jobs) and jobs[arrived][0] <= now:
+            queue.append(arrived)
+            arrived += 1
+
+        if fair:
+            user_served = {}
+            section_served = {}
+            for finish, user, section in served:
+                if finish >= now - history:
+                    user_served[user] = user_served.get(user, 0) + 1
+                    section_served[section] = section_served.get(section, 0) + 1
+            candidates = [(i, jobs[i][1], jobs[i][2], jobs[i][0])
+                          for i in queue[:window]]
+            chosen = fair_order(candidates, user_served, section_served,
+                                weights, now - max_wait)[0]
+        else:
+            chosen = queue[0]
+
+        queue.remove(chosen)
+        arrival, user, section, service_time = jobs[chosen]
+        waits[chosen] = now - arrival
+        free_at[g] = now + service_time
+        served.append((free_at[g], user, section))
+    return waits
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def get_groups(jobs):
+    """
+    Returns (name, job indices) pairs of the groups of jobs to report.
+    """
+    groups = [('all', list(range(len(jobs))))]
+    first = {}
+    for i, job in enumerate(jobs):
+        first.setdefault(job[1], i)
+    groups.append(('first of each user', sorted(first.values())))
+
+    counts = {}
+    for job in jobs:
+        counts[job[1]] = counts.get(job[1], 0) + 1
+    heaviest = max(counts, key=counts.get)
+    groups.append(('heaviest user',
+                   [i for i, job in enumerate(jobs) if job[1] == heaviest]))
+
+    sections = sorted(set(job[2] for job in jobs), key=str)
+    for section in sections:
+        groups.append(('section {}'.format(section),
+                       [i for i, job in enumerate(jobs) if job[2] == section]))
+    return groups
+
+
+def report(jobs, fifo_waits, fair_waits):
+    print('{:<22} {:>5}   {:>20}   {:>20}'.format(
+        '', 'count', 'fifo p50/p95/p99', 'fair p50/p95/p99'))
+    for name, indices in get_groups(jobs):
+        columns = []
+        for waits in (fifo_waits, fair_waits):
+            group_waits = [waits[i] for i in indices]
+            columns.append('{:6.1f} {:6.1f} {:6.1f}'.format(
+                percentile(group_waits, 50),
+                percentile(group_waits, 95),
+                percentile(group_waits, 99)))
+        print('{:<22} {:>5}   {:>20}   {:>20}'.format(
+            name, len(indices), *columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--graders', type=int, default=2,
+                        help='number of graders (default: 2)')
+    parser.add_argument('--service', type=float, default=3.0,
+                        help='mean grading time in seconds of synthetic '
+                             'submissions and of replayed submissions '
+                             'without timing (default: 3)')
+    parser.add_argument('--since', type=int, default=None,
+                        help='replay submissions of the last SECONDS '
+                             'seconds from the database')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed of the synthetic burst')
+    args = parser.parse_args()
+
+    if args.since is not None:
+        jobs = replayed_burst(args.since, args.service)
+    else:
+        jobs = synthetic_burst(args.seed, args.service)
+    if not jobs:
+        print('No submissions to replay')
+        return
+
+    print('{} submissions by {} users, {} graders; waiting times in seconds'.format(
+        len(jobs), len(set(job[1] for job in jobs)), args.graders))
+    report(jobs,
+           simulate(jobs, args.graders, False),
+           simulate(jobs, args.graders, True))
+
+
+if __name__ == '__main__':
+    main()
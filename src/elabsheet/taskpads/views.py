@@ -22,6 +22,7 @@ from .utils import make_result_explanation
 from cms.models import Task, Assignment
 from lab.models import Submission
 from lab.views import build_answer
+from grader.wakeup import notify_graders
 from logger.models import Log
 from commons.decorators import taskpads_required
 from commons.utils import get_remote_addr_from_request
@@ -370,10 +371,13 @@ def ajax_submit(request, post_key, participant_key):
         result_list = [r['passed'] for r in grading_results]
         submission.compiler_messages = messages
         submission.results = result_list
+        submission.stats = [r['stats'] for r in grading_results]
         submission.manual_scores = manual_grading_results
         submission.graded_at = datetime.now()
 
     submission.save()
+    if settings.SEPARATE_GRADING:
+        notify_graders()
 
     if not is_anonymous:
         Log.create("taskpads:submit", request,